@@ -0,0 +1,8 @@
+"""
+File __main__.py from project Project_Chess_Game
+
+"""
+
+from src.chesscli import main
+
+raise SystemExit(main())
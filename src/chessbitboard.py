@@ -0,0 +1,541 @@
+"""
+File chessbitboard.py from project Project_Chess_Game
+
+"""
+
+
+# Bitboard backed GameState: same API and moves as chessengine.GameState, but the position lives in 64 bit integers.
+# make_move/undo_move update the bitboards and write only the touched squares of the 8 x 8 board view, and move
+# generation and attack queries never walk the board list
+
+
+from src.chessengine import GameState, Move, MoveIndex, SQ_ROW_COL, DIRECTIONS, KNIGHT_OFFSETS, ENPASSANT_SQUARES, \
+    NO_ENPASSANT, STACK_PIECES, STACK_PIECE_INDEX, ZOBRIST_PIECES, ZOBRIST_BLACK_TO_MOVE, ZOBRIST_STATE
+from src.chessevaluation import PSQ_SCORES, PHASE_WEIGHTS
+
+# Square `sq = row * 8 + col`, bit `1 << sq`. Row 0 is rank 8, same as the board list
+# directions 0 - 3 are orthogonal, 4 - 7 are diagonal, same order as GameState.check_for_pins_and_checks
+
+FULL = (1 << 64) - 1
+
+# rays in a positive direction run towards higher square indices, so their first blocker is the lowest set bit
+POSITIVE_DIRECTIONS = tuple(d[0] * 8 + d[1] > 0 for d in DIRECTIONS)
+
+PIECES = ('wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK')
+
+
+def _offset_table(offsets):
+    table = []
+    for sq in range(64):
+        r, c = SQ_ROW_COL[sq]
+        bb = 0
+        for d_row, d_col in offsets:
+            if (0 <= r + d_row < 8) and (0 <= c + d_col < 8):
+                bb |= 1 << ((r + d_row) * 8 + c + d_col)
+        table.append(bb)
+    return table
+
+
+def _ray_tables():
+    rays = []
+    between = [[0] * 64 for _ in range(64)]
+    for d_row, d_col in DIRECTIONS:
+        dir_rays = []
+        for sq in range(64):
+            r, c = SQ_ROW_COL[sq]
+            bb = 0
+            for i in range(1, 8):
+                end_row = r + d_row * i
+                end_col = c + d_col * i
+                if not ((0 <= end_row < 8) and (0 <= end_col < 8)):
+                    break
+                end_sq = end_row * 8 + end_col
+                between[sq][end_sq] = bb  # squares strictly between sq and end_sq
+                bb |= 1 << end_sq
+            dir_rays.append(bb)
+        rays.append(dir_rays)
+    return rays, between
+
+
+KNIGHT_ATTACKS = _offset_table(KNIGHT_OFFSETS)
+KING_ATTACKS = _offset_table(DIRECTIONS)
+# squares attacked by a pawn of that color standing on sq
+PAWN_ATTACKS = {'w': _offset_table(((-1, -1), (-1, 1))), 'b': _offset_table(((1, -1), (1, 1)))}
+RAYS, BETWEEN = _ray_tables()
+
+# castling rights bits (see CastlingRights.get_bits) that survive a move from or to sq: a king or rook leaving its
+# home square, or a rook captured on it, clears the rights of that king or rook
+CASTLING_KEEP = [15] * 64
+CASTLING_KEEP[63] &= ~1  # h1, white king side
+CASTLING_KEEP[7] &= ~2  # h8, black king side
+CASTLING_KEEP[56] &= ~4  # a1, white queen side
+CASTLING_KEEP[0] &= ~8  # a8, black queen side
+CASTLING_KEEP[60] &= ~(1 | 4)  # e1
+CASTLING_KEEP[4] &= ~(2 | 8)  # e8
+
+
+def lsb_index(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+def ray_attacks(d, sq, occ):
+
+    """
+    squares attacked from sq in direction d, up to and including the first blocker
+    """
+
+    ray = RAYS[d][sq]
+    blockers = ray & occ
+    if blockers:
+        first = lsb_index(blockers) if POSITIVE_DIRECTIONS[d] else blockers.bit_length() - 1
+        ray ^= RAYS[d][first]
+    return ray
+
+
+def rook_attacks(sq, occ):
+    return ray_attacks(0, sq, occ) | ray_attacks(1, sq, occ) | ray_attacks(2, sq, occ) | ray_attacks(3, sq, occ)
+
+
+def bishop_attacks(sq, occ):
+    return ray_attacks(4, sq, occ) | ray_attacks(5, sq, occ) | ray_attacks(6, sq, occ) | ray_attacks(7, sq, occ)
+
+
+class BitboardGameState(GameState):
+
+    def __init__(self, fen=None):
+
+        """
+        - `bitboards` maps every piece name to a 64 bit int with a bit set per square it stands on
+        - `occupancy` maps `(w, b)` to the union of that side's bitboards
+        - `board` is a view for the UI and Move objects: make_move/undo_move only write the squares a move touches
+        """
+
+        super().__init__(fen)
+        self.sync_bitboards()
+
+    def set_position(self, board, whitetomove, castling_rights, enpassant_possible, halfmove_clock=0,
+                     fullmove_number=1):
+        super().set_position(board, whitetomove, castling_rights, enpassant_possible, halfmove_clock,
+                             fullmove_number)
+        self.sync_bitboards()
+
+    def sync_bitboards(self):
+
+        """
+        rebuild every bitboard from `board`, needed whenever the board list is replaced wholesale
+        """
+
+        self.bitboards = {piece: 0 for piece in PIECES}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.bitboards[piece] |= 1 << (r * 8 + c)
+
+    def make_move(self, move):
+
+        """
+        play `move`, the same bookkeeping as GameState.make_move done with square indices from `move.code`
+        """
+
+        code = move.code
+        start = code & 63
+        end = code >> 6 & 63
+        flags = code >> 12
+        moved = move.piece_moved
+        captured = move.piece_captured
+        color = moved[0]
+        board = self.board
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+
+        state = self.state_stack[self.ply]
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_STATE[state & 255] ^ ZOBRIST_PIECES[moved][start]
+        score = self.psq_score - PSQ_SCORES[moved][start]
+
+        bitboards[moved] ^= 1 << start
+        occupancy[color] ^= 1 << start | 1 << end
+        board[start >> 3][start & 7] = "--"
+
+        if captured != "--":
+            if flags == Move.ENPASSANT:
+                captured_sq = start & 56 | end & 7
+                board[start >> 3][end & 7] = "--"
+            else:
+                captured_sq = end
+            bitboards[captured] ^= 1 << captured_sq
+            occupancy[captured[0]] ^= 1 << captured_sq
+            key ^= ZOBRIST_PIECES[captured][captured_sq]
+            score -= PSQ_SCORES[captured][captured_sq]
+            self.phase -= PHASE_WEIGHTS[captured[1]]
+
+        placed = moved
+        if flags & Move.PROMOTION:
+            placed = color + Move.promotion_pieces[flags & 3]
+            self.phase += PHASE_WEIGHTS[placed[1]]
+        bitboards[placed] ^= 1 << end
+        board[end >> 3][end & 7] = placed
+        key ^= ZOBRIST_PIECES[placed][end]
+        score += PSQ_SCORES[placed][end]
+
+        if flags == Move.CASTLING:
+            if end > start:  # king side castle
+                rook_from, rook_to = end + 1, end - 1
+            else:  # queen side castle
+                rook_from, rook_to = end - 2, end + 1
+            rook = board[rook_from >> 3][rook_from & 7]
+            if rook != "--":
+                bitboards[rook] ^= 1 << rook_from | 1 << rook_to
+                occupancy[color] ^= 1 << rook_from | 1 << rook_to
+                board[rook_from >> 3][rook_from & 7] = "--"
+                board[rook_to >> 3][rook_to & 7] = rook
+                key ^= ZOBRIST_PIECES[rook][rook_from] ^ ZOBRIST_PIECES[rook][rook_to]
+                score += PSQ_SCORES[rook][rook_to] - PSQ_SCORES[rook][rook_from]
+
+        if moved == 'wK':
+            self.white_king_loc = SQ_ROW_COL[end]
+        elif moved == 'bK':
+            self.black_king_loc = SQ_ROW_COL[end]
+
+        self.movelog.append(move)
+        self.whitetomove = not self.whitetomove
+
+        # enpassant square, only kept when an enemy pawn can capture on it (see GameState.enpassant_capture_possible)
+        ep_file = NO_ENPASSANT
+        self.enpassant_possible = ()
+        if moved[1] == 'p':
+            if end - start == 16 or start - end == 16:
+                enemy_pawns = bitboards['bp' if color == 'w' else 'wp']
+                if PAWN_ATTACKS[color][(start + end) >> 1] & enemy_pawns:
+                    ep_file = start & 7
+                    self.enpassant_possible = ENPASSANT_SQUARES[self.whitetomove][ep_file]
+            self.halfmove_clock = 0
+        elif captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if color == 'b':
+            self.fullmove_number += 1
+
+        rights = state & 15 & CASTLING_KEEP[start] & CASTLING_KEEP[end]
+        if rights != state & 15:
+            self.current_castling_rights.set_bits(rights)
+
+        # push the new irreversible state, update zobrist key and repetition counts
+        self.ply += 1
+        if self.ply == len(self.state_stack):
+            self.grow_stacks()
+        state = rights | ep_file << 4 | STACK_PIECE_INDEX[captured] << 8 | self.halfmove_clock << 12
+        self.state_stack[self.ply] = state
+        self.zobrist_key = key ^ ZOBRIST_STATE[state & 255]
+        self.key_stack[self.ply] = self.zobrist_key
+        self.key_counts[self.zobrist_key] = self.key_counts.get(self.zobrist_key, 0) + 1
+        self.psq_score = score
+        self.score_stack[self.ply] = score
+
+    def undo_move(self):
+
+        """
+        take back the last move, the counterpart of make_move
+        """
+
+        if len(self.movelog) != 0:
+            move = self.movelog.pop()
+            code = move.code
+            start = code & 63
+            end = code >> 6 & 63
+            flags = code >> 12
+            moved = move.piece_moved
+            color = moved[0]
+            board = self.board
+            bitboards = self.bitboards
+            occupancy = self.occupancy
+            captured = STACK_PIECES[self.state_stack[self.ply] >> 8 & 15]
+
+            # remove the position from the repetition counts
+            count = self.key_counts[self.zobrist_key] - 1
+            if count:
+                self.key_counts[self.zobrist_key] = count
+            else:
+                del self.key_counts[self.zobrist_key]
+
+            placed = board[end >> 3][end & 7]
+            bitboards[placed] ^= 1 << end
+            bitboards[moved] ^= 1 << start
+            occupancy[color] ^= 1 << start | 1 << end
+            board[start >> 3][start & 7] = moved
+            board[end >> 3][end & 7] = "--"
+
+            if captured != "--":
+                captured_sq = start & 56 | end & 7 if flags == Move.ENPASSANT else end
+                bitboards[captured] ^= 1 << captured_sq
+                occupancy[captured[0]] ^= 1 << captured_sq
+                board[captured_sq >> 3][captured_sq & 7] = captured
+                self.phase += PHASE_WEIGHTS[captured[1]]
+            if flags & Move.PROMOTION:
+                self.phase -= PHASE_WEIGHTS[placed[1]]
+
+            if flags == Move.CASTLING:
+                if end > start:
+                    rook_from, rook_to = end + 1, end - 1
+                else:
+                    rook_from, rook_to = end - 2, end + 1
+                rook = board[rook_to >> 3][rook_to & 7]
+                if rook != "--":
+                    bitboards[rook] ^= 1 << rook_from | 1 << rook_to
+                    occupancy[color] ^= 1 << rook_from | 1 << rook_to
+                    board[rook_to >> 3][rook_to & 7] = "--"
+                    board[rook_from >> 3][rook_from & 7] = rook
+
+            if moved == 'wK':
+                self.white_king_loc = SQ_ROW_COL[start]
+            elif moved == 'bK':
+                self.black_king_loc = SQ_ROW_COL[start]
+
+            # restore castling rights, enpassant square, halfmove clock and zobrist key from the stack
+            self.whitetomove = not self.whitetomove
+            self.ply -= 1
+            state = self.state_stack[self.ply]
+            self.current_castling_rights.set_bits(state & 15)
+            ep_file = state >> 4 & 15
+            self.enpassant_possible = () if ep_file == NO_ENPASSANT else ENPASSANT_SQUARES[self.whitetomove][ep_file]
+            self.halfmove_clock = state >> 12
+            self.zobrist_key = self.key_stack[self.ply]
+            self.psq_score = self.score_stack[self.ply]
+            if color == 'b':
+                self.fullmove_number -= 1
+
+    def attackers_to(self, sq, color, occ):
+
+        """
+        bitboard of the pieces of `color` attacking square sq, sliders are blocked by `occ`
+        """
+
+        bb = self.bitboards
+        enemy = 'b' if color == 'w' else 'w'
+        return (PAWN_ATTACKS[enemy][sq] & bb[color + 'p']) | \
+            (KNIGHT_ATTACKS[sq] & bb[color + 'N']) | \
+            (KING_ATTACKS[sq] & bb[color + 'K']) | \
+            (rook_attacks(sq, occ) & (bb[color + 'R'] | bb[color + 'Q'])) | \
+            (bishop_attacks(sq, occ) & (bb[color + 'B'] | bb[color + 'Q']))
+
+    def sq_under_attack(self, r, c):
+
+        """
+        determine if the enemy can attack square r, c
+        """
+
+        enemy_color = 'b' if self.whitetomove else 'w'
+        return self.attackers_to(r * 8 + c, enemy_color, self.occupancy['w'] | self.occupancy['b']) != 0
+
+    def get_valid_moves(self, moves=None, indexed=False):
+
+        """
+        all moves considering checks, generated straight from the bitboards
+        - checkers and pinned pieces are found once, every piece is then limited to a mask of allowed squares
+        - `moves` can be a list to reuse as the output buffer, it is cleared first
+        - `indexed` returns a MoveIndex, for repeated lookups by square or move id
+        """
+
+        if self.whitetomove:
+            color, enemy_color = 'w', 'b'
+            king_row, king_col = self.white_king_loc
+        else:
+            color, enemy_color = 'b', 'w'
+            king_row, king_col = self.black_king_loc
+
+        own = self.occupancy[color]
+        opp = self.occupancy[enemy_color]
+        occ = own | opp
+        king_sq = king_row * 8 + king_col
+        board = self.board
+        if moves is None:
+            moves = []
+        else:
+            moves.clear()
+
+        checkers = self.attackers_to(king_sq, enemy_color, occ)
+        in_check = checkers != 0
+
+        # king moves, the king itself must not block attacks on the squares it steps back along
+        occ_without_king = occ ^ (1 << king_sq)
+        targets = KING_ATTACKS[king_sq] & ~own
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end_sq = bit.bit_length() - 1
+            if not self.attackers_to(end_sq, enemy_color, occ_without_king):
+                moves.append(Move((king_row, king_col), SQ_ROW_COL[end_sq], board))
+
+        if checkers & (checkers - 1) == 0:  # not in double check
+            check_mask, pin_masks = self.get_move_masks(enemy_color, own, occ, king_sq, checkers)
+            self.get_bitboard_piece_moves(color, own, occ, check_mask, pin_masks, moves)
+            self.get_bitboard_pawn_moves(color, opp, occ, check_mask, pin_masks, king_sq, moves)
+
+            if not in_check:
+                self.get_castle_moves(king_row, king_col, moves, in_check=False)
+
+        if len(moves) == 0:  # either checkmate or stalemate
+            if in_check:
+                self.check_mate = True
+            else:
+                self.stale_mate = True
+        else:
+            self.check_mate = False
+            self.stale_mate = False
+        self.draw_by_repetition = self.is_repetition()
+
+        if indexed:
+            return MoveIndex(moves)
+        return moves
+
+    def has_legal_move(self):
+
+        """
+        determine if the side to move has any legal move, with the masks of get_valid_moves
+        - king steps are tried one at a time, then the pieces and the pawns as a group each
+        - castling is never needed: it is only legal if the king's step towards the rook is legal too
+        """
+
+        if self.whitetomove:
+            color, enemy_color = 'w', 'b'
+            king_row, king_col = self.white_king_loc
+        else:
+            color, enemy_color = 'b', 'w'
+            king_row, king_col = self.black_king_loc
+
+        own = self.occupancy[color]
+        opp = self.occupancy[enemy_color]
+        occ = own | opp
+        king_sq = king_row * 8 + king_col
+
+        occ_without_king = occ ^ (1 << king_sq)
+        targets = KING_ATTACKS[king_sq] & ~own
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            if not self.attackers_to(bit.bit_length() - 1, enemy_color, occ_without_king):
+                return True
+
+        checkers = self.attackers_to(king_sq, enemy_color, occ)
+        if checkers & (checkers - 1):  # double check, only the king can move
+            return False
+        check_mask, pin_masks = self.get_move_masks(enemy_color, own, occ, king_sq, checkers)
+        moves = []
+        self.get_bitboard_piece_moves(color, own, occ, check_mask, pin_masks, moves)
+        if moves:
+            return True
+        self.get_bitboard_pawn_moves(color, opp, occ, check_mask, pin_masks, king_sq, moves)
+        return len(moves) != 0
+
+    def get_move_masks(self, enemy_color, own, occ, king_sq, checkers):
+
+        """
+        `(check_mask, pin_masks)` of the side to move when not in double check
+        - `check_mask`: squares a non king piece may move to, the checker and the squares between it and the king
+        - `pin_masks`: pinned pieces mapped to the squares between the king and the pinner (pinner included)
+        """
+
+        if checkers:
+            check_mask = BETWEEN[king_sq][lsb_index(checkers)] | checkers
+        else:
+            check_mask = FULL
+
+        bb = self.bitboards
+        pin_masks = {}
+        enemy_orthogonal = bb[enemy_color + 'R'] | bb[enemy_color + 'Q']
+        enemy_diagonal = bb[enemy_color + 'B'] | bb[enemy_color + 'Q']
+        for d in range(8):
+            ray = RAYS[d][king_sq]
+            if not ray & (enemy_orthogonal if d <= 3 else enemy_diagonal):
+                continue
+            blockers = ray & occ
+            if not blockers:
+                continue
+            first = lsb_index(blockers) if POSITIVE_DIRECTIONS[d] else blockers.bit_length() - 1
+            if not (1 << first) & own:
+                continue
+            beyond = RAYS[d][first] & occ
+            if not beyond:
+                continue
+            second = lsb_index(beyond) if POSITIVE_DIRECTIONS[d] else beyond.bit_length() - 1
+            if (1 << second) & (enemy_orthogonal if d <= 3 else enemy_diagonal):
+                pin_masks[first] = ray ^ RAYS[d][second]
+        return check_mask, pin_masks
+
+    def get_bitboard_piece_moves(self, color, own, occ, check_mask, pin_masks, moves):
+
+        """
+        knight, bishop, rook and queen moves limited to `check_mask` and any pin
+        """
+
+        bb = self.bitboards
+        board = self.board
+        for piece_type in ('N', 'B', 'R', 'Q'):
+            pieces = bb[color + piece_type]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                sq = bit.bit_length() - 1
+
+                if piece_type == 'N':
+                    if sq in pin_masks:  # a pinned knight can never move
+                        continue
+                    targets = KNIGHT_ATTACKS[sq]
+                elif piece_type == 'B':
+                    targets = bishop_attacks(sq, occ)
+                elif piece_type == 'R':
+                    targets = rook_attacks(sq, occ)
+                else:
+                    targets = bishop_attacks(sq, occ) | rook_attacks(sq, occ)
+
+                targets &= ~own & check_mask & pin_masks.get(sq, FULL)
+                start = SQ_ROW_COL[sq]
+                while targets:
+                    end_bit = targets & -targets
+                    targets ^= end_bit
+                    moves.append(Move(start, SQ_ROW_COL[end_bit.bit_length() - 1], board))
+
+    def get_bitboard_pawn_moves(self, color, opp, occ, check_mask, pin_masks, king_sq, moves):
+
+        """
+        pawn pushes, captures and enpassant limited to `check_mask` and any pin
+        """
+
+        board = self.board
+        step, start_row = (-8, 6) if color == 'w' else (8, 1)
+        ep_bit = 0
+        if self.enpassant_possible != ():
+            ep_bit = 1 << (self.enpassant_possible[0] * 8 + self.enpassant_possible[1])
+
+        pawns = self.bitboards[color + 'p']
+        while pawns:
+            bit = pawns & -pawns
+            pawns ^= bit
+            sq = bit.bit_length() - 1
+            start = SQ_ROW_COL[sq]
+            allowed = check_mask & pin_masks.get(sq, FULL)
+
+            one = sq + step
+            if not (1 << one) & occ:  # 1 sq pawn advance
+                if (1 << one) & allowed:
+                    self.add_pawn_move(start, SQ_ROW_COL[one], moves)
+                two = one + step
+                if start[0] == start_row and not (1 << two) & occ and (1 << two) & allowed:  # 2 sq pawn advance
+                    moves.append(Move(start, SQ_ROW_COL[two], board))
+
+            attacks = PAWN_ATTACKS[color][sq]
+            captures = attacks & opp & allowed
+            while captures:
+                end_bit = captures & -captures
+                captures ^= end_bit
+                self.add_pawn_move(start, SQ_ROW_COL[end_bit.bit_length() - 1], moves)
+
+            if attacks & ep_bit:
+                ep_sq = ep_bit.bit_length() - 1
+                captured_bit = 1 << (ep_sq - step)
+                # play the capture out on the occupancy, both pawns leave the rank so pins alone are not enough
+                new_occ = occ ^ bit ^ ep_bit ^ captured_bit
+                enemy_color = 'b' if color == 'w' else 'w'
+                if not self.attackers_to(king_sq, enemy_color, new_occ) & ~captured_bit:
+                    moves.append(Move(start, SQ_ROW_COL[ep_sq], board, is_enpassant_move=True))
@@ -0,0 +1,232 @@
+"""
+File chesscli.py from project Project_Chess_Game
+
+"""
+
+
+# Headless command line entry point: perft, search and FEN analysis without ever importing pygame.
+# Run with `python -m src <command>`, the GUI stays at `python -m src.chessmain`
+
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from src.chessengine import GameState, START_FEN
+from src.chessbitboard import BitboardGameState
+from src.chessevaluation import evaluate
+
+BACKENDS = {'mailbox': GameState, 'bitboard': BitboardGameState}
+
+
+def fen_argument(text):
+
+    """
+    argparse type of FEN arguments, a malformed FEN is reported like any other bad argument
+    """
+
+    try:
+        GameState(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+
+def cmd_perft(args):
+    from src import chessperft
+    argv = ['--fen', args.fen, '--depth', str(args.depth), '--backend', args.backend, '--tt-mb', str(args.tt_mb)]
+    if args.divide:
+        argv.append('--divide')
+    if args.suite:
+        argv.append('--suite')
+    return chessperft.main(argv)
+
+
+def cmd_search(args):
+    from src import chesssearch
+
+    gs = BACKENDS[args.backend](args.fen)
+
+    if args.book:
+        from src import chessbook
+        with chessbook.OpeningBook(args.book) as book:
+            move = book.choose_move(gs)
+        if move is not None:
+            print("bestmove %s (book)" % move.get_chess_notation())
+            return 0
+
+    def info(result):
+        print("info depth %d score %d nodes %d nps %d pv %s" % (result.depth, result.score, result.nodes, result.nps,
+                                                                result.get_pv_notation()))
+
+    result = chesssearch.Search(gs).search(max_depth=args.depth, time_limit=args.time, node_limit=args.nodes,
+                                           info=info)
+    print("bestmove %s" % (result.best_move.get_chess_notation() if result.best_move else '(none)'))
+    return 0
+
+
+def cmd_fen(args):
+
+    """
+    print what the engine knows about a position
+    """
+
+    gs = BACKENDS[args.backend](args.fen)
+    moves = gs.get_valid_moves()
+    print("fen %s" % gs.get_fen())
+    print("key %016x" % gs.zobrist_key)
+    print("check %s" % gs.in_check())
+    print("eval %d" % evaluate(gs))
+    print("status %s" % gs.get_status())
+    print("moves %d: %s" % (len(moves), ' '.join(sorted(move.get_chess_notation() for move in moves))))
+    return 0
+
+
+def cmd_pgn(args):
+    from src import chesspgn
+    return chesspgn.main(args.paths + ['--workers', str(args.workers)])
+
+
+STARTUP_COMMANDS = {
+    'python': "pass",
+    'headless': "import src.chessengine",
+    'cli': "import src.chesscli",
+    'gui': "import src.chessmain; src.chessmain.load_pygame()",
+}
+
+
+def measure_startup(code, runs=10):
+
+    """
+    median wall time in ms of a fresh interpreter running `code`, `None` if it fails
+    """
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-c', code], capture_output=True)
+        if completed.returncode != 0:
+            return None
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+BENCH_PIECES = {'p': 'pawn', 'N': 'knight', 'B': 'bishop', 'R': 'rook', 'Q': 'queen', 'K': 'king'}
+
+
+def bench_generators(fens, repeat=100):
+
+    """
+    microseconds per call of each piece move generator, sq_under_attack and get_valid_moves over positions `fens`
+    - generators run on every piece of that type of the side to move, sq_under_attack on every square
+    - returns `{name: microseconds}`, names without a single call are left out
+    """
+
+    states = [GameState(fen) for fen in fens]
+    moves = []
+
+    def time_calls(calls):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for call in calls:
+                call()
+        return (time.perf_counter() - start) / (repeat * len(calls)) * 1e6
+
+    def generator_call(generate, r, c):
+        def call():
+            moves.clear()
+            generate(r, c, moves)
+        return call
+
+    results = {}
+    for piece_type, name in BENCH_PIECES.items():
+        calls = [generator_call(gs.move_functions[piece_type], r, c) for gs in states
+                 for r in range(8) for c in range(8) if gs.board[r][c] == ('w' if gs.whitetomove else 'b') + piece_type]
+        if calls:
+            results[name] = time_calls(calls)
+    results['sq_under_attack'] = time_calls([(lambda gs=gs, r=r, c=c: gs.sq_under_attack(r, c))
+                                             for gs in states for r in range(8) for c in range(8)])
+    results['get_valid_moves'] = time_calls([(lambda gs=gs: gs.get_valid_moves(moves)) for gs in states])
+    return results
+
+
+def cmd_bench(args):
+    from src.chessperft import REFERENCE_POSITIONS
+    fens = args.fen or [fen for _, fen, _ in REFERENCE_POSITIONS]
+    for name, us in bench_generators(fens, args.repeat).items():
+        print("%-16s %8.2f us/call" % (name, us))
+    return 0
+
+
+def cmd_profile(args):
+    from src import chessprofile
+    argv = [args.mode, '--depth', str(args.depth), '--backend', args.backend, '--cprofile', str(args.cprofile)]
+    for fen in args.fen or ():
+        argv += ['--fen', fen]
+    return chessprofile.main(argv)
+
+
+def cmd_startup(args):
+    for name, code in STARTUP_COMMANDS.items():
+        ms = measure_startup(code, args.runs)
+        print("%-10s %s" % (name, "%.1f ms" % ms if ms is not None else "failed (pygame missing?)"))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src', description="headless chess engine tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    perft = commands.add_parser('perft', help="count move tree leaves")
+    perft.add_argument('--fen', type=fen_argument, default=START_FEN)
+    perft.add_argument('--depth', type=int, default=3)
+    perft.add_argument('--divide', action='store_true')
+    perft.add_argument('--suite', action='store_true')
+    perft.add_argument('--tt-mb', type=int, default=0)
+    perft.set_defaults(run=cmd_perft)
+
+    search = commands.add_parser('search', help="search a position for the best move")
+    search.add_argument('--fen', type=fen_argument, default=START_FEN)
+    search.add_argument('--depth', type=int, default=64)
+    search.add_argument('--time', type=float, default=None, help="seconds")
+    search.add_argument('--nodes', type=int, default=None)
+    search.add_argument('--book', default=None, help="Polyglot book built by chessbook, tried before searching")
+    search.set_defaults(run=cmd_search)
+
+    fen = commands.add_parser('fen', help="legal moves and status of a position")
+    fen.add_argument('fen', nargs='?', type=fen_argument, default=START_FEN)
+    fen.set_defaults(run=cmd_fen)
+
+    pgn = commands.add_parser('pgn', help="replay and validate PGN files")
+    pgn.add_argument('paths', nargs='+')
+    pgn.add_argument('--workers', type=int, default=1)
+    pgn.set_defaults(run=cmd_pgn)
+
+    bench = commands.add_parser('bench', help="time the move generators per call")
+    bench.add_argument('--fen', action='append', type=fen_argument, help="position to time on, repeatable, defaults to the perft suite")
+    bench.add_argument('--repeat', type=int, default=100)
+    bench.set_defaults(run=cmd_bench)
+
+    profile = commands.add_parser('profile', help="hot path counters and generator times per position")
+    profile.add_argument('mode', choices=('perft', 'search'))
+    profile.add_argument('--fen', action='append', type=fen_argument, help="position to run, repeatable, defaults to the perft suite")
+    profile.add_argument('--depth', type=int, default=3)
+    profile.add_argument('--cprofile', type=int, default=0, metavar='N',
+                         help="also record the runs with cProfile and print its N most expensive functions")
+    profile.set_defaults(run=cmd_profile)
+
+    startup = commands.add_parser('startup', help="measure interpreter startup of the headless and GUI entry points")
+    startup.add_argument('--runs', type=int, default=10)
+    startup.set_defaults(run=cmd_startup)
+
+    for command in (perft, search, fen, profile):
+        command.add_argument('--backend', choices=sorted(BACKENDS), default='mailbox')
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
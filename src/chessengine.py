@@ -8,15 +8,95 @@ Built using PyCharm
 
 # Responsible for storing all information about current state of game and determine all valid moves with movelog
 
+import random
+from array import array
+
+from src.chessevaluation import PSQ_SCORES, PHASE_WEIGHTS, compute_psq_score
+
+# Zobrist keys, one random 64 bit number per (piece, square), side, castling right and enpassant file.
+# Seeded so every process hashes the same position to the same key
+
+_zobrist_random = random.Random(20200720)
+ZOBRIST_PIECES = {piece: [_zobrist_random.getrandbits(64) for _ in range(64)]
+                  for piece in ('wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK')}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = {'wks': _zobrist_random.getrandbits(64), 'bks': _zobrist_random.getrandbits(64),
+                    'wqs': _zobrist_random.getrandbits(64), 'bqs': _zobrist_random.getrandbits(64)}
+ZOBRIST_ENPASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
+
+# Undo stack records, one 64 bit word per ply
+# - bits 0 - 3: castling rights `wks | bks << 1 | wqs << 2 | bqs << 3`
+# - bits 4 - 7: enpassant file, `NO_ENPASSANT` if there is none
+# - bits 8 - 11: index of the piece captured by the move into the position in `STACK_PIECES`
+# - bits 12 - 43: halfmove clock
+NO_ENPASSANT = 8
+STACK_PIECES = ('--', 'wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK')
+STACK_PIECE_INDEX = {piece: i for i, piece in enumerate(STACK_PIECES)}
+UNDO_STACK_SIZE = 512  # plies, the stack doubles when a game gets longer
+
+# zobrist key of the castling and enpassant bits (0 - 7) of a record
+ZOBRIST_STATE = [(ZOBRIST_CASTLING['wks'] if bits & 1 else 0) ^ (ZOBRIST_CASTLING['bks'] if bits & 2 else 0) ^
+                 (ZOBRIST_CASTLING['wqs'] if bits & 4 else 0) ^ (ZOBRIST_CASTLING['bqs'] if bits & 8 else 0) ^
+                 (ZOBRIST_ENPASSANT[bits >> 4] if bits >> 4 < NO_ENPASSANT else 0)
+                 for bits in range(NO_ENPASSANT << 4 | 16)]
+
+# enpassant squares by file, indexed by the side to move (black to move: row 5, white to move: row 2)
+ENPASSANT_SQUARES = (tuple((5, c) for c in range(8)), tuple((2, c) for c in range(8)))
+
+# Move tables, built once at import (about a millisecond). Square `sq = row * 8 + col`, entries are
+# `(row, col)` tuples so they can go straight into Move. Directions 0 - 3 are orthogonal, 4 - 7 diagonal
+
+SQ_ROW_COL = tuple((sq // 8, sq % 8) for sq in range(64))
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2))
+
+
+def _target_squares(offsets):
+    return tuple(tuple((r + d_row, c + d_col) for d_row, d_col in offsets if 0 <= r + d_row < 8 and 0 <= c + d_col < 8)
+                 for r, c in SQ_ROW_COL)
+
+
+def _ray_squares(d_row, d_col):
+    rays = []
+    for r, c in SQ_ROW_COL:
+        ray = []
+        while 0 <= r + d_row * (len(ray) + 1) < 8 and 0 <= c + d_col * (len(ray) + 1) < 8:
+            ray.append((r + d_row * (len(ray) + 1), c + d_col * (len(ray) + 1)))
+        rays.append(tuple(ray))
+    return tuple(rays)
+
+
+KNIGHT_SQUARES = _target_squares(KNIGHT_OFFSETS)
+KING_SQUARES = _target_squares(DIRECTIONS)
+# RAY_SQUARES[d][sq]: squares from sq outwards in direction d, nearest first
+RAY_SQUARES = tuple(_ray_squares(d_row, d_col) for d_row, d_col in DIRECTIONS)
+# the non empty rays of a square per slider
+ROOK_RAYS = tuple(tuple(RAY_SQUARES[d][sq] for d in range(4) if RAY_SQUARES[d][sq]) for sq in range(64))
+BISHOP_RAYS = tuple(tuple(RAY_SQUARES[d][sq] for d in range(4, 8) if RAY_SQUARES[d][sq]) for sq in range(64))
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# FEN castling letter to the row of its king and the column of its rook
+CASTLING_SQUARES = {'K': (7, 7), 'Q': (7, 0), 'k': (0, 7), 'q': (0, 0)}
+
+# the halfmove clock has 32 bits of the undo stack records, FEN move counters are limited to that range
+MAX_HALFMOVE_CLOCK = (1 << 32) - 1
+
+# FEN piece letters
+FEN_PIECES = {'P': 'wp', 'R': 'wR', 'N': 'wN', 'B': 'wB', 'Q': 'wQ', 'K': 'wK',
+              'p': 'bp', 'r': 'bR', 'n': 'bN', 'b': 'bB', 'q': 'bQ', 'k': 'bK'}
+PIECES_FEN = {v: k for k, v in FEN_PIECES.items()}
+
 
 class GameState:
 
-    def __init__(self):
+    def __init__(self, fen=None):
 
         """
         - board is an `8 x 8` 2d list, each element has 2 chars
         - first char: color `(w, b)`
         - second char: type `(K, Q, B, N, R, p)`
+        - `fen` sets up another position than the start position
         """
 
         self.board = [
@@ -30,40 +110,440 @@ class GameState:
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
         ]
 
-        self.move_functions = {'p': self.get_pawn_moves,
-                               'R': self.get_rook_moves,
-                               'N': self.get_knight_moves,
-                               'B': self.get_bishop_moves,
-                               'K': self.get_king_moves,
-                               'Q': self.get_queen_moves}
+        self.move_functions = {}
+        self.bind_move_functions()
 
         self.whitetomove = True
-        self.movelog = []
+
+        # fifty move rule clock (plies since the last capture or pawn move) and the FEN move number
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
 
         # tracking king
         self.white_king_loc = (7, 4)
         self.black_king_loc = (0, 4)
 
+        # square sets of both sides, bit `row * 8 + col` set for every square a piece of that color stands on
+        self.occupancy = {'w': 0, 'b': 0}
+        self.sync_occupancy()
+
         self.check_mate = False
         self.stale_mate = False
+        self.draw_by_repetition = False
+
+        # pins and checks against the king of the side to move, only set while generating valid moves
+        self.pins = []
+        self.checks = []
 
         # enpassant
         self.enpassant_possible = ()
 
         # Castling rights
         self.current_castling_rights = CastlingRights(True, True, True, True)
-        self.castle_rights_log = [CastlingRights(self.current_castling_rights.wks,
-                                                 self.current_castling_rights.bks,
-                                                 self.current_castling_rights.wqs,
-                                                 self.current_castling_rights.bqs)]
+
+        self.start_logs()
+
+        if fen is not None:
+            self.load_fen(fen)
+
+    def start_logs(self):
+
+        """
+        (re)start the move log and everything make_move/undo_move track from the current position
+        """
+
+        self.movelog = []
+
+        # preallocated undo stack indexed by ply: a packed record of the irreversible state of every position
+        # (see STACK_PIECES) and its zobrist key, make_move/undo_move only overwrite entries
+        self.ply = 0
+        self.state_stack = array('Q', bytes(8 * UNDO_STACK_SIZE))
+        self.key_stack = array('Q', bytes(8 * UNDO_STACK_SIZE))
+        self.state_stack[0] = self.pack_state("--")
+
+        # packed material and piece-square score (see chessevaluation) and game phase, kept up to date by
+        # make_move and undo_move, the score of every ply is stacked next to its key
+        self.psq_score, self.phase = compute_psq_score(self.board)
+        self.score_stack = array('q', bytes(8 * UNDO_STACK_SIZE))
+        self.score_stack[0] = self.psq_score
+
+        # position hash, plus how often every position was reached so repetitions can be counted in O(1)
+        self.zobrist_key = self.compute_zobrist_key()
+        self.key_stack[0] = self.zobrist_key
+        self.key_counts = {self.zobrist_key: 1}
+
+    def load_fen(self, fen):
+
+        """
+        set up the position of a FEN string, missing trailing fields default to `w - - 0 1`
+        - the board list is filled in place, so loading many positions into one game state allocates no new board
+        - raises ValueError, leaving the position as it was, for a malformed FEN, a side without exactly one king or
+          move counters out of range; castling rights without their king and rook at home are dropped
+        """
+
+        fields = fen.split()
+        if not fields:
+            raise ValueError("empty FEN")
+
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError("FEN %r does not have 8 ranks" % fen)
+        placement = []  # validate everything before touching the board
+        for rank in ranks:
+            row = []
+            for char in rank:
+                if char in '12345678':
+                    row.extend(["--"] * int(char))
+                elif char in FEN_PIECES:
+                    row.append(FEN_PIECES[char])
+                else:
+                    raise ValueError("invalid piece %r in FEN %r" % (char, fen))
+            if len(row) != 8:
+                raise ValueError("rank %r in FEN %r is not 8 squares" % (rank, fen))
+            placement.append(row)
+        for king in ('wK', 'bK'):
+            kings = sum(row.count(king) for row in placement)
+            if kings != 1:
+                raise ValueError("FEN %r has %d %s kings, expected one" % (
+                    fen, kings, 'white' if king == 'wK' else 'black'))
+
+        side = fields[1] if len(fields) > 1 else 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        enpassant = fields[3] if len(fields) > 3 else '-'
+        if side not in ('w', 'b'):
+            raise ValueError("invalid side to move %r in FEN %r" % (side, fen))
+        if castling != '-' and (not set(castling) <= set('KQkq') or len(set(castling)) != len(castling)):
+            raise ValueError("invalid castling rights %r in FEN %r" % (castling, fen))
+        if enpassant == '-':
+            enpassant_possible = ()
+        elif len(enpassant) == 2 and enpassant[0] in Move.files_cols and enpassant[1] == ('6' if side == 'w' else '3'):
+            enpassant_possible = ENPASSANT_SQUARES[side == 'w'][Move.files_cols[enpassant[0]]]
+        else:
+            raise ValueError("invalid enpassant square %r in FEN %r" % (enpassant, fen))
+        try:
+            halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("invalid move counters in FEN %r" % fen)
+        if not 0 <= halfmove_clock <= MAX_HALFMOVE_CLOCK or not 1 <= fullmove_number <= MAX_HALFMOVE_CLOCK:
+            raise ValueError("move counters out of range in FEN %r" % fen)
+
+        # a right only stands with the king and that rook still on their home squares
+        rights = {}
+        for char, (r, rook_col) in CASTLING_SQUARES.items():
+            color = 'w' if char.isupper() else 'b'
+            rights[char] = char in castling and placement[r][4] == color + 'K' and \
+                placement[r][rook_col] == color + 'R'
+
+        board = self.board
+        for r in range(8):
+            board[r][:] = placement[r]
+
+        self.set_position(board, side == 'w', CastlingRights(rights['K'], rights['k'], rights['Q'], rights['q']),
+                          enpassant_possible, halfmove_clock, fullmove_number)
+
+    def get_fen(self):
+
+        """
+        FEN string of the current position, including castling rights, enpassant square and move counters
+        """
+
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                else:
+                    if empty:
+                        rank += str(empty)
+                        empty = 0
+                    rank += PIECES_FEN[piece]
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+
+        rights = self.current_castling_rights
+        castling = ('K' if rights.wks else '') + ('Q' if rights.wqs else '') + \
+                   ('k' if rights.bks else '') + ('q' if rights.bqs else '')
+        if self.enpassant_possible == ():
+            enpassant = '-'
+        else:
+            enpassant = Move.cols_files[self.enpassant_possible[1]] + Move.rows_ranks[self.enpassant_possible[0]]
+
+        return "%s %s %s %s %d %d" % ('/'.join(ranks), 'w' if self.whitetomove else 'b', castling or '-', enpassant,
+                                      self.halfmove_clock, self.fullmove_number)
+
+    def set_position(self, board, whitetomove, castling_rights, enpassant_possible, halfmove_clock=0,
+                     fullmove_number=1):
+
+        """
+        replace the whole position, clearing the move log
+        - every way of setting up a position (FEN, snapshots) goes through here
+        """
+
+        self.board = board
+        self.whitetomove = whitetomove
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == 'wK':
+                    self.white_king_loc = (r, c)
+                elif board[r][c] == 'bK':
+                    self.black_king_loc = (r, c)
+
+        self.current_castling_rights = castling_rights
+        self.enpassant_possible = enpassant_possible if self.enpassant_capture_possible(enpassant_possible) else ()
+        self.sync_occupancy()
+
+        self.check_mate = False
+        self.stale_mate = False
+        self.draw_by_repetition = False
+        self.start_logs()
+
+    def sync_occupancy(self):
+
+        """
+        rebuild the square sets from `board`, make_move and undo_move keep them up to date after that
+        """
+
+        occupancy = {'w': 0, 'b': 0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    occupancy[piece[0]] |= 1 << (r * 8 + c)
+        self.occupancy = occupancy
+
+    def snapshot(self):
+
+        """
+        compact, picklable copy of the position and its repetition history (not the move log)
+        - `(board string, whitetomove, castling rights, enpassant square, halfmove clock, fullmove number,
+          zobrist key history)`
+        """
+
+        rights = self.current_castling_rights
+        return (''.join(''.join(row) for row in self.board), self.whitetomove,
+                (rights.wks, rights.bks, rights.wqs, rights.bqs), self.enpassant_possible,
+                self.halfmove_clock, self.fullmove_number, tuple(self.get_key_history()))
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+
+        """
+        rebuild a game state from `snapshot()`, e.g. in a worker process
+        """
+
+        board_string, whitetomove, rights, enpassant_possible, halfmove_clock, fullmove_number, key_history = snapshot
+        board = [[board_string[i:i + 2] for i in range(r * 16, r * 16 + 16, 2)] for r in range(8)]
+
+        gs = cls()
+        gs.set_position(board, whitetomove, CastlingRights(*rights), enpassant_possible, halfmove_clock,
+                        fullmove_number)
+        gs.set_key_history(key_history)
+        return gs
+
+    def get_key_history(self):
+
+        """
+        zobrist keys of every position reached, oldest first and ending with the current one
+        """
+
+        return self.key_stack[:self.ply + 1].tolist()
+
+    def set_key_history(self, key_history):
+
+        """
+        take over the positions reached before the current one (e.g. from a snapshot) for repetition counting
+        - only valid right after set_position, the earlier positions cannot be undone into
+        """
+
+        state = self.state_stack[self.ply]
+        while len(self.key_stack) < len(key_history):
+            self.grow_stacks()
+        self.ply = len(key_history) - 1
+        self.key_stack[:self.ply + 1] = array('Q', key_history)
+        self.state_stack[self.ply] = state
+        self.score_stack[self.ply] = self.psq_score
+        self.key_counts = {}
+        for key in key_history:
+            self.key_counts[key] = self.key_counts.get(key, 0) + 1
+
+    def grow_stacks(self):
+        self.state_stack.extend(self.state_stack)
+        self.key_stack.extend(self.key_stack)
+        self.score_stack.extend(self.score_stack)
+
+    def pack_state(self, piece_captured):
+
+        """
+        undo stack record of the current position, `piece_captured` by the move that led to it
+        """
+
+        ep = self.enpassant_possible
+        return self.current_castling_rights.get_bits() | (ep[1] if ep != () else NO_ENPASSANT) << 4 | \
+            STACK_PIECE_INDEX[piece_captured] << 8 | self.halfmove_clock << 12
+
+    def bind_move_functions(self):
+
+        """
+        piece type to move generator dispatch, bound to this game state
+        """
+
+        self.move_functions = {'p': self.get_pawn_moves,
+                               'R': self.get_rook_moves,
+                               'N': self.get_knight_moves,
+                               'B': self.get_bishop_moves,
+                               'K': self.get_king_moves,
+                               'Q': self.get_queen_moves}
+
+    def __getstate__(self):
+
+        """
+        pickle without the bound method dispatch table, it is rebuilt on load
+        """
+
+        state = self.__dict__.copy()
+        del state['move_functions']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.bind_move_functions()
+
+    def compute_zobrist_key(self):
+
+        """
+        hash the whole position from scratch, make_move and undo_move keep `zobrist_key` equal to this
+        """
+
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][r * 8 + c]
+        if not self.whitetomove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ self.castling_enpassant_key()
+
+    def castling_enpassant_key(self):
+
+        """
+        part of the zobrist key coming from castling rights and the enpassant square
+        """
+
+        ep = self.enpassant_possible
+        return ZOBRIST_STATE[self.current_castling_rights.get_bits() | (ep[1] if ep != () else NO_ENPASSANT) << 4]
+
+    def is_repetition(self, count=3):
+
+        """
+        determine if the current position has been reached `count` times
+        """
+
+        return self.key_counts.get(self.zobrist_key, 0) >= count
+
+    def is_fifty_move_draw(self):
+
+        """
+        determine if fifty moves of each side have passed without a capture or pawn move
+        """
+
+        return self.halfmove_clock >= 100
+
+    def is_insufficient_material(self):
+
+        """
+        determine if neither side can ever checkmate: bare kings, a single knight or bishop, or only bishops all
+        standing on squares of one color
+        - stops at the first pawn, rook or queen, so it is cheap in any position that still has one
+        """
+
+        board = self.board
+        knights = 0
+        bishop_colors = set()
+        squares = self.occupancy['w'] | self.occupancy['b']
+        while squares:
+            bit = squares & -squares
+            squares ^= bit
+            r, c = SQ_ROW_COL[bit.bit_length() - 1]
+            piece_type = board[r][c][1]
+            if piece_type == 'N':
+                knights += 1
+            elif piece_type == 'B':
+                bishop_colors.add((r + c) & 1)
+            elif piece_type != 'K':  # pawn, rook or queen
+                return False
+        if knights == 0:
+            return len(bishop_colors) <= 1
+        return knights == 1 and not bishop_colors
+
+    def get_status(self):
+
+        """
+        terminal status of the position without generating every move, one of 'checkmate', 'stalemate',
+        'fifty moves', 'repetition', 'insufficient material' or 'active'
+        - a mate delivered on the hundredth halfmove or third repetition still counts as checkmate
+        - leaves the game over flags alone, they still describe the last get_valid_moves call
+        """
+
+        if not self.has_legal_move():
+            return 'checkmate' if self.in_check() else 'stalemate'
+        if self.is_fifty_move_draw():
+            return 'fifty moves'
+        if self.is_repetition():
+            return 'repetition'
+        if self.is_insufficient_material():
+            return 'insufficient material'
+        return 'active'
+
+    def enpassant_capture_possible(self, enpassant_possible):
+
+        """
+        determine if a pawn of the side to move stands next to the pawn that just passed `enpassant_possible`
+        - only such a square is kept, so the zobrist key (like the Polyglot one) and the FEN ignore a double push
+          nothing can capture
+        - pins are not looked at
+        """
+
+        if enpassant_possible == ():
+            return False
+        ep_row, ep_col = enpassant_possible
+        pawn, pawn_row = ('wp', ep_row + 1) if self.whitetomove else ('bp', ep_row - 1)
+        row = self.board[pawn_row]
+        return (ep_col > 0 and row[ep_col - 1] == pawn) or (ep_col < 7 and row[ep_col + 1] == pawn)
 
     def make_move(self, move):
 
+        start_sq = move.start_row * 8 + move.start_col
+        end_sq = move.end_row * 8 + move.end_col
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_STATE[self.state_stack[self.ply] & 255]
+        key ^= ZOBRIST_PIECES[move.piece_moved][start_sq]
+        score = self.psq_score - PSQ_SCORES[move.piece_moved][start_sq]
+        if move.piece_captured != "--":
+            self.phase -= PHASE_WEIGHTS[move.piece_captured[1]]
+            if not move.is_enpassant_move:
+                key ^= ZOBRIST_PIECES[move.piece_captured][end_sq]
+                score -= PSQ_SCORES[move.piece_captured][end_sq]
+
         self.board[move.start_row][move.start_col] = "--"
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.movelog.append(move)
         self.whitetomove = not self.whitetomove
 
+        # update square sets
+        occupancy = self.occupancy
+        occupancy[move.piece_moved[0]] ^= 1 << start_sq | 1 << end_sq
+        if move.piece_captured != "--":
+            if move.is_enpassant_move:
+                occupancy[move.piece_captured[0]] ^= 1 << (move.start_row * 8 + move.end_col)
+            else:
+                occupancy[move.piece_captured[0]] ^= 1 << end_sq
+
         # update kings location
         if move.piece_moved == 'wK':
             self.white_king_loc = (move.end_row, move.end_col)
@@ -72,37 +552,65 @@ class GameState:
 
         # pawn promotion
         if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + 'Q'
+            self.board[move.end_row][move.end_col] = move.piece_moved[0] + move.promotion_piece
+            self.phase += PHASE_WEIGHTS[move.promotion_piece]
+
+        key ^= ZOBRIST_PIECES[self.board[move.end_row][move.end_col]][end_sq]
+        score += PSQ_SCORES[self.board[move.end_row][move.end_col]][end_sq]
 
         # enpassant
         if move.is_enpassant_move:
             self.board[move.start_row][move.end_col] = '--'
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.start_row * 8 + move.end_col]
+            score -= PSQ_SCORES[move.piece_captured][move.start_row * 8 + move.end_col]
 
         # update enpassant_possible var
+        self.enpassant_possible = ()
         if move.piece_moved[1] == 'p' and abs(move.start_row - move.end_row) == 2:
-            self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
+            enpassant_possible = ENPASSANT_SQUARES[self.whitetomove][move.start_col]
+            if self.enpassant_capture_possible(enpassant_possible):
+                self.enpassant_possible = enpassant_possible
+
+        # move counters
+        if move.piece_moved[1] == 'p' or move.piece_captured != "--":
+            self.halfmove_clock = 0
         else:
-            self.enpassant_possible = ()
+            self.halfmove_clock += 1
+        if move.piece_moved[0] == 'b':
+            self.fullmove_number += 1
 
         # castling move
         if move.is_castling_move:
             if move.end_col - move.start_col == 2: # king side castle
-                self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][move.end_col + 1]  # moves the rook into new square
-                self.board[move.end_row][move.end_col + 1] = '--'
+                rook_from, rook_to = move.end_col + 1, move.end_col - 1
             else:  # queen side castle
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 2]  # moves the rook into new square
-                self.board[move.end_row][move.end_col - 2] = '--'
+                rook_from, rook_to = move.end_col - 2, move.end_col + 1
+            rook = self.board[move.end_row][rook_from]
+            self.board[move.end_row][rook_to] = rook  # moves the rook into new square
+            self.board[move.end_row][rook_from] = '--'
+            if rook != '--':
+                key ^= ZOBRIST_PIECES[rook][move.end_row * 8 + rook_from] ^ ZOBRIST_PIECES[rook][move.end_row * 8 + rook_to]
+                score += PSQ_SCORES[rook][move.end_row * 8 + rook_to] - PSQ_SCORES[rook][move.end_row * 8 + rook_from]
+                occupancy[rook[0]] ^= 1 << (move.end_row * 8 + rook_from) | 1 << (move.end_row * 8 + rook_to)
 
         # update castling rights
         self.update_castle_rights(move)
-        self.castle_rights_log.append(CastlingRights(self.current_castling_rights.wks,
-                                                     self.current_castling_rights.bks,
-                                                     self.current_castling_rights.wqs,
-                                                     self.current_castling_rights.bqs))
+
+        # push the new irreversible state, update zobrist key and repetition counts
+        self.ply += 1
+        if self.ply == len(self.state_stack):
+            self.grow_stacks()
+        state = self.pack_state(move.piece_captured)
+        self.state_stack[self.ply] = state
+        self.zobrist_key = key ^ ZOBRIST_STATE[state & 255]
+        self.key_stack[self.ply] = self.zobrist_key
+        self.key_counts[self.zobrist_key] = self.key_counts.get(self.zobrist_key, 0) + 1
+        self.psq_score = score
+        self.score_stack[self.ply] = score
 
     def update_castle_rights(self, move):
         """
-        update castling rights (only at rook or king move)
+        update castling rights (only at rook or king move, or a rook capture)
         """
         if move.piece_moved == 'wK':
             self.current_castling_rights.wks = False
@@ -126,14 +634,48 @@ class GameState:
                 elif move.start_col == 7:
                     self.current_castling_rights.bks = False
 
+        # a rook captured on its starting square takes the castling right with it
+        if move.piece_captured == 'wR':
+            if move.end_row == 7:
+                if move.end_col == 0:
+                    self.current_castling_rights.wqs = False
+                elif move.end_col == 7:
+                    self.current_castling_rights.wks = False
+
+        elif move.piece_captured == 'bR':
+            if move.end_row == 0:
+                if move.end_col == 0:
+                    self.current_castling_rights.bqs = False
+                elif move.end_col == 7:
+                    self.current_castling_rights.bks = False
+
     def undo_move(self):
 
         if len(self.movelog) != 0:
             move = self.movelog.pop()
+            piece_captured = STACK_PIECES[self.state_stack[self.ply] >> 8 & 15]
+
+            # remove the position from the repetition counts
+            count = self.key_counts[self.zobrist_key] - 1
+            if count:
+                self.key_counts[self.zobrist_key] = count
+            else:
+                del self.key_counts[self.zobrist_key]
+
             self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            self.board[move.end_row][move.end_col] = piece_captured
             self.whitetomove = not self.whitetomove
 
+            # update square sets
+            occupancy = self.occupancy
+            occupancy[move.piece_moved[0]] ^= 1 << (move.start_row * 8 + move.start_col) | \
+                1 << (move.end_row * 8 + move.end_col)
+            if piece_captured != "--":
+                if move.is_enpassant_move:
+                    occupancy[piece_captured[0]] ^= 1 << (move.start_row * 8 + move.end_col)
+                else:
+                    occupancy[piece_captured[0]] ^= 1 << (move.end_row * 8 + move.end_col)
+
             # update kings location
             if move.piece_moved == 'wK':
                 self.white_king_loc = (move.start_row, move.start_col)
@@ -143,74 +685,280 @@ class GameState:
             # undo enpassant move
             if move.is_enpassant_move:
                 self.board[move.end_row][move.end_col] = '--'
-                self.board[move.start_row][move.end_col] = move.piece_captured
-                self.enpassant_possible = (move.end_row, move.end_col)
-            # undo 2 sq pawn advance
-            if move.piece_moved[1] == 'p' and abs(move.start_row - move.end_row):
-                self.enpassant_possible = ()
-
-            # undo castling rights move
-            self.castle_rights_log.pop() # get rid of new castle rights from log
-            new_rights = self.castle_rights_log[-1]
-            self.current_castling_rights = CastlingRights(new_rights.wks,
-                                                          new_rights.bks,
-                                                          new_rights.wqs,
-                                                          new_rights.bqs)
+                self.board[move.start_row][move.end_col] = piece_captured
+
+            # restore castling rights, enpassant square, halfmove clock and zobrist key from the stack
+            self.ply -= 1
+            state = self.state_stack[self.ply]
+            self.current_castling_rights.set_bits(state & 15)
+            ep_file = state >> 4 & 15
+            self.enpassant_possible = () if ep_file == NO_ENPASSANT else ENPASSANT_SQUARES[self.whitetomove][ep_file]
+            self.halfmove_clock = state >> 12
+            self.zobrist_key = self.key_stack[self.ply]
+            self.psq_score = self.score_stack[self.ply]
+            if piece_captured != "--":
+                self.phase += PHASE_WEIGHTS[piece_captured[1]]
+            if move.is_pawn_promotion:
+                self.phase -= PHASE_WEIGHTS[move.promotion_piece]
+            if move.piece_moved[0] == 'b':
+                self.fullmove_number -= 1
 
             # undo castle mode
             if move.is_castling_move:
                 if move.end_col - move.start_col == 2:
-                    self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 1]
-                    self.board[move.end_row][move.end_col - 1] = '--'
+                    rook_from, rook_to = move.end_col + 1, move.end_col - 1
                 else:
-                    self.board[move.end_row][move.end_col - 2] = self.board[move.end_row][move.end_col + 1]
-                    self.board[move.end_row][move.end_col + 1] = '--'
+                    rook_from, rook_to = move.end_col - 2, move.end_col + 1
+                rook = self.board[move.end_row][rook_to]
+                self.board[move.end_row][rook_from] = rook
+                self.board[move.end_row][rook_to] = '--'
+                if rook != '--':
+                    occupancy[rook[0]] ^= 1 << (move.end_row * 8 + rook_from) | 1 << (move.end_row * 8 + rook_to)
 
-    def get_valid_moves(self):
+    def get_valid_moves(self, moves=None, indexed=False):
 
         """
         all moves considering checks
+        - pins and checks are found once per position by scanning outwards from the king
+        - pseudo legal moves are then filtered against them instead of being played out
+        - `moves` can be a list to reuse as the output buffer, it is cleared first
+        - `indexed` returns a MoveIndex, for repeated lookups by square or move id
         """
 
-        # temp vars
+        in_check, self.pins, self.checks = self.check_for_pins_and_checks()
 
-        temp_enpassant_poss = self.enpassant_possible
-        temp_castle_rights = CastlingRights(self.current_castling_rights.wks,
-                                            self.current_castling_rights.bks,
-                                            self.current_castling_rights.wqs,
-                                            self.current_castling_rights.bqs)
+        if self.whitetomove:
+            king_row, king_col = self.white_king_loc
+        else:
+            king_row, king_col = self.black_king_loc
 
-        moves = self.get_possible_moves()
+        if moves is None:
+            moves = []
+        else:
+            moves.clear()
 
-        # get castling moves
-        if self.whitetomove:
-            self.get_castle_moves(self.white_king_loc[0], self.white_king_loc[1], moves)
+        if len(self.checks) > 1:  # double check, only the king can move
+            self.get_king_moves(king_row, king_col, moves)
         else:
-            self.get_castle_moves(self.black_king_loc[0], self.black_king_loc[1], moves)
+            self.get_possible_moves(moves)
 
-        for i in range(len(moves) - 1, -1, -1):  # go backwards when removing items from list
-            self.make_move(moves[i])
-            self.whitetomove = not self.whitetomove  # make_move switches turns, switch after to run in check
+        if not in_check:  # get castling moves
+            self.get_castle_moves(king_row, king_col, moves, in_check=False)
 
-            if self.in_check():
-                moves.remove(moves[i])
-            self.whitetomove = not self.whitetomove  # switch it back
-            self.undo_move()
+        self.remove_illegal_moves(moves, *self.get_move_restrictions(king_row, king_col))
 
         if len(moves) == 0:  # either checkmate or stalemate
-            if self.in_check():
+            if in_check:
                 self.check_mate = True
             else:
                 self.stale_mate = True
         else:
             self.check_mate = False
             self.stale_mate = False
+        self.draw_by_repetition = self.is_repetition()
 
-        self.enpassant_possible = temp_enpassant_poss
-        self.current_castling_rights = temp_castle_rights
+        # pins only hold for the position they were computed in
+        self.pins = []
+        self.checks = []
 
+        if indexed:
+            return MoveIndex(moves)
         return moves
 
+    def get_move_restrictions(self, king_row, king_col):
+
+        """
+        `(valid_squares, pins)` from the pins and checks found by check_for_pins_and_checks
+        - `valid_squares`: squares `row * 8 + col` a non king piece can move to in order to stop a single check, `None`
+          if not in check
+        - `pins`: square `row * 8 + col` of every pinned piece to the direction of its pin
+        """
+
+        valid_squares = None
+        if len(self.checks) == 1:
+            check_row, check_col, d_row, d_col = self.checks[0]
+            if self.board[check_row][check_col][1] == 'N':  # knight checks can only be captured
+                valid_squares = {check_row * 8 + check_col}
+            else:
+                valid_squares = set()
+                for i in range(1, 8):
+                    sq = (king_row + d_row * i) * 8 + king_col + d_col * i
+                    valid_squares.add(sq)
+                    if sq == check_row * 8 + check_col:
+                        break
+
+        pins = {}
+        for pin in self.pins:
+            pins[pin[0] * 8 + pin[1]] = (pin[2], pin[3])
+        return valid_squares, pins
+
+    def remove_illegal_moves(self, moves, valid_squares, pins):
+
+        """
+        drop the pseudo legal moves of `moves` that would leave the king in check, in place
+        """
+
+        for i in range(len(moves) - 1, -1, -1):  # go backwards when removing items from list
+            move = moves[i]
+            code = move.code
+
+            if move.piece_moved[1] == 'K':
+                if not self.king_move_is_safe(move):
+                    moves.pop(i)
+                continue
+
+            if code >> 12 == Move.ENPASSANT:
+                # both pawns leave the rank at once, so pins alone cannot tell if this exposes the king
+                if not self.enpassant_move_is_safe(move):
+                    moves.pop(i)
+                continue
+
+            start = code & 63
+            end = code >> 6 & 63
+            pin = pins.get(start)
+            if pin is not None:
+                # a pinned piece may only move along the line of the pin
+                if ((end >> 3) - (start >> 3)) * pin[1] != ((end & 7) - (start & 7)) * pin[0]:
+                    moves.pop(i)
+                    continue
+
+            if valid_squares is not None and end not in valid_squares:
+                moves.pop(i)
+
+    def has_legal_move(self):
+
+        """
+        determine if the side to move has any legal move, stopping at the first one found
+        - the king is tried first, then the other pieces one at a time
+        - castling is never needed: it is only legal if the king's step towards the rook is legal too
+        - leaves the game over flags alone, see `get_status`
+        """
+
+        in_check, self.pins, self.checks = self.check_for_pins_and_checks()
+        try:
+            if self.whitetomove:
+                king_row, king_col = self.white_king_loc
+            else:
+                king_row, king_col = self.black_king_loc
+
+            moves = []
+            self.get_king_moves(king_row, king_col, moves)
+            for move in moves:
+                if self.king_move_is_safe(move):
+                    return True
+            if len(self.checks) > 1:  # double check, only the king can move
+                return False
+
+            valid_squares, pins = self.get_move_restrictions(king_row, king_col)
+            board = self.board
+            move_functions = self.move_functions
+            squares = self.occupancy['w' if self.whitetomove else 'b'] & ~(1 << (king_row * 8 + king_col))
+            while squares:
+                bit = squares & -squares
+                squares ^= bit
+                r, c = SQ_ROW_COL[bit.bit_length() - 1]
+                moves.clear()
+                move_functions[board[r][c][1]](r, c, moves)
+                self.remove_illegal_moves(moves, valid_squares, pins)
+                if moves:
+                    return True
+            return False
+        finally:
+            self.pins = []
+            self.checks = []
+
+    def check_for_pins_and_checks(self):
+
+        """
+        scan outwards from the king of the side to move
+        - returns `(in_check, pins, checks)`
+        - pins and checks are lists of `(row, col, d_row, d_col)`, the direction pointing away from the king
+        """
+
+        pins = []
+        checks = []
+        in_check = False
+
+        if self.whitetomove:
+            enemy_color, ally_color = 'b', 'w'
+            start_row, start_col = self.white_king_loc
+        else:
+            enemy_color, ally_color = 'w', 'b'
+            start_row, start_col = self.black_king_loc
+
+        board = self.board
+        king_sq = start_row * 8 + start_col
+
+        for j in range(8):
+            d = DIRECTIONS[j]
+            possible_pin = ()
+            i = 0
+            for end_row, end_col in RAY_SQUARES[j][king_sq]:
+                i += 1
+                end_piece = board[end_row][end_col]
+                if end_piece[0] == ally_color and end_piece[1] != 'K':
+                    if possible_pin == ():  # first allied piece could be pinned
+                        possible_pin = (end_row, end_col, d[0], d[1])
+                    else:  # second allied piece, no pin or check possible in this direction
+                        break
+                elif end_piece[0] == enemy_color:
+                    piece_type = end_piece[1]
+                    # 1. orthogonally away from king and piece is a rook
+                    # 2. diagonally away from king and piece is a bishop
+                    # 3. 1 sq diagonally away from king and piece is a pawn
+                    # 4. any direction and piece is a queen
+                    # 5. any direction 1 sq away and piece is a king
+                    if (0 <= j <= 3 and piece_type == 'R') or \
+                            (4 <= j <= 7 and piece_type == 'B') or \
+                            (i == 1 and piece_type == 'p' and (
+                                (enemy_color == 'w' and 6 <= j <= 7) or (enemy_color == 'b' and 4 <= j <= 5))) or \
+                            (piece_type == 'Q') or \
+                            (i == 1 and piece_type == 'K'):
+                        if possible_pin == ():  # no piece blocking, so check
+                            in_check = True
+                            checks.append((end_row, end_col, d[0], d[1]))
+                        else:  # piece blocking, so pin
+                            pins.append(possible_pin)
+                    break  # enemy piece not applying check
+
+        enemy_knight = enemy_color + 'N'
+        for end_row, end_col in KNIGHT_SQUARES[king_sq]:
+            if board[end_row][end_col] == enemy_knight:
+                in_check = True
+                checks.append((end_row, end_col, end_row - start_row, end_col - start_col))
+
+        return in_check, pins, checks
+
+    def king_move_is_safe(self, move):
+
+        """
+        determine if the king would be left in check after `move`, without going through make_move
+        """
+
+        self.board[move.start_row][move.start_col] = '--'  # king must not shield its own target square
+        attacked = self.sq_under_attack(move.end_row, move.end_col)
+        self.board[move.start_row][move.start_col] = move.piece_moved
+
+        return not attacked
+
+    def enpassant_move_is_safe(self, move):
+
+        """
+        determine if the king would be left in check after an enpassant capture
+        """
+
+        self.board[move.start_row][move.start_col] = '--'
+        self.board[move.start_row][move.end_col] = '--'
+        self.board[move.end_row][move.end_col] = move.piece_moved
+
+        in_check = self.in_check()
+
+        self.board[move.end_row][move.end_col] = '--'
+        self.board[move.start_row][move.end_col] = move.piece_captured
+        self.board[move.start_row][move.start_col] = move.piece_moved
+
+        return not in_check
+
     def in_check(self):
 
         """
@@ -225,34 +973,65 @@ class GameState:
     def sq_under_attack(self, r, c):
 
         """
-        determine if the enemy can attach square r, c
+        determine if the enemy can attack square r, c
+        - looks outwards from the square for knights, kings, pawns and sliders instead of building enemy moves
         """
 
-        self.whitetomove = not self.whitetomove
-        enemy_moves = self.get_possible_moves()
-        self.whitetomove = not self.whitetomove
+        enemy_color = 'b' if self.whitetomove else 'w'
+
+        # pawns attack diagonally towards the side they move to
+        pawn_row = r - 1 if enemy_color == 'b' else r + 1
+        if 0 <= pawn_row < 8:
+            if c - 1 >= 0 and self.board[pawn_row][c - 1] == enemy_color + 'p':
+                return True
+            if c + 1 <= 7 and self.board[pawn_row][c + 1] == enemy_color + 'p':
+                return True
+
+        board = self.board
+        sq = r * 8 + c
 
-        for move in enemy_moves:
-            if move.end_row == r and move.end_col == c:
+        enemy_knight = enemy_color + 'N'
+        for end_row, end_col in KNIGHT_SQUARES[sq]:
+            if board[end_row][end_col] == enemy_knight:
                 return True
+
+        enemy_king = enemy_color + 'K'
+        for end_row, end_col in KING_SQUARES[sq]:
+            if board[end_row][end_col] == enemy_king:
+                return True
+
+        # sliders, the first piece hit along each ray decides
+        enemy_queen = enemy_color + 'Q'
+        for j in range(8):
+            enemy_slider = enemy_color + ('R' if j <= 3 else 'B')
+            for end_row, end_col in RAY_SQUARES[j][sq]:
+                end_piece = board[end_row][end_col]
+                if end_piece == "--":
+                    continue
+                if end_piece == enemy_slider or end_piece == enemy_queen:
+                    return True
+                break
+
         return False
 
-    def get_possible_moves(self):
+    def get_possible_moves(self, moves=None):
 
         """
-        all moves without considering checks
+        all moves without considering checks, appended to `moves` when given
+        - only the squares in the side to move's square set are visited, in board order
         """
 
-        moves = []
-
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]  # black or whites turn
-
-                if (turn == 'w' and self.whitetomove) or (turn == 'b' and not self.whitetomove):
-                    piece = self.board[r][c][1]
+        if moves is None:
+            moves = []
 
-                    self.move_functions[piece](r, c, moves)  # move function dict
+        board = self.board
+        move_functions = self.move_functions
+        squares = self.occupancy['w' if self.whitetomove else 'b']
+        while squares:
+            bit = squares & -squares
+            squares ^= bit
+            r, c = SQ_ROW_COL[bit.bit_length() - 1]
+            move_functions[board[r][c][1]](r, c, moves)  # move function dict
 
         return moves
 
@@ -264,65 +1043,59 @@ class GameState:
 
         if self.whitetomove:
             if self.board[r - 1][c] == '--':  # 1 sq pawn advance
-                moves.append(Move((r, c), (r - 1, c), self.board))
+                self.add_pawn_move((r, c), (r - 1, c), moves)
                 if r == 6 and self.board[r - 2][c] == "--":  # 2 sq pawn advance
                     moves.append(Move((r, c), (r - 2, c), self.board))
 
             if c - 1 >= 0:
                 if self.board[r - 1][c - 1][0] == 'b':  # left capture enemy piece
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board))
+                    self.add_pawn_move((r, c), (r - 1, c - 1), moves)
                 elif (r - 1, c - 1) == self.enpassant_possible:
                     moves.append(Move((r, c), (r - 1, c - 1), self.board, is_enpassant_move=True))
 
             if c + 1 <= 7:
                 if self.board[r - 1][c + 1][0] == 'b':  # right capture enemy piece
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board))
+                    self.add_pawn_move((r, c), (r - 1, c + 1), moves)
                 elif (r - 1, c + 1) == self.enpassant_possible:
                     moves.append(Move((r, c), (r - 1, c + 1), self.board, is_enpassant_move=True))
 
         else:
             if self.board[r + 1][c] == '--':
-                moves.append(Move((r, c), (r + 1, c), self.board))
+                self.add_pawn_move((r, c), (r + 1, c), moves)
                 if r == 1 and self.board[r + 2][c] == "--":
                     moves.append(Move((r, c), (r + 2, c), self.board))
 
             if c - 1 >= 0:
                 if self.board[r + 1][c - 1][0] == 'w':
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board))
+                    self.add_pawn_move((r, c), (r + 1, c - 1), moves)
                 elif (r + 1, c - 1) == self.enpassant_possible:
                     moves.append(Move((r, c), (r + 1, c - 1), self.board, is_enpassant_move=True))
 
             if c + 1 <= 7:
                 if self.board[r + 1][c + 1][0] == 'w':
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board))
+                    self.add_pawn_move((r, c), (r + 1, c + 1), moves)
                 elif (r + 1, c + 1) == self.enpassant_possible:
                     moves.append(Move((r, c), (r + 1, c + 1), self.board, is_enpassant_move=True))
 
+    def add_pawn_move(self, start_sq, end_sq, moves):
+
+        """
+        add a pawn move, once per promotion piece when it reaches the last rank
+        """
+
+        if end_sq[0] == 0 or end_sq[0] == 7:
+            for piece in Move.promotion_pieces:
+                moves.append(Move(start_sq, end_sq, self.board, promotion_piece=piece))
+        else:
+            moves.append(Move(start_sq, end_sq, self.board))
+
     def get_rook_moves(self, r, c, moves):
 
         """
         get all rook moves
         """
 
-        dirs = ((-1, 0), (0, -1), (1, 0), (0, 1))
-        enemy_color = 'b' if self.whitetomove else 'w'
-
-        for d in dirs:
-            for i in range(1, 8):
-                end_row = r + i * d[0]
-                end_col = c + i * d[1]
-
-                if (0 <= end_row < 8) and (0 <= end_col < 8):
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == "--":
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    elif end_piece[0] == enemy_color:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
+        self.get_slider_moves(r, c, ROOK_RAYS[r * 8 + c], moves)
 
     def get_bishop_moves(self, r, c, moves):
 
@@ -330,24 +1103,26 @@ class GameState:
         get all bishop moves
         """
 
-        dirs = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+        self.get_slider_moves(r, c, BISHOP_RAYS[r * 8 + c], moves)
+
+    def get_slider_moves(self, r, c, rays, moves):
+
+        """
+        moves along precomputed `rays`, each stops at the first piece and includes it if it is an enemy
+        """
+
+        board = self.board
         enemy_color = 'b' if self.whitetomove else 'w'
+        start = (r, c)
 
-        for d in dirs:
-            for i in range(1, 8):
-                end_row = r + i * d[0]
-                end_col = c + i * d[1]
-
-                if (0 <= end_row < 8) and (0 <= end_col < 8):
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == "--":
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    elif end_piece[0] == enemy_color:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                        break
-                    else:
-                        break
+        for ray in rays:
+            for end in ray:
+                end_piece = board[end[0]][end[1]]
+                if end_piece == "--":
+                    moves.append(Move(start, end, board))
                 else:
+                    if end_piece[0] == enemy_color:
+                        moves.append(Move(start, end, board))
                     break
 
     def get_knight_moves(self, r, c, moves):
@@ -356,17 +1131,13 @@ class GameState:
         get all knight moves
         """
 
-        knight_moves = ((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2))
+        board = self.board
         ally_color = 'w' if self.whitetomove else 'b'
+        start = (r, c)
 
-        for m in knight_moves:
-            end_row = r + m[0]
-            end_col = c + m[1]
-
-            if (0 <= end_row < 8) and (0 <= end_col < 8):
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    moves.append(Move((r, c), (end_row, end_col), self.board))
+        for end in KNIGHT_SQUARES[r * 8 + c]:
+            if board[end[0]][end[1]][0] != ally_color:
+                moves.append(Move(start, end, board))
 
     def get_king_moves(self, r, c, moves):
 
@@ -374,23 +1145,22 @@ class GameState:
         get all king moves
         """
 
-        king_moves = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+        board = self.board
         ally_color = 'w' if self.whitetomove else 'b'
+        start = (r, c)
 
-        for i in range(8):
-            end_row = r + king_moves[i][0]
-            end_col = c + king_moves[i][1]
-
-            if (0 <= end_row < 8) and (0 <= end_col < 8):
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    moves.append(Move((r, c), (end_row, end_col), self.board))
+        for end in KING_SQUARES[r * 8 + c]:
+            if board[end[0]][end[1]][0] != ally_color:
+                moves.append(Move(start, end, board))
 
-    def get_castle_moves(self, r, c, moves):
+    def get_castle_moves(self, r, c, moves, in_check=None):
         """
         Generate all valid castle moves for the king at (r, c) and add them to valid moves list
+        - `in_check` can be passed in when it is already known for the current position
         """
-        if self.sq_under_attack(r, c):
+        if in_check is None:
+            in_check = self.sq_under_attack(r, c)
+        if in_check:
             return # cannot castle when in check
 
         if (self.whitetomove and self.current_castling_rights.wks) or (not self.whitetomove and self.current_castling_rights.bks):
@@ -404,7 +1174,7 @@ class GameState:
                 moves.append(Move((r, c), (r, c + 2), self.board, is_castling_move=True))
 
     def get_queen_side_castle(self, r, c, moves):
-        if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3]:
+        if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--':
             if not self.sq_under_attack(r, c - 1) and not self.sq_under_attack(r, c - 2):
                 moves.append(Move((r, c), (r, c - 2), self.board, is_castling_move=True))
 
@@ -429,42 +1199,135 @@ class CastlingRights:
         self.wqs = wqs
         self.bqs = bqs
 
+    def get_bits(self):
+        return self.wks | self.bks << 1 | self.wqs << 2 | self.bqs << 3
+
+    def set_bits(self, bits):
+
+        """
+        restore the rights from `get_bits()` in place
+        """
+
+        self.wks = bits & 1 != 0
+        self.bks = bits & 2 != 0
+        self.wqs = bits & 4 != 0
+        self.bqs = bits & 8 != 0
+
 
 class Move:
+
+    """
+    A move packed into a 16 bit `code`
+    - bits 0 - 5: start square `row * 8 + col`
+    - bits 6 - 11: end square
+    - bits 12 - 15: flags, `ENPASSANT`, `CASTLING` or `PROMOTION` plus the index of the promotion piece
+    - `start_row`, `start_col`, `end_row` and `end_col` are read back from `code`, only the pieces are stored besides it
+    """
+
+    __slots__ = ('code', 'piece_moved', 'piece_captured')
+
     ranks_rows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rows_ranks = {v: k for k, v in ranks_rows.items()}
 
     files_cols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     cols_files = {v: k for k, v in files_cols.items()}
 
-    def __init__(self, start_sq, end_sq, board, is_enpassant_move=False, is_castling_move=False):
+    # flags
+    ENPASSANT = 1
+    CASTLING = 2
+    PROMOTION = 4
+    promotion_pieces = ('Q', 'R', 'B', 'N')
 
-        self.start_row = start_sq[0]
-        self.start_col = start_sq[1]
-        self.end_row = end_sq[0]
-        self.end_col = end_sq[1]
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
+    def __init__(self, start_sq, end_sq, board, is_enpassant_move=False, is_castling_move=False, promotion_piece='Q'):
 
-        # Pawn promotion
+        start_row, start_col = start_sq
+        end_row, end_col = end_sq
+        self.piece_moved = board[start_row][start_col]
+        self.piece_captured = board[end_row][end_col]
 
-        self.is_pawn_promotion = False
-        if (self.piece_moved == 'wp' and self.end_row == 0) or (self.piece_moved == 'bp' and self.end_row == 7):
-            self.is_pawn_promotion = True
+        flags = 0
 
         # Enpassant
 
-        self.is_enpassant_move = is_enpassant_move
-        if self.is_enpassant_move:
+        if is_enpassant_move:
+            flags = Move.ENPASSANT
             self.piece_captured = 'wp' if self.piece_moved == 'bp' else 'bp'
 
         # Castling Move
 
-        self.is_castling_move = is_castling_move
+        elif is_castling_move:
+            flags = Move.CASTLING
+
+        # Pawn promotion
+
+        elif (self.piece_moved == 'wp' and end_row == 0) or (self.piece_moved == 'bp' and end_row == 7):
+            flags = Move.PROMOTION | Move.promotion_pieces.index(promotion_piece)
+
+        self.code = (start_row * 8 + start_col) | (end_row * 8 + end_col) << 6 | flags << 12
+
+    @classmethod
+    def from_code(cls, code, board):
+
+        """
+        rebuild a move from its packed `code`, reading the pieces from `board`
+        """
+
+        flags = code >> 12
+        return cls(divmod(code & 63, 8), divmod(code >> 6 & 63, 8), board,
+                   is_enpassant_move=flags == cls.ENPASSANT,
+                   is_castling_move=flags == cls.CASTLING,
+                   promotion_piece=cls.promotion_pieces[flags & 3])
+
+    @property
+    def start_row(self):
+        return self.code >> 3 & 7
+
+    @property
+    def start_col(self):
+        return self.code & 7
+
+    @property
+    def end_row(self):
+        return self.code >> 9 & 7
+
+    @property
+    def end_col(self):
+        return self.code >> 6 & 7
+
+    @property
+    def is_pawn_promotion(self):
+        return self.code >> 12 & Move.PROMOTION != 0
+
+    @property
+    def is_enpassant_move(self):
+        return self.code >> 12 == Move.ENPASSANT
+
+    @property
+    def is_castling_move(self):
+        return self.code >> 12 == Move.CASTLING
+
+    @property
+    def promotion_piece(self):
+
+        """
+        piece type a pawn promotes to, `None` for any other move
+        """
+
+        if self.code >> 12 & Move.PROMOTION:
+            return Move.promotion_pieces[self.code >> 12 & 3]
+        return None
+
+    @property
+    def move_id(self):
 
-        self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col * 1
-        # print(self.move_id)
+        """
+        `start_row, start_col, end_row, end_col` as decimal digits, underpromotions add the piece index * 10000
+        """
 
+        move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col * 1
+        if self.code >> 12 & Move.PROMOTION:
+            move_id += (self.code >> 12 & 3) * 10000
+        return move_id
 
     def __eq__(self, other):
 
@@ -477,16 +1340,163 @@ class Move:
 
         return False
 
+    def __hash__(self):
+        return hash(self.move_id)
+
     def get_chess_notation(self):
 
         """
         string move notation
         """
 
-        return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        notation = self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        if self.code >> 12 & Move.PROMOTION:
+            notation += self.promotion_piece.lower()
+        return notation
 
     def get_rank_file(self, r, c):
         """
         get rank file
         """
         return self.cols_files[c] + self.rows_ranks[r]
+
+
+class MoveIndex(list):
+    """
+    List of valid moves that is also indexed by start square and by move id, for O(1) lookups from the UI
+    """
+
+    def __init__(self, moves=()):
+        super().__init__(moves)
+        self.by_square = {}
+        self.by_id = {}
+        for move in self:
+            self.by_square.setdefault((move.start_row, move.start_col), []).append(move)
+            self.by_id[move.move_id] = move
+
+    def get_moves_from(self, r, c):
+
+        """
+        valid moves of the piece on `(r, c)`
+        """
+
+        return self.by_square.get((r, c), [])
+
+    def get_move(self, start_sq, end_sq, promotion_piece='Q'):
+
+        """
+        the valid move between two `(row, col)` squares, or `None`
+        - `promotion_piece` picks among the promotions, it is ignored for any other move
+        """
+
+        move_id = start_sq[0] * 1000 + start_sq[1] * 100 + end_sq[0] * 10 + end_sq[1]
+        return self.by_id.get(move_id + Move.promotion_pieces.index(promotion_piece) * 10000) or \
+            self.by_id.get(move_id)
+
+
+class TranspositionTable:
+    """
+    Fixed size hash table of search results, keyed by `GameState.zobrist_key`
+    - entries live in two flat arrays, one for the full key and one for the packed data
+    - each bucket holds 2 entries: a depth preferred slot and an always replace slot
+    - packed data: bits 0 - 15 move code, 16 - 23 depth, 24 - 25 bound, 26 - 31 generation, 32 - 63 score
+    """
+
+    EXACT = 1
+    LOWER_BOUND = 2
+    UPPER_BOUND = 3
+
+    ENTRY_BYTES = 16
+    SCORE_OFFSET = 1 << 31
+
+    def __init__(self, size_mb=16):
+
+        self.size_mb = size_mb
+        self.buckets = max(1, size_mb * 1024 * 1024 // (2 * self.ENTRY_BYTES))
+        self.generation = 0
+
+        self.keys = array('Q')
+        self.data = array('Q')
+        self.clear()
+
+    def clear(self):
+
+        """
+        empty the table and reset counters
+        """
+
+        self.keys = array('Q', bytes(8 * 2 * self.buckets))
+        self.data = array('Q', bytes(8 * 2 * self.buckets))
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+
+    def new_search(self):
+
+        """
+        age the table, entries from older searches are replaced first
+        """
+
+        self.generation = (self.generation + 1) & 63
+
+    def probe(self, key):
+
+        """
+        look up `key`, returns `(depth, bound, score, move_code)` or `None`
+        """
+
+        i = (key % self.buckets) * 2
+        for slot in (i, i + 1):
+            data = self.data[slot]
+            if data and self.keys[slot] == key:
+                self.hits += 1
+                return data >> 16 & 255, data >> 24 & 3, (data >> 32) - self.SCORE_OFFSET, data & 0xFFFF
+
+        self.misses += 1
+        if self.data[i] or self.data[i + 1]:
+            self.collisions += 1  # bucket taken by other positions
+        return None
+
+    def store(self, key, depth, bound, score, move_code=0):
+
+        """
+        store a result, keeping the deepest entry of the current search in the first slot of the bucket
+        - `score` must fit in a signed 32 bit int and `depth` in 0 - 255
+        """
+
+        i = (key % self.buckets) * 2
+        old = self.data[i]
+        if not old or self.keys[i] == key or old >> 26 & 63 != self.generation or depth >= old >> 16 & 255:
+            slot = i
+        else:
+            slot = i + 1
+
+        self.keys[slot] = key
+        self.data[slot] = (move_code & 0xFFFF) | (depth & 255) << 16 | bound << 24 | self.generation << 26 | \
+            (score + self.SCORE_OFFSET) << 32
+        self.stores += 1
+
+    def usage(self):
+
+        """
+        fraction of slots in use
+        """
+
+        return sum(1 for data in self.data if data) / len(self.data)
+
+    def stats(self):
+
+        """
+        counters as a dict, hit rate included
+        """
+
+        probes = self.hits + self.misses
+        return {'size_mb': self.size_mb,
+                'entries': len(self.data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'collisions': self.collisions,
+                'stores': self.stores,
+                'hit_rate': self.hits / probes if probes else 0.0}
@@ -0,0 +1,95 @@
+"""
+File chessepd.py from project Project_Chess_Game
+
+"""
+
+
+# Streaming reader for FEN and EPD position files: one position per line, read lazily so memory use does not grow
+# with the file, and loaded into a single reused GameState
+
+
+from src.chessengine import GameState
+
+
+def parse_epd(line):
+
+    """
+    split an EPD or FEN line into `(fen, operations)`
+    - `fen` always has all six fields, taken from the line or from the `hmvc`/`fmvn` operations
+    - `operations` maps opcodes to their operand string, e.g. `{'bm': 'e4', 'id': '"pos 1"'}`
+    """
+
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("EPD line %r needs at least 4 fields" % line)
+
+    rest = fields[4] if len(fields) > 4 else ''
+    counters = rest.split(None, 2)
+    if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():  # a plain FEN line
+        halfmove_clock, fullmove_number = counters[0], counters[1]
+        rest = counters[2] if len(counters) > 2 else ''
+    else:
+        halfmove_clock, fullmove_number = None, None
+
+    operations = {}
+    for operation in rest.split(';'):
+        operation = operation.strip()
+        if operation:
+            opcode, _, operand = operation.partition(' ')
+            operations[opcode] = operand.strip()
+
+    if halfmove_clock is None:
+        halfmove_clock = operations.get('hmvc', '0')
+        fullmove_number = operations.get('fmvn', '1')
+
+    return ' '.join(fields[:4] + [halfmove_clock, fullmove_number]), operations
+
+
+def read_positions(source, gs=None, skip_invalid=False):
+
+    """
+    generator over the positions of a FEN/EPD file, yields `(gs, operations)` per line
+    - `source` is a path or an open text file, lines are read one at a time
+    - the same game state (`gs`, or a new GameState) is reloaded for every line, copy it if it has to be kept
+    - blank lines and lines starting with `#` are skipped, invalid lines raise ValueError unless `skip_invalid`
+    """
+
+    if gs is None:
+        gs = GameState()
+
+    if isinstance(source, str):
+        with open(source) as f:
+            yield from _read_lines(f, gs, skip_invalid)
+    else:
+        yield from _read_lines(source, gs, skip_invalid)
+
+
+def _read_lines(lines, gs, skip_invalid):
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            fen, operations = parse_epd(line)
+            gs.load_fen(fen)
+        except (ValueError, KeyError) as e:
+            if skip_invalid:
+                continue
+            raise ValueError("line %d: %s" % (line_number, e))
+        yield gs, operations
+
+
+def write_positions(path, positions):
+
+    """
+    write `(gs, operations)` pairs as EPD lines, the counterpart of read_positions
+    """
+
+    with open(path, 'w') as f:
+        for gs, operations in positions:
+            fields = gs.get_fen().split()
+            ops = dict(operations)
+            ops.setdefault('hmvc', fields[4])
+            ops.setdefault('fmvn', fields[5])
+            f.write(' '.join(fields[:4]) + ''.join(' %s %s;' % (opcode, operand) if operand else ' %s;' % opcode
+                                                   for opcode, operand in ops.items()) + '\n')
@@ -0,0 +1,263 @@
+"""
+File chessevaluation.py from project Project_Chess_Game
+
+"""
+
+
+# Tapered static evaluation: material plus middlegame and endgame piece-square tables (the PeSTO values), blended
+# by game phase. GameState keeps the piece-square sum and the phase up to date in make_move/undo_move, so
+# evaluating a position is a few arithmetic operations instead of a scan of the board
+
+
+import argparse
+import random
+
+# piece values, middlegame and endgame
+MG_VALUES = {'p': 82, 'N': 337, 'B': 365, 'R': 477, 'Q': 1025, 'K': 0}
+EG_VALUES = {'p': 94, 'N': 281, 'B': 297, 'R': 512, 'Q': 936, 'K': 0}
+
+# phase weight per piece type, the start position has MAX_PHASE and bare kings have 0
+PHASE_WEIGHTS = {'p': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+MAX_PHASE = 24
+
+# Piece-square tables from white's point of view, indexed like the board: `row * 8 + col`, row 0 is rank 8.
+# Black uses the same tables with the rows mirrored
+
+MG_TABLES = {
+    'p': (0, 0, 0, 0, 0, 0, 0, 0,
+          98, 134, 61, 95, 68, 126, 34, -11,
+          -6, 7, 26, 31, 65, 56, 25, -20,
+          -14, 13, 6, 21, 23, 12, 17, -23,
+          -27, -2, -5, 12, 17, 6, 10, -25,
+          -26, -4, -4, -10, 3, 3, 33, -12,
+          -35, -1, -20, -23, -15, 24, 38, -22,
+          0, 0, 0, 0, 0, 0, 0, 0),
+    'N': (-167, -89, -34, -49, 61, -97, -15, -107,
+          -73, -41, 72, 36, 23, 62, 7, -17,
+          -47, 60, 37, 65, 84, 129, 73, 44,
+          -9, 17, 19, 53, 37, 69, 18, 22,
+          -13, 4, 16, 13, 28, 19, 21, -8,
+          -23, -9, 12, 10, 19, 17, 25, -16,
+          -29, -53, -12, -3, -1, 18, -14, -19,
+          -105, -21, -58, -33, -17, -28, -19, -23),
+    'B': (-29, 4, -82, -37, -25, -42, 7, -8,
+          -26, 16, -18, -13, 30, 59, 18, -47,
+          -16, 37, 43, 40, 35, 50, 37, -2,
+          -4, 5, 19, 50, 37, 37, 7, -2,
+          -6, 13, 13, 26, 34, 12, 10, 4,
+          0, 15, 15, 15, 14, 27, 18, 10,
+          4, 15, 16, 0, 7, 21, 33, 1,
+          -33, -3, -14, -21, -13, -12, -39, -21),
+    'R': (32, 42, 32, 51, 63, 9, 31, 43,
+          27, 32, 58, 62, 80, 67, 26, 44,
+          -5, 19, 26, 36, 17, 45, 61, 16,
+          -24, -11, 7, 26, 24, 35, -8, -20,
+          -36, -26, -12, -1, 9, -7, 6, -23,
+          -45, -25, -16, -17, 3, 0, -5, -33,
+          -44, -16, -20, -9, -1, 11, -6, -71,
+          -19, -13, 1, 17, 16, 7, -37, -26),
+    'Q': (-28, 0, 29, 12, 59, 44, 43, 45,
+          -24, -39, -5, 1, -16, 57, 28, 54,
+          -13, -17, 7, 8, 29, 56, 47, 57,
+          -27, -27, -16, -16, -1, 17, -2, 1,
+          -9, -26, -9, -10, -2, -4, 3, -3,
+          -14, 2, -11, -2, -5, 2, 14, 5,
+          -35, -8, 11, 2, 8, 15, -3, 1,
+          -1, -18, -9, 10, -15, -25, -31, -50),
+    'K': (-65, 23, 16, -15, -56, -34, 2, 13,
+          29, -1, -20, -7, -8, -4, -38, -29,
+          -9, 24, 2, -16, -20, 6, 22, -22,
+          -17, -20, -12, -27, -30, -25, -14, -36,
+          -49, -1, -27, -39, -46, -44, -33, -51,
+          -14, -14, -22, -46, -44, -30, -15, -27,
+          1, 7, -8, -64, -43, -16, 9, 8,
+          -15, 36, 12, -54, 8, -28, 24, 14),
+}
+
+EG_TABLES = {
+    'p': (0, 0, 0, 0, 0, 0, 0, 0,
+          178, 173, 158, 134, 147, 132, 165, 187,
+          94, 100, 85, 67, 56, 53, 82, 84,
+          32, 24, 13, 5, -2, 4, 17, 17,
+          13, 9, -3, -7, -7, -8, 3, -1,
+          4, 7, -6, 1, 0, -5, -1, -8,
+          13, 8, 8, 10, 13, 0, 2, -7,
+          0, 0, 0, 0, 0, 0, 0, 0),
+    'N': (-58, -38, -13, -28, -31, -27, -63, -99,
+          -25, -8, -25, -2, -9, -25, -24, -52,
+          -24, -20, 10, 9, -1, -9, -19, -41,
+          -17, 3, 22, 22, 22, 11, 8, -18,
+          -18, -6, 16, 25, 16, 17, 4, -18,
+          -23, -3, -1, 15, 10, -3, -20, -22,
+          -42, -20, -10, -5, -2, -20, -23, -44,
+          -29, -51, -23, -15, -22, -18, -50, -64),
+    'B': (-14, -21, -11, -8, -7, -9, -17, -24,
+          -8, -4, 7, -12, -3, -13, -4, -14,
+          2, -8, 0, -1, -2, 6, 0, 4,
+          -3, 9, 12, 9, 14, 10, 3, 2,
+          -6, 3, 13, 19, 7, 10, -3, -9,
+          -12, -3, 8, 10, 13, 3, -7, -15,
+          -14, -18, -7, -1, 4, -9, -15, -27,
+          -23, -9, -23, -5, -9, -16, -5, -17),
+    'R': (13, 10, 18, 15, 12, 12, 8, 5,
+          11, 13, 13, 11, -3, 3, 8, 3,
+          7, 7, 7, 5, 4, -3, -5, -3,
+          4, 3, 13, 1, 2, 1, -1, 2,
+          3, 5, 8, 4, -5, -6, -8, -11,
+          -4, 0, -5, -1, -7, -12, -8, -16,
+          -6, -6, 0, 2, -9, -9, -11, -3,
+          -9, 2, 3, -1, -5, -13, 4, -20),
+    'Q': (-9, 22, 22, 27, 27, 19, 10, 20,
+          -17, 20, 32, 41, 58, 25, 30, 0,
+          -20, 6, 9, 49, 47, 35, 19, 9,
+          3, 22, 24, 45, 57, 40, 57, 36,
+          -18, 28, 19, 47, 31, 34, 39, 23,
+          -16, -27, 15, 6, 9, 17, 10, 5,
+          -22, -23, -30, -16, -16, -23, -36, -32,
+          -33, -28, -22, -43, -5, -32, -20, -41),
+    'K': (-74, -35, -18, -18, -11, 15, 4, -17,
+          -12, 17, 14, 17, 17, 38, 23, 11,
+          10, 17, 23, 15, 20, 45, 44, 13,
+          -8, 22, 24, 27, 26, 33, 26, 3,
+          -18, -4, 21, 24, 27, 23, 9, -11,
+          -19, -3, 11, 21, 23, 16, 7, -9,
+          -27, -11, 4, 13, 14, 4, -5, -17,
+          -53, -34, -21, -11, -28, -14, -24, -43),
+}
+
+# Middlegame and endgame score are packed into one int `mg + eg * EG_UNIT` so a move updates both with one
+# addition, white positive and black negative. Either half stays far below EG_UNIT / 2 in any position
+EG_UNIT = 1 << 20
+
+
+def _psq_scores():
+    scores = {'--': (0,) * 64}
+    for piece_type in MG_TABLES:
+        white = []
+        black = []
+        for sq in range(64):
+            mirrored = (7 - sq // 8) * 8 + sq % 8
+            white.append(MG_VALUES[piece_type] + MG_TABLES[piece_type][sq] +
+                         (EG_VALUES[piece_type] + EG_TABLES[piece_type][sq]) * EG_UNIT)
+            black.append(-(MG_VALUES[piece_type] + MG_TABLES[piece_type][mirrored] +
+                           (EG_VALUES[piece_type] + EG_TABLES[piece_type][mirrored]) * EG_UNIT))
+        scores['w' + piece_type] = tuple(white)
+        scores['b' + piece_type] = tuple(black)
+    return scores
+
+
+# PSQ_SCORES[piece][sq]: packed material and piece-square score of a piece standing on a square
+PSQ_SCORES = _psq_scores()
+
+
+def unpack_score(score):
+
+    """
+    `(middlegame, endgame)` of a packed score
+    """
+
+    mg = ((score + EG_UNIT // 2) & (EG_UNIT - 1)) - EG_UNIT // 2
+    return mg, (score - mg) // EG_UNIT
+
+
+def compute_psq_score(board):
+
+    """
+    packed score and phase of a board from scratch, GameState keeps `psq_score` and `phase` equal to this
+    """
+
+    score = 0
+    phase = 0
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece != "--":
+                score += PSQ_SCORES[piece][r * 8 + c]
+                phase += PHASE_WEIGHTS[piece[1]]
+    return score, phase
+
+
+def blend(score, phase):
+
+    """
+    middlegame and endgame halves of a packed score weighted by phase, from white's point of view
+    - promotions can push the phase past MAX_PHASE, that counts as a full middlegame
+    """
+
+    mg, eg = unpack_score(score)
+    phase = min(phase, MAX_PHASE)
+    return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+def evaluate(gs, incremental=True):
+
+    """
+    static evaluation in centipawns from the side to move's point of view
+    - `incremental` reads the scores make_move/undo_move maintain, otherwise they are recomputed from the board
+    """
+
+    if incremental:
+        score = blend(gs.psq_score, gs.phase)
+    else:
+        score = blend(*compute_psq_score(gs.board))
+    return score if gs.whitetomove else -score
+
+
+def verify_incremental(gs, games=10, plies=200, rng=None):
+
+    """
+    play random games from `gs` and compare the incremental scores against a full recompute after every make_move
+    and undo_move, returns the number of positions checked
+    - raises ValueError at the first mismatch
+    """
+
+    rng = rng or random.Random(0)
+    checked = 0
+
+    def check():
+        expected = compute_psq_score(gs.board)
+        if (gs.psq_score, gs.phase) != expected:
+            raise ValueError("incremental evaluation %s differs from %s in %s" % (
+                (unpack_score(gs.psq_score), gs.phase), (unpack_score(expected[0]), expected[1]), gs.get_fen()))
+
+    for _ in range(games):
+        played = 0
+        for _ in range(plies):
+            moves = gs.get_valid_moves()
+            if not moves:
+                break
+            gs.make_move(rng.choice(moves))
+            played += 1
+            check()
+            checked += 1
+        for _ in range(played):
+            gs.undo_move()
+            check()
+            checked += 1
+    return checked
+
+
+def main(argv=None):
+    from src.chessengine import GameState, START_FEN
+    from src.chessbitboard import BitboardGameState
+
+    parser = argparse.ArgumentParser(description="evaluate positions and check the incremental evaluation")
+    parser.add_argument('--fen', action='append', help="position to evaluate, repeatable")
+    parser.add_argument('--verify', type=int, default=0, metavar='GAMES',
+                        help="play random games from every position comparing incremental and full evaluation")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    for fen in args.fen or [START_FEN]:
+        gs = GameState(fen)
+        mg, eg = unpack_score(gs.psq_score)
+        print("%s: %d (middlegame %d, endgame %d, phase %d)" % (fen, evaluate(gs), mg, eg, gs.phase))
+        if args.verify:
+            for backend in (GameState, BitboardGameState):
+                checked = verify_incremental(backend(fen), args.verify, rng=random.Random(args.seed))
+                print("  %s: %d positions match the full recompute" % (backend.__name__, checked))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,494 @@
+"""
+File chessgamedb.py from project Project_Chess_Game
+
+"""
+
+
+# Game database: games are stored as their 16 bit Move codes in an append-only data file, about two bytes a ply,
+# and every position they reach is indexed by zobrist key in sorted runs. The runs and the game offsets are memory
+# mapped and binary searched, so finding the games of a position reads a few pages instead of replaying anything
+
+
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from src.chessengine import GameState, Move, START_FEN
+from src.chesspgn import RESULTS
+
+MAGIC = b'PCGD'
+VERSION = 2  # 2: keys no longer hash an enpassant square nothing can capture on
+HEADER = struct.Struct('<4sB')
+
+# result index into RESULTS, start FEN length (0 for the standard start position), number of moves
+RECORD = struct.Struct('<BBH')
+
+# data file offset of every game, by game number
+OFFSET = struct.Struct('<Q')
+
+# index runs: zobrist key and game number, sorted by key then game
+INDEX_ENTRY = struct.Struct('<QI')
+KEY = struct.Struct('<Q')
+
+DATA_FILE = 'games.dat'
+OFFSETS_FILE = 'offsets.dat'
+RUN_PREFIX = 'positions-'
+RUN_SUFFIX = '.idx'
+
+# move codes are written little endian whatever the machine, arrays of them are swapped on big endian hosts
+SWAP_CODES = sys.byteorder == 'big'
+
+
+class GameRecord:
+    """
+    One stored game: start position, Move codes of the main line and result
+    - `moves` is an array('H') of Move.code, the same two bytes a move takes on disk
+    """
+
+    def __init__(self, moves, result='*', start_fen=START_FEN):
+        self.moves = moves if isinstance(moves, array) else array('H', moves)
+        self.result = result
+        self.start_fen = start_fen
+
+    @classmethod
+    def from_game_state(cls, gs, result='*', start_fen=START_FEN):
+
+        """
+        record of the moves in `gs.movelog`, `start_fen` is the position the log starts from
+        """
+
+        return cls(array('H', [move.code for move in gs.movelog]), result, start_fen)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def pack(self):
+        fen = b'' if self.start_fen == START_FEN else self.start_fen.encode('ascii')
+        if len(fen) > 255 or len(self.moves) > 0xFFFF:
+            raise ValueError("game too long to store: %d byte FEN, %d moves" % (len(fen), len(self.moves)))
+        moves = self.moves
+        if SWAP_CODES:
+            moves = array('H', moves)
+            moves.byteswap()
+        return RECORD.pack(RESULTS.index(self.result), len(fen), len(moves)) + fen + moves.tobytes()
+
+    @classmethod
+    def unpack_from(cls, buffer, offset):
+
+        """
+        the record stored at `offset` of `buffer` and the offset just past it
+        """
+
+        result, fen_length, plies = RECORD.unpack_from(buffer, offset)
+        offset += RECORD.size
+        start_fen = bytes(buffer[offset:offset + fen_length]).decode('ascii') if fen_length else START_FEN
+        offset += fen_length
+        moves = array('H')
+        moves.frombytes(buffer[offset:offset + plies * 2])
+        if SWAP_CODES:
+            moves.byteswap()
+        return cls(moves, RESULTS[result], start_fen), offset + plies * 2
+
+    def replay(self, gs=None):
+
+        """
+        generator that plays the game on `gs` through make_move and yields it after every move
+        - `gs` is reset to the start position first and reused, copy it if a position has to be kept
+        - moves are rebuilt from their codes one at a time, nothing is generated or validated
+        """
+
+        if gs is None:
+            gs = GameState()
+        gs.load_fen(self.start_fen)
+        for code in self.moves:
+            gs.make_move(Move.from_code(code, gs.board))
+            yield gs
+
+    def get_keys(self, gs=None):
+
+        """
+        zobrist keys of every position of the game, start position included
+        """
+
+        if gs is None:
+            gs = GameState()
+        gs.load_fen(self.start_fen)
+        keys = {gs.zobrist_key}
+        for position in self.replay(gs):
+            keys.add(position.zobrist_key)
+        return keys
+
+
+def _map(f):
+    size = f.seek(0, 2)
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+
+class GameDatabase:
+    """
+    Directory holding one game database
+    - `games.dat`: header then the packed GameRecords back to back, only ever appended to
+    - `offsets.dat`: data file offset of every game, so game `n` is read without scanning
+    - `positions-<first game>.idx`: sorted `(key, game)` entries, one run per appended batch, see `compact`
+    - opened read only unless `writable`, which also creates a missing database
+    - pickles as its path, a worker process maps the same files again
+    """
+
+    def __init__(self, directory, writable=False):
+
+        self.directory = directory
+        self.writable = writable
+        if writable:
+            os.makedirs(directory, exist_ok=True)
+            if not os.path.exists(os.path.join(directory, DATA_FILE)):
+                with open(os.path.join(directory, DATA_FILE), 'wb') as f:
+                    f.write(HEADER.pack(MAGIC, VERSION))
+                open(os.path.join(directory, OFFSETS_FILE), 'wb').close()
+
+        self.data_map = None
+        self.offsets_map = None
+        self.runs = []
+        mode = 'r+b' if writable else 'rb'
+        self.data_file = open(os.path.join(directory, DATA_FILE), mode)
+        self.offsets_file = open(os.path.join(directory, OFFSETS_FILE), mode)
+        magic, version = HEADER.unpack(self.data_file.read(HEADER.size).ljust(HEADER.size, b'\0'))
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("%s is not a version %d game database" % (directory, VERSION))
+
+        self.remap()
+
+    def remap(self):
+
+        """
+        map the files again after they grew, whole games only: a write cut short by a crash is ignored
+        """
+
+        self.close_maps()
+        self.data_map = _map(self.data_file)
+        self.offsets_map = _map(self.offsets_file)
+        self.games = len(self.offsets_map) // OFFSET.size if self.offsets_map is not None else 0
+        self.end = HEADER.size
+        if self.games:
+            self.end = GameRecord.unpack_from(self.data_map, self.get_offset(self.games - 1))[1]
+
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith(RUN_PREFIX) and name.endswith(RUN_SUFFIX):
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    run = _map(f)
+                if run is not None:
+                    self.runs.append(run)
+
+    def close_maps(self):
+        for m in [self.data_map, self.offsets_map] + self.runs:
+            if m is not None:
+                m.close()
+        self.data_map = None
+        self.offsets_map = None
+        self.runs = []
+
+    def close(self):
+        self.close_maps()
+        self.data_file.close()
+        self.offsets_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.games
+
+    def __getstate__(self):
+        return {'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'])
+
+    def get_offset(self, game):
+        return OFFSET.unpack_from(self.offsets_map, game * OFFSET.size)[0]
+
+    def __getitem__(self, game):
+        if not 0 <= game < self.games:
+            raise IndexError("game %d out of range, the database has %d games" % (game, self.games))
+        return GameRecord.unpack_from(self.data_map, self.get_offset(game))[0]
+
+    def iter_games(self, start=0, stop=None):
+
+        """
+        generator over `(game number, GameRecord)` from `start` up to `stop`, decoded one at a time
+        """
+
+        stop = self.games if stop is None else min(stop, self.games)
+        offset = self.get_offset(start) if start < stop else 0
+        for game in range(start, stop):
+            record, offset = GameRecord.unpack_from(self.data_map, offset)
+            yield game, record
+
+    def find(self, key):
+
+        """
+        sorted numbers of the games that reached the position with zobrist key `key`
+        """
+
+        games = []
+        for run in self.runs:
+            lo, hi = 0, len(run) // INDEX_ENTRY.size
+            entries = hi
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if KEY.unpack_from(run, mid * INDEX_ENTRY.size)[0] < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            while lo < entries:
+                entry_key, game = INDEX_ENTRY.unpack_from(run, lo * INDEX_ENTRY.size)
+                if entry_key != key:
+                    break
+                games.append(game)
+                lo += 1
+        if len(self.runs) > 1:  # runs cover consecutive games, unless a compact was cut short
+            games = sorted(set(games))
+        return [game for game in games if game < self.games]
+
+    def get_games(self, gs):
+
+        """
+        sorted numbers of the games that reached the position of `gs`
+        """
+
+        return self.find(gs.zobrist_key)
+
+    def append(self, records):
+
+        """
+        add GameRecords as one batch, their positions are found by replaying them, returns the first game number
+        """
+
+        gs = GameState()
+        return self.write_batch([(record, record.get_keys(gs)) for record in records])
+
+    def write_batch(self, games):
+
+        """
+        add `(GameRecord, position keys)` pairs: data, then offsets, then a new index run
+        - a crash leaves at worst games without index entries, never index entries without a game
+        """
+
+        if not self.writable:
+            raise ValueError("%s is open read only" % self.directory)
+        first_game = self.games
+        if not games:
+            return first_game
+
+        offsets = array('Q')
+        chunks = []
+        offset = self.end
+        entries = []
+        for game, (record, keys) in enumerate(games, first_game):
+            packed = record.pack()
+            offsets.append(offset)
+            chunks.append(packed)
+            offset += len(packed)
+            entries.extend(key << 32 | game for key in keys)
+        if SWAP_CODES:
+            offsets.byteswap()
+
+        self.data_file.seek(self.end)
+        self.data_file.write(b''.join(chunks))
+        self.data_file.truncate()
+        self.data_file.flush()
+        self.offsets_file.seek(first_game * OFFSET.size)
+        self.offsets_file.write(offsets.tobytes())
+        self.offsets_file.truncate()
+        self.offsets_file.flush()
+
+        entries.sort()
+        pack = INDEX_ENTRY.pack
+        self.write_run(first_game, (pack(entry >> 32, entry & 0xFFFFFFFF) for entry in entries))
+        self.remap()
+        return first_game
+
+    def write_run(self, first_game, packed_entries):
+        path = os.path.join(self.directory, '%s%010d%s' % (RUN_PREFIX, first_game, RUN_SUFFIX))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(b''.join(packed_entries))
+        os.replace(path + '.tmp', path)
+
+    def compact(self):
+
+        """
+        merge all index runs into one, queries then binary search a single file
+        - streams the runs through a heap merge, memory use does not grow with the database
+        """
+
+        if not self.writable:
+            raise ValueError("%s is open read only" % self.directory)
+        if len(self.runs) <= 1:
+            return
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(RUN_PREFIX) and name.endswith(RUN_SUFFIX))
+        merged = heapq.merge(*(INDEX_ENTRY.iter_unpack(run) for run in self.runs))
+        pack = INDEX_ENTRY.pack
+
+        def chunks(size=1 << 16):
+            batch = []
+            for key, game in merged:
+                batch.append(pack(key, game))
+                if len(batch) == size:
+                    yield b''.join(batch)
+                    batch = []
+            yield b''.join(batch)
+
+        path = os.path.join(self.directory, '%s%010d%s' % (RUN_PREFIX, 0, RUN_SUFFIX))
+        with open(path + '.tmp', 'wb') as f:
+            for chunk in chunks():
+                f.write(chunk)
+        self.close_maps()
+        os.replace(path + '.tmp', path)
+        for name in names:
+            if os.path.join(self.directory, name) != path:
+                os.remove(os.path.join(self.directory, name))
+        self.remap()
+
+    def get_size(self):
+
+        """
+        `(data bytes, index bytes)` on disk
+        """
+
+        return self.end, sum(len(run) for run in self.runs)
+
+
+def import_pgn(db, paths, batch_size=10000, compact=True, log=None):
+
+    """
+    validate and store the games of PGN files, writing a batch of `batch_size` games at a time
+    - invalid games are left out and recorded in the errors, the rest of the file is still imported
+    - `compact` merges the index runs of the batches at the end
+    - returns chesspgn.ReplayStats
+    """
+
+    from src import chesspgn
+
+    stats = chesspgn.ReplayStats()
+    start = time.perf_counter()
+    gs = GameState()
+    batch = []
+    moves = []
+
+    for path in paths:
+        for game_number, game in enumerate(chesspgn.read_games(path), 1):
+            start_fen = game.get_start_fen()
+            codes = array('H')
+            keys = set()
+            try:
+                chesspgn.load_start_position(game, gs)
+                keys.add(gs.zobrist_key)
+                for san in game.moves:
+                    gs.get_valid_moves(moves)
+                    move = chesspgn.parse_san(gs, san, moves)
+                    codes.append(move.code)
+                    gs.make_move(move)
+                    keys.add(gs.zobrist_key)
+                record = GameRecord(codes, game.result if game.result in RESULTS else '*', start_fen)
+                record.pack()  # too long to store is an error of this game, not of the batch
+            except ValueError as e:  # PGNError or an oversized game
+                stats.errors.append((path, game_number, str(e)))
+                continue
+
+            batch.append((record, keys))
+            stats.games += 1
+            stats.positions += len(codes)
+            if len(batch) >= batch_size:
+                db.write_batch(batch)
+                batch = []
+                if log is not None:
+                    log("%d games imported in %.1fs" % (stats.games, time.perf_counter() - start))
+
+    db.write_batch(batch)
+    if compact:
+        db.compact()
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+def main(argv=None):
+    from src import chesspgn
+
+    parser = argparse.ArgumentParser(description="build and query a binary game database")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_command = commands.add_parser('import', help="add the games of PGN files")
+    import_command.add_argument('database')
+    import_command.add_argument('paths', nargs='+')
+    import_command.add_argument('--batch', type=int, default=10000, help="games written per batch")
+    import_command.add_argument('--no-compact', action='store_true', help="keep one index run per batch")
+
+    find = commands.add_parser('find', help="list the games that reached a position")
+    find.add_argument('database')
+    find.add_argument('--fen', default=START_FEN)
+    find.add_argument('--limit', type=int, default=20)
+
+    show = commands.add_parser('show', help="print a stored game in SAN")
+    show.add_argument('database')
+    show.add_argument('game', type=int)
+
+    info = commands.add_parser('info', help="games and size of a database")
+    info.add_argument('database')
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        with GameDatabase(args.database, writable=True) as db:
+            stats = import_pgn(db, args.paths, args.batch, not args.no_compact, log=print)
+            for name, game_number, message in stats.errors:
+                print("%s game %d: %s" % (name, game_number, message))
+            print(stats.get_report())
+            print("%d games in %s" % (len(db), args.database))
+        return 1 if stats.errors else 0
+
+    with GameDatabase(args.database) as db:
+        if args.command == 'find':
+            gs = GameState(args.fen)
+            start = time.perf_counter()
+            games = db.get_games(gs)
+            elapsed = time.perf_counter() - start
+            print("%d games in %.2f ms" % (len(games), elapsed * 1000))
+            for game in games[:args.limit]:
+                record = db[game]
+                print("%8d %-7s %d plies" % (game, record.result, len(record)))
+            return 0 if games else 1
+
+        if args.command == 'show':
+            record = db[args.game]
+            gs = GameState(record.start_fen)
+            tokens = []
+            for code in record.moves:
+                if gs.whitetomove:
+                    tokens.append("%d." % gs.fullmove_number)
+                elif not tokens:
+                    tokens.append("%d..." % gs.fullmove_number)
+                move = Move.from_code(code, gs.board)
+                tokens.append(chesspgn.get_san(gs, move))
+                gs.make_move(move)
+            if record.start_fen != START_FEN:
+                print('[FEN "%s"]' % record.start_fen)
+            print(' '.join(tokens + [record.result]))
+            return 0
+
+        data_bytes, index_bytes = db.get_size()
+        print("%d games, %d index runs" % (len(db), len(db.runs)))
+        print("data %d bytes (%.1f per game), index %d bytes (%d entries)" % (
+            data_bytes, data_bytes / max(len(db), 1), index_bytes, index_bytes // INDEX_ENTRY.size))
+        return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
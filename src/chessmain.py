@@ -6,10 +6,15 @@ Built using PyCharm
 """
 
 # Main driver file: responsible for handeling user input and current Gamestate object
+# pygame is only imported once the GUI is launched, so importing this module stays headless
 
 
-import pygame as p
+import argparse
+
 from src import chessengine
+from src import chessworker
+
+p = None  # pygame, bound by load_pygame()
 
 # Consts
 
@@ -18,6 +23,19 @@ DIMENSIONS = 8
 SQ_SIZE = HEIGHT // DIMENSIONS
 MAX_FPS = 15
 IMAGES = {}
+NO_MOVES = chessengine.MoveIndex()
+
+
+def load_pygame():
+    """
+    import pygame on first use
+    """
+
+    global p
+    if p is None:
+        import pygame
+        p = pygame
+    return p
 
 
 def load_images():
@@ -30,178 +48,313 @@ def load_images():
         IMAGES[piece] = p.transform.scale(p.image.load("img/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
 
 
-def main():
+def main(argv=None):
     """
     main game function
+    - `--engine white|black` lets the engine play that side: engine moves, and the valid moves that come with them,
+      are computed by an EngineWorker process the loop only polls, so drawing and input never wait on a search. The
+      engine ponders while the human thinks
+    - without `--engine` no process is started, valid moves are generated in the loop
     """
 
+    parser = argparse.ArgumentParser(description="play chess in a pygame window")
+    parser.add_argument('--engine', choices=('white', 'black'), default=None, help="side the engine plays")
+    parser.add_argument('--depth', type=int, default=4, help="engine search depth")
+    parser.add_argument('--time', type=float, default=2.0, help="engine seconds per move")
+    args = parser.parse_args(argv)
+
+    load_pygame()
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
-    screen.fill(p.Color("white"))
+    worker = chessworker.EngineWorker(args.depth, args.time) if args.engine is not None else None
     gs = chessengine.GameState()
-    valid_moves = gs.get_valid_moves()
-    move_made = False  # flag var for when a valid move is made by user
-    animate = False  # flag var for enabling anims
+    valid_moves = request_moves(worker, gs)  # MoveIndex of the position, None while the worker computes it
+    thinking = False  # flag var for when the engine is searching its move
     game_over = False  # game over
 
     load_images()
+    renderer = BoardRenderer(screen)
 
     running = True
     sq_selected = ()
     player_click = []
 
-    while running:
-
-        for e in p.event.get():
-
-            if e.type == p.QUIT:
-                running = False
-
-            elif e.type == p.MOUSEBUTTONDOWN:
-                if not game_over:
-                    location = p.mouse.get_pos()
-                    col = location[0] // SQ_SIZE
-                    row = location[1] // SQ_SIZE
-
-                    if sq_selected == (row, col):
+    try:
+        while running:
+
+            for e in p.event.get():
+
+                if e.type == p.QUIT:
+                    running = False
+
+                elif e.type == p.MOUSEBUTTONDOWN:
+                    if not game_over:
+                        location = p.mouse.get_pos()
+                        col = location[0] // SQ_SIZE
+                        row = location[1] // SQ_SIZE
+
+                        if sq_selected == (row, col):
+                            sq_selected = ()
+                            player_click = []
+                        else:
+                            sq_selected = (row, col)
+                            player_click = player_click[-1:] + [sq_selected]
+
+                elif e.type == p.KEYDOWN:
+                    if e.key == p.K_z:  # undo, back to the human's last move when playing the engine
+                        gs.undo_move()
+                        if args.engine is not None and not thinking and gs.movelog:
+                            gs.undo_move()
+                    if e.key == p.K_r:  # reset
+                        gs = chessengine.GameState()
+                    if e.key in (p.K_z, p.K_r):
+                        valid_moves = request_moves(worker, gs)  # cancels any search or ponder of the old position
+                        thinking = False
                         sq_selected = ()
                         player_click = []
+                        game_over = False
+
+            for reply in worker.poll() if worker is not None else ():
+                if reply[0] == 'bestmove':
+                    move = chessengine.Move.from_code(reply[1], gs.board)
+                    print(move.get_chess_notation())
+                    gs.make_move(move)
+                    renderer.animate_move(move, gs.board, clock)
+                    worker.ponder(gs)
+                valid_moves = chessworker.decode_moves(reply[-2], gs.board)
+                gs.check_mate, gs.stale_mate, gs.draw_by_repetition = reply[-1]
+                thinking = False
+
+            engine_to_move = args.engine is not None and gs.whitetomove == (args.engine == 'white')
+            if valid_moves is not None and not engine_to_move and len(player_click) == 2:
+                move = valid_moves.get_move(player_click[0], player_click[1])
+                if move is not None:
+                    print(move.get_chess_notation())
+                    gs.make_move(move)
+                    renderer.animate_move(move, gs.board, clock)
+                    if worker is None:
+                        valid_moves = gs.get_valid_moves(indexed=True)
                     else:
-                        sq_selected = (row, col)
-                        player_click.append(sq_selected)
-                    if len(player_click) == 2:
-                        move = chessengine.Move(player_click[0], player_click[1], gs.board)
-                        print(move.get_chess_notation())
-                        for i in range(len(valid_moves)):
-                            if move == valid_moves[i]:
-                                gs.make_move(valid_moves[i])
-                                move_made = True
-                                animate = True
-                                sq_selected = ()
-                                player_click = []
-                        if not move_made:
-                            player_click = [sq_selected]
-
-            elif e.type == p.KEYDOWN:
-                if e.key == p.K_z:  # undo
-                    gs.undo_move()
-                    move_made = True
-                    animate = False
-                if e.key == p.K_r:  # reset
-                    gs = chessengine.GameState()
-                    valid_moves = gs.get_valid_moves()
+                        valid_moves = None  # the engine's reply brings the moves after its own
                     sq_selected = ()
                     player_click = []
-                    move_made = False
-                    animate = False
-
-        if move_made:
-            if animate:
-                animate_move(gs.movelog[-1], screen, gs.board, clock)
-            valid_moves = gs.get_valid_moves()
-            move_made = False
-            animate = False
-
-        draw_game_state(screen, gs, valid_moves, sq_selected)
-
-        if gs.check_mate:
-            game_over = True
-            if gs.whitetomove:
-                draw_text(screen, "Black wins by checkmate")
-            else:
-                draw_text(screen, "White wins by checkmate")
-        elif gs.stale_mate:
-            game_over = True
-            draw_text(screen, "Stalemate")
-
-        clock.tick(MAX_FPS)
-        p.display.flip()
-
+                else:
+                    player_click = [sq_selected]
+
+            text = None
+            if valid_moves is not None:
+                if gs.check_mate:
+                    game_over = True
+                    if gs.whitetomove:
+                        text = "Black wins by checkmate"
+                    else:
+                        text = "White wins by checkmate"
+                elif gs.stale_mate:
+                    game_over = True
+                    text = "Stalemate"
+                elif gs.is_fifty_move_draw():
+                    game_over = True
+                    text = "Draw by fifty-move rule"
+                elif gs.draw_by_repetition:
+                    game_over = True
+                    text = "Draw by repetition"
+                elif gs.is_insufficient_material():
+                    game_over = True
+                    text = "Draw by insufficient material"
+
+            engine_to_move = args.engine is not None and gs.whitetomove == (args.engine == 'white')
+            if engine_to_move and not thinking and not game_over:
+                worker.request_move(gs)  # its reply also brings the human's moves after the engine's
+                valid_moves = None
+                thinking = True
+
+            dirty = renderer.draw_game_state(gs, valid_moves if valid_moves is not None else NO_MOVES, sq_selected,
+                                             text)
+            if dirty:
+                p.display.update(dirty)
+            clock.tick(MAX_FPS)
+    finally:
+        if worker is not None:
+            worker.close()
+
+
+def request_moves(worker, gs):
 
-def draw_board(screen):
     """
-    draw squares on board
+    valid moves of `gs` as a MoveIndex, computed in-process without an engine worker
+    - with a worker they are requested from it and `None` is returned, they arrive with `poll()`
     """
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
 
-    for r in range(DIMENSIONS):
-        for c in range(DIMENSIONS):
-            color = colors[((r + c) % 2)]
-            p.draw.rect(screen, color, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    if worker is None:
+        return gs.get_valid_moves(indexed=True)
+    worker.request_moves(gs)
+    return None
 
 
-def draw_pieces(screen, board):
+class BoardRenderer:
     """
-    draw pieces on board
+    Draws the game with dirty rectangles instead of full frames
+    - the empty board is rendered once, squares are restored from it with an area blit
+    - the pieces and highlights on screen are remembered, only squares that differ are redrawn
+    - methods return the rects they drew so the caller can pass them to `display.update`
     """
 
-    for r in range(DIMENSIONS):
-        for c in range(DIMENSIONS):
+    def __init__(self, screen):
 
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        self.screen = screen
+        colors = [p.Color("white"), p.Color("gray")]
+        self.background = p.Surface((WIDTH, HEIGHT))
+        for r in range(DIMENSIONS):
+            for c in range(DIMENSIONS):
+                p.draw.rect(self.background, colors[(r + c) % 2], self.get_square_rect(r, c))
 
-
-def highlight_squares(screen, gs, valid_moves, sq_selected):
-    if sq_selected != ():
-        r, c = sq_selected
-        if gs.board[r][c][0] == ('w' if gs.whitetomove else 'b'):
+        self.highlights = {}
+        for color in ('blue', 'yellow'):
             s = p.Surface((SQ_SIZE, SQ_SIZE))
             s.set_alpha(100)
-            s.fill(p.Color('blue'))
-            screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-
-            s.fill(p.Color('yellow'))
-            for move in valid_moves:
-                if move.start_row == r and move.start_col == c:
-                    screen.blit(s, (move.end_col * SQ_SIZE, move.end_row * SQ_SIZE))
-
+            s.fill(p.Color(color))
+            self.highlights[color] = s
+
+        self.font = p.font.SysFont("Arial", 32, True, False)
+        self.text_cache = {}
+        self.text = None  # message currently on screen
+        self.text_rect = None
+
+        self.drawn_board = None  # pieces on screen, None forces a full redraw
+        self.drawn_highlights = {}
+
+    @staticmethod
+    def get_square_rect(r, c):
+        return p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+
+    def invalidate(self):
+        self.drawn_board = None
+
+    def draw_square(self, r, c, piece, highlight=None):
+        rect = self.get_square_rect(r, c)
+        self.screen.blit(self.background, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
+
+    def draw_board(self, board, highlights, overrides=None):
+
+        """
+        bring the screen in line with `board`, returns the dirty rects
+        - `highlights` maps `(row, col)` to a highlight color
+        - `overrides` maps `(row, col)` to the piece to show there instead of the board's
+        """
+
+        dirty = []
+        full = self.drawn_board is None
+        if full:
+            self.screen.blit(self.background, (0, 0))
+            self.drawn_board = [["--"] * DIMENSIONS for _ in range(DIMENSIONS)]
+            self.drawn_highlights = {}
+            dirty.append(self.screen.get_rect())
+
+        drawn_board = self.drawn_board
+        drawn_highlights = self.drawn_highlights
+        for r in range(DIMENSIONS):
+            row = board[r]
+            drawn_row = drawn_board[r]
+            for c in range(DIMENSIONS):
+                piece = row[c] if overrides is None else overrides.get((r, c), row[c])
+                highlight = highlights.get((r, c))
+                if piece != drawn_row[c] or highlight != drawn_highlights.get((r, c)):
+                    rect = self.draw_square(r, c, piece, highlight)
+                    drawn_row[c] = piece
+                    if not full:
+                        dirty.append(rect)
+
+        self.drawn_highlights = highlights
+        return dirty
+
+    def draw_game_state(self, gs, valid_moves, sq_selected, text=None):
+
+        """
+        responsible for all graphics in current gamestates, `text` is a message drawn over the board
+        """
+
+        if text != self.text and self.text is not None:  # message taken down or replaced
+            self.text = None
+            self.invalidate()
+        dirty = self.draw_board(gs.board, highlight_squares(gs, valid_moves, sq_selected))
+        if text is not None and (text != self.text or self.text_rect.collidelist(dirty) != -1):
+            dirty.append(self.draw_text(text))
+        return dirty
+
+    def animate_move(self, move, board, clock):
+
+        """
+        slide the moved piece over the board, each frame only redraws the squares under its old and new position
+        """
+
+        end = (move.end_row, move.end_col)
+        # the board already holds the move, show the captured piece on the end square until the slide is done
+        overrides = {end: move.piece_captured}
+        p.display.update(self.draw_board(board, {}, overrides))
+
+        dR = move.end_row - move.start_row
+        dC = move.end_col - move.start_col
+        frames_per_sq = 10  # frames per square
+        frame_count = (abs(dR) + abs(dC)) * frames_per_sq
+        previous = None
+        for frame in range(frame_count + 1):
+            r, c = ((move.start_row + dR * (frame / frame_count),
+                     move.start_col + dC * (frame / frame_count)))
+            rect = p.Rect(round(c * SQ_SIZE), round(r * SQ_SIZE), SQ_SIZE, SQ_SIZE)
+            dirty = [rect]
+            if previous is not None:
+                # restore every square the piece covered last frame
+                for sq_r in range(previous.top // SQ_SIZE, (previous.bottom - 1) // SQ_SIZE + 1):
+                    for sq_c in range(previous.left // SQ_SIZE, (previous.right - 1) // SQ_SIZE + 1):
+                        self.draw_square(sq_r, sq_c, overrides.get((sq_r, sq_c), board[sq_r][sq_c]))
+                dirty.append(previous)
+            self.screen.blit(IMAGES[move.piece_moved], rect)
+            p.display.update(dirty)
+            previous = rect
+            clock.tick(60)
+
+        # the slide drew over squares behind the renderer's back, the next frame repaints the end square
+        self.drawn_board[end[0]][end[1]] = None
+
+    def get_text_surfaces(self, text):
+        surfaces = self.text_cache.get(text)
+        if surfaces is None:
+            surfaces = (self.font.render(text, 0, p.Color('white')), self.font.render(text, 0, p.Color('black')))
+            self.text_cache[text] = surfaces
+        return surfaces
+
+    def draw_text(self, text):
+        light, dark = self.get_text_surfaces(text)
+        text_location = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH / 2 - light.get_width() / 2,
+                                                         HEIGHT / 2 - light.get_height() / 2)
+        self.screen.blit(light, text_location)
+        self.screen.blit(dark, text_location.move(2, 2))
+        self.text = text
+        self.text_rect = p.Rect(text_location.topleft, (light.get_width() + 2, light.get_height() + 2))
+        return self.text_rect
+
+
+def highlight_squares(gs, valid_moves, sq_selected):
 
-def draw_game_state(screen, gs, valid_moves, sq_selected):
     """
-    responsible for all graphics in current gamestates
+    highlight colors by square: the selected piece in blue, its destinations in yellow
+    - `valid_moves` is the MoveIndex of the position
     """
 
-    draw_board(screen)
-    highlight_squares(screen, gs, valid_moves, sq_selected)
-    draw_pieces(screen, gs.board)
-
-
-def animate_move(move, screen, board, clock):
-    global colors
-    dR = move.end_row - move.start_row
-    dC = move.end_col - move.start_col
-    frames_per_sq = 10  # frames per square
-    frame_count = (abs(dR) + abs(dC)) * frames_per_sq
-    for frame in range(frame_count + 1):
-        r, c = ((move.start_row + dR * (frame / frame_count),
-                 move.start_col + dC * (frame / frame_count)))
-        draw_board(screen)
-        draw_pieces(screen, board)
-        # erase piece moved from ending square
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = p.Rect(move.end_col * SQ_SIZE, move.end_row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, end_square)
-        # draw captured piece into rect
-        if move.piece_captured != '--':
-            screen.blit(IMAGES[move.piece_captured], end_square)
-        # draw moving piece
-        screen.blit(IMAGES[move.piece_moved], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
-
-
-def draw_text(screen, text):
-    font = p.font.SysFont("Arial", 32, True, False)
-    text_obj = font.render(text, 0, p.Color('white'))
-    text_location = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH / 2 - text_obj.get_width() / 2,
-                                                     HEIGHT / 2 - text_obj.get_height() / 2)
-    screen.blit(text_obj, text_location)
-    text_obj = font.render(text, 0, p.Color('black'))
-    screen.blit(text_obj, text_location.move(2, 2))
+    highlights = {}
+    if sq_selected != ():
+        r, c = sq_selected
+        if gs.board[r][c][0] == ('w' if gs.whitetomove else 'b'):
+            highlights[(r, c)] = 'blue'
+            for move in valid_moves.get_moves_from(r, c):
+                highlights[(move.end_row, move.end_col)] = 'yellow'
+    return highlights
 
 
 if __name__ == "__main__":
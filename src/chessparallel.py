@@ -0,0 +1,162 @@
+"""
+File chessparallel.py from project Project_Chess_Game
+
+"""
+
+
+# Multi-process perft and search: root moves are split across a process pool, every worker rebuilds the position
+# from a GameState snapshot and the results are merged back in root move order so output is deterministic
+
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src.chessengine import GameState, Move, TranspositionTable
+from src.chessbitboard import BitboardGameState
+from src import chessperft
+from src import chesssearch
+
+BACKENDS = {'mailbox': GameState, 'bitboard': BitboardGameState}
+
+
+def _play_root_move(backend, snapshot, move_code):
+    gs = BACKENDS[backend].from_snapshot(snapshot)
+    gs.make_move(Move.from_code(move_code, gs.board))
+    return gs
+
+
+def _perft_task(task):
+    backend, snapshot, move_code, depth, tt_mb = task
+    gs = _play_root_move(backend, snapshot, move_code)
+    return chessperft.perft(gs, depth, TranspositionTable(tt_mb) if tt_mb else None)
+
+
+def _search_task(task):
+
+    """
+    search one root move, returns `(score, depth, nodes, pv codes)`
+    - the score is from the root side's point of view, the depth counts the root move
+    - depth 0 means the deadline passed before the child finished one ply, the score is then only the quiescence
+      score of the child position
+    """
+
+    backend, snapshot, move_code, depth, deadline, tt_mb = task
+    gs = _play_root_move(backend, snapshot, move_code)
+    searcher = chesssearch.Search(gs, TranspositionTable(tt_mb))
+
+    if depth > 1:
+        time_limit = max(0.0, deadline - time.time()) if deadline is not None else None
+        result = searcher.search(max_depth=depth - 1, time_limit=time_limit)
+        if result.depth > 0 or result.best_move is None:  # no legal move is final at any depth
+            score = -result.score
+            if abs(score) >= chesssearch.MATE_THRESHOLD:  # mate distance counted from the child, one ply further
+                score -= 1 if score > 0 else -1
+            finished = result.depth + 1 if result.best_move is not None else depth
+            return score, finished, result.nodes, [move_code] + [move.code for move in result.pv]
+
+    # negamax at depth 0 from ply 1: quiescence with the draw rules, mate and stalemate seen, no limits
+    searcher.stop_time = None
+    searcher.node_limit = None
+    score = -searcher.negamax(0, -chesssearch.INFINITY, chesssearch.INFINITY, 1)
+    return score, 1 if depth <= 1 else 0, searcher.nodes, [move_code]
+
+
+def parallel_perft(gs, depth, workers=None, tt_mb=0, backend='mailbox'):
+
+    """
+    perft with every root move counted in its own worker process
+    - returns `[(move, nodes), ...]` in root move order, the total is their sum
+    - depth 0 counts only the position itself, returned as `[(None, 1)]`
+    """
+
+    if depth <= 0:
+        return [(None, 1)]
+    moves = gs.get_valid_moves()
+    if depth == 1:
+        return [(move, 1) for move in moves]
+
+    snapshot = gs.snapshot()
+    tasks = [(backend, snapshot, move.code, depth - 1, tt_mb) for move in moves]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        counts = list(executor.map(_perft_task, tasks))
+    return list(zip(moves, counts))
+
+
+def parallel_search(gs, depth, workers=None, time_limit=None, tt_mb=16, backend='mailbox'):
+
+    """
+    root split search: every root move is searched to `depth - 1` in a worker, the best score wins
+    - ties go to the earlier root move so a fixed depth search always picks the same move
+    - with `time_limit` every worker stops at the shared deadline, results then depend on machine load; root moves
+      whose search did not finish a ply are only picked when no root move finished one
+    - returns a SearchResult, `nodes` summed over all workers
+    """
+
+    start = time.perf_counter()
+    moves = gs.get_valid_moves()
+    if not moves:
+        return chesssearch.SearchResult(None, -chesssearch.MATE_SCORE if gs.check_mate else 0, 0, 0, 0.0, [])
+
+    deadline = time.time() + time_limit if time_limit is not None else None
+    snapshot = gs.snapshot()
+    tasks = [(backend, snapshot, move.code, depth, deadline, tt_mb) for move in moves]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        results = list(executor.map(_search_task, tasks))
+
+    # a timed out child's score is shallower than the rest, it only counts when no child finished
+    candidates = [i for i in range(len(results)) if results[i][1] > 0] or list(range(len(results)))
+    best = candidates[0]
+    for i in candidates[1:]:
+        if results[i][0] > results[best][0]:
+            best = i
+    score, _, _, pv_codes = results[best]
+    depth = min(results[i][1] for i in candidates)  # every candidate was searched at least this deep
+
+    # rebuild the principal variation as Move objects on the caller's position
+    pv = []
+    for code in pv_codes:
+        move = Move.from_code(code, gs.board)
+        pv.append(move)
+        gs.make_move(move)
+    for _ in pv:
+        gs.undo_move()
+    gs.get_valid_moves()  # restore the game over flags of the root position
+
+    nodes = sum(result[2] for result in results)
+    return chesssearch.SearchResult(pv[0], score, depth, nodes, time.perf_counter() - start, pv)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="perft and search split over worker processes")
+    parser.add_argument('mode', choices=('perft', 'search'))
+    parser.add_argument('--fen', default=chessperft.START_FEN)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes, defaults to the cpu count")
+    parser.add_argument('--time', type=float, default=None, help="search time limit in seconds")
+    parser.add_argument('--tt-mb', type=int, default=0, help="transposition table size per worker")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='mailbox')
+    args = parser.parse_args(argv)
+
+    gs = BACKENDS[args.backend](args.fen)
+    start = time.perf_counter()
+    if args.mode == 'perft':
+        results = parallel_perft(gs, args.depth, args.workers, args.tt_mb, args.backend)
+        for move, nodes in results:
+            if move is not None:
+                print("%s: %d" % (move.get_chess_notation(), nodes))
+        nodes = sum(result[1] for result in results)
+        elapsed = time.perf_counter() - start
+        print("depth %d: %d nodes in %.2fs (%d nodes/sec)" % (args.depth, nodes, elapsed,
+                                                              nodes / elapsed if elapsed else 0))
+    else:
+        result = parallel_search(gs, args.depth, args.workers, args.time, args.tt_mb or 16, args.backend)
+        print("bestmove %s score %d depth %d nodes %d nps %d pv %s" % (
+            result.best_move.get_chess_notation() if result.best_move else '(none)', result.score, result.depth,
+            result.nodes, result.nps, result.get_pv_notation()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
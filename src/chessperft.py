@@ -0,0 +1,245 @@
+"""
+File chessperft.py from project Project_Chess_Game
+
+"""
+
+
+# Perft: counts leaf nodes of the legal move tree to check move generation against known totals and time it
+
+
+import argparse
+import time
+
+from src.chessengine import GameState, TranspositionTable, START_FEN
+from src.chessbitboard import BitboardGameState
+from src import chessepd
+
+# (name, fen, {depth: nodes}), counts from the chessprogramming wiki perft results and Martin Sedlak's edge cases
+REFERENCE_POSITIONS = [
+    ("start position", START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    ("illegal enpassant 1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+     {6: 1134888}),
+    ("illegal enpassant 2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+     {6: 1015133}),
+    ("enpassant gives check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+     {6: 1440467}),
+    ("short castling gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+     {6: 661072}),
+    ("long castling gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1",
+     {6: 803711}),
+    ("castling rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+     {4: 1274206}),
+    ("castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1",
+     {4: 1720476}),
+    ("promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",
+     {6: 3821001}),
+    ("discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1",
+     {5: 1004658}),
+    ("promote to give check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1",
+     {6: 217342}),
+    ("underpromote to give check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1",
+     {6: 92683}),
+    ("self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1",
+     {6: 2217}),
+    ("stalemate and checkmate 1", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1",
+     {7: 567584}),
+    ("stalemate and checkmate 2", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+     {4: 23527}),
+]
+
+# (name, fen, GameState.get_status()), draws by material against the endings that can still be won
+STATUS_POSITIONS = [
+    ("KRK", "8/8/8/4k3/8/8/8/R3K3 w - - 0 1", 'active'),
+    ("KQK", "8/8/8/4k3/8/8/8/3QK3 w - - 0 1", 'active'),
+    ("KBK", "8/8/8/4k3/8/8/8/2B1K3 w - - 0 1", 'insufficient material'),
+    ("KNK", "8/8/8/4k3/8/8/8/1N2K3 b - - 0 1", 'insufficient material'),
+    ("KPK", "8/8/8/4k3/8/8/P7/4K3 w - - 0 1", 'active'),
+    ("KNNK", "8/8/8/4k3/8/8/8/1N2K1N1 w - - 0 1", 'active'),
+    ("KBKB same colored", "5b2/8/8/4k3/8/8/8/2B1K3 w - - 0 1", 'insufficient material'),
+    ("KBKB opposite colored", "2b5/8/8/4k3/8/8/8/2B1K3 w - - 0 1", 'active'),
+    ("KBKN", "2n5/8/8/4k3/8/8/8/2B1K3 w - - 0 1", 'active'),
+    ("KBBK same colored", "8/8/8/4k3/8/8/1B6/2B1K3 w - - 0 1", 'insufficient material'),
+    ("fifty moves", "8/8/8/4k3/8/8/8/R3K3 w - - 100 80", 'fifty moves'),
+    ("mate on the hundredth halfmove", "R5k1/5ppp/8/8/8/8/8/6K1 b - - 100 80", 'checkmate'),
+    ("stalemate", "7k/5Q2/6K1/8/8/8/8/8 b - - 0 1", 'stalemate'),
+]
+
+BACKENDS = {'mailbox': GameState, 'bitboard': BitboardGameState}
+
+
+def perft(gs, depth, tt=None):
+
+    """
+    number of leaf nodes `depth` plies below the current position
+    - `tt` is an optional TranspositionTable caching subtree counts
+    """
+
+    buffers = [[] for _ in range(depth + 1)]  # one reusable move list per ply
+    return _perft(gs, depth, tt, buffers)
+
+
+def _perft(gs, depth, tt, buffers):
+    if depth == 0:
+        return 1
+
+    if tt is not None and depth > 1:
+        entry = tt.probe(gs.zobrist_key)
+        if entry is not None and entry[0] == depth:
+            return entry[2]
+
+    moves = gs.get_valid_moves(buffers[depth])
+    if depth == 1:  # bulk counting, the leaves don't need to be played
+        return len(moves)
+
+    nodes = 0
+    for i in range(len(moves)):
+        gs.make_move(moves[i])
+        nodes += _perft(gs, depth - 1, tt, buffers)
+        gs.undo_move()
+
+    if tt is not None and nodes < TranspositionTable.SCORE_OFFSET:
+        tt.store(gs.zobrist_key, depth, TranspositionTable.EXACT, nodes)
+    return nodes
+
+
+def divide(gs, depth, tt=None):
+
+    """
+    perft split by root move, returns a list of `(move, nodes)`
+    """
+
+    results = []
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        results.append((move, perft(gs, depth - 1, tt) if depth > 1 else 1))
+        gs.undo_move()
+    return results
+
+
+def run_perft(fen, depth, backend='mailbox', show_divide=False, tt_mb=0):
+
+    """
+    time a perft run and print the node count and nodes/sec, returns the node count
+    """
+
+    gs = BACKENDS[backend](fen)
+    tt = TranspositionTable(tt_mb) if tt_mb else None
+
+    start = time.perf_counter()
+    if show_divide:
+        results = divide(gs, depth, tt)
+        for move, nodes in sorted(results, key=lambda result: result[0].get_chess_notation()):
+            print("%s: %d" % (move.get_chess_notation(), nodes))
+        nodes = sum(result[1] for result in results)
+    else:
+        nodes = perft(gs, depth, tt)
+    elapsed = time.perf_counter() - start
+
+    print("depth %d: %d nodes in %.2fs (%d nodes/sec)" % (depth, nodes, elapsed, nodes / elapsed if elapsed else 0))
+    if tt is not None:
+        print("tt: %s" % tt.stats())
+    return nodes
+
+
+def run_suite(max_depth=3, backend='mailbox', tt_mb=0):
+
+    """
+    check every reference position against its known counts up to `max_depth`, returns True if all match
+    """
+
+    passed = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, counts in REFERENCE_POSITIONS:
+        depths = [depth for depth in sorted(counts) if depth <= max_depth]
+        if not depths:
+            continue
+        depth = depths[-1]
+        gs = BACKENDS[backend](fen)
+        tt = TranspositionTable(tt_mb) if tt_mb else None
+
+        start = time.perf_counter()
+        nodes = perft(gs, depth, tt)
+        elapsed = time.perf_counter() - start
+        total_nodes += nodes
+        total_time += elapsed
+
+        ok = nodes == counts[depth]
+        passed = passed and ok
+        print("%-4s %-28s depth %d: %10d (expected %10d) %6.2fs" % (
+            "ok" if ok else "FAIL", name, depth, nodes, counts[depth], elapsed))
+
+    print("%d nodes in %.2fs (%d nodes/sec)" % (total_nodes, total_time, total_nodes / total_time if total_time else 0))
+    return check_statuses(backend) and passed
+
+
+def check_statuses(backend='mailbox'):
+
+    """
+    check the game status of every STATUS_POSITIONS entry, returns True if all match
+    """
+
+    passed = True
+    for name, fen, expected in STATUS_POSITIONS:
+        status = BACKENDS[backend](fen).get_status()
+        ok = status == expected
+        passed = passed and ok
+        print("%-4s %-32s %s (expected %s)" % ("ok" if ok else "FAIL", name, status, expected))
+    return passed
+
+
+def run_epd(path, max_depth=3, backend='mailbox', tt_mb=0):
+
+    """
+    check a perft EPD file (`<fen> ;D1 20 ;D2 400 ...`) up to `max_depth`, streaming one position at a time
+    """
+
+    passed = True
+    for line_number, (gs, operations) in enumerate(chessepd.read_positions(path, BACKENDS[backend]()), 1):
+        counts = {int(opcode[1:]): int(operand) for opcode, operand in operations.items()
+                  if opcode[:1] == 'D' and opcode[1:].isdigit()}
+        depths = [depth for depth in sorted(counts) if depth <= max_depth]
+        if not depths:
+            continue
+        depth = depths[-1]
+        fen = gs.get_fen()
+        nodes = perft(gs, depth, TranspositionTable(tt_mb) if tt_mb else None)
+        ok = nodes == counts[depth]
+        passed = passed and ok
+        print("%-4s %d %s depth %d: %d (expected %d)" % ("ok" if ok else "FAIL", line_number, fen, depth, nodes,
+                                                        counts[depth]))
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="perft move generation counts and timing")
+    parser.add_argument('--fen', default=START_FEN, help="position to count from")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--divide', action='store_true', help="print the node count under every root move")
+    parser.add_argument('--suite', action='store_true', help="check the reference positions up to --depth")
+    parser.add_argument('--epd', help="check a perft EPD file with `;D<depth> <nodes>` operations up to --depth")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='mailbox')
+    parser.add_argument('--tt-mb', type=int, default=0, help="transposition table size, 0 to disable")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.depth, args.backend, args.tt_mb) else 1
+    if args.epd:
+        return 0 if run_epd(args.epd, args.depth, args.backend, args.tt_mb) else 1
+    run_perft(args.fen, args.depth, args.backend, args.divide, args.tt_mb)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
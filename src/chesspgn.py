@@ -0,0 +1,339 @@
+"""
+File chesspgn.py from project Project_Chess_Game
+
+"""
+
+
+# PGN replay: streams games out of PGN files, resolves SAN moves against GameState.get_valid_moves and reports
+# throughput. Files are read a game at a time and can be fanned out over a process pool
+
+
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src.chessengine import GameState, Move, START_FEN
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+# comments, NAGs, variation brackets and everything else as one token
+MOVETEXT_TOKENS = re.compile(r'\{[^}]*\}|;[^\n]*|\$\d+|\(|\)|[^\s{}();$]+')
+MOVE_NUMBER = re.compile(r'^\d+\.*')
+HEADER = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+
+
+class PGNError(ValueError):
+    """
+    raised for a SAN move that is illegal or ambiguous in its position
+    """
+
+
+class PGNGame:
+    """
+    One game of a PGN file: tag pairs, SAN moves of the main line and the result token
+    """
+
+    def __init__(self, headers, moves, result):
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+
+    def get_start_fen(self):
+        if self.headers.get('SetUp', '1') == '1' and 'FEN' in self.headers:
+            return self.headers['FEN']
+        return START_FEN
+
+
+class ReplayStats:
+    """
+    Counters of a replay run, can be merged across files and processes
+    """
+
+    def __init__(self, games=0, positions=0, errors=None, elapsed=0.0):
+        self.games = games
+        self.positions = positions
+        self.errors = errors if errors is not None else []
+        self.elapsed = elapsed
+
+    def merge(self, other):
+        self.games += other.games
+        self.positions += other.positions
+        self.errors.extend(other.errors)
+
+    def get_report(self):
+        elapsed = self.elapsed or 1e-9
+        return "%d games, %d positions, %d invalid in %.2fs (%.1f games/sec, %.1f positions/sec)" % (
+            self.games, self.positions, len(self.errors), self.elapsed, self.games / elapsed,
+            self.positions / elapsed)
+
+
+def read_games(source):
+
+    """
+    generator over the games of a PGN file, `source` is a path or an open text file
+    - only one game's text is held in memory at a time
+    """
+
+    if isinstance(source, str):
+        with open(source, encoding='utf-8', errors='replace') as f:
+            yield from _read_games(f)
+    else:
+        yield from _read_games(source)
+
+
+def _read_games(lines):
+    headers = {}
+    movetext = []
+    open_comments = 0  # a brace comment can run over several lines
+
+    for line in lines:
+        stripped = line.strip()
+        if open_comments == 0 and stripped.startswith('['):
+            if movetext:  # tags after movetext start the next game
+                yield _parse_game(headers, movetext)
+                headers = {}
+                movetext = []
+            match = HEADER.match(stripped)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"')
+        elif stripped and not stripped.startswith('%'):
+            movetext.append(stripped)
+            open_comments += stripped.count('{') - stripped.count('}')
+
+    if headers or movetext:
+        yield _parse_game(headers, movetext)
+
+
+def _parse_game(headers, movetext):
+
+    """
+    main line SAN moves and result out of the movetext, skipping comments, NAGs and variations
+    """
+
+    moves = []
+    result = headers.get('Result', '*')
+    variation_depth = 0
+    for token in MOVETEXT_TOKENS.findall('\n'.join(movetext)):
+        first = token[0]
+        if first == '(':
+            variation_depth += 1
+        elif first == ')':
+            variation_depth -= 1
+        elif first in '{;$' or variation_depth > 0:
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            san = MOVE_NUMBER.sub('', token)
+            if san:
+                moves.append(san)
+    return PGNGame(headers, moves, result)
+
+
+def parse_san(gs, san, moves=None):
+
+    """
+    the Move of `gs` that SAN string `san` describes
+    - `moves` can be the already generated valid moves of `gs`
+    - raises PGNError if no move or more than one move matches
+    """
+
+    if moves is None:
+        moves = gs.get_valid_moves()
+
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        long_castle = len(text) == 5
+        for move in moves:
+            if move.is_castling_move and (move.end_col < move.start_col) == long_castle:
+                return move
+        raise PGNError("illegal castling %r in %s" % (san, gs.get_fen()))
+
+    promotion = None
+    if '=' in text:
+        text, promotion = text.split('=', 1)
+        promotion = promotion[:1].upper()
+    elif len(text) > 2 and text[-1] in 'QRBN' and text[0] in Move.files_cols:  # promotion without '=', e.g. e8Q
+        text, promotion = text[:-1], text[-1]
+
+    if text[:1] in ('K', 'Q', 'R', 'B', 'N'):
+        piece_type = text[0]
+        text = text[1:]
+    else:
+        piece_type = 'p'
+    text = text.replace('x', '').replace('-', '')
+
+    destination = text[-2:]
+    if len(destination) != 2 or destination[0] not in Move.files_cols or destination[1] not in Move.ranks_rows:
+        raise PGNError("cannot read SAN move %r" % san)
+    end_row = Move.ranks_rows[destination[1]]
+    end_col = Move.files_cols[destination[0]]
+
+    start_col = start_row = None
+    for char in text[:-2]:  # disambiguation, file and/or rank of the moving piece
+        if char in Move.files_cols:
+            start_col = Move.files_cols[char]
+        elif char in Move.ranks_rows:
+            start_row = Move.ranks_rows[char]
+        else:
+            raise PGNError("cannot read SAN move %r" % san)
+
+    if piece_type == 'p' and promotion is None and (end_row == 0 or end_row == 7):
+        promotion = 'Q'
+
+    found = None
+    for move in moves:
+        if move.end_row != end_row or move.end_col != end_col or move.piece_moved[1] != piece_type:
+            continue
+        if (start_col is not None and move.start_col != start_col) or \
+                (start_row is not None and move.start_row != start_row):
+            continue
+        if move.promotion_piece != promotion:
+            continue
+        if found is not None:
+            raise PGNError("ambiguous move %r in %s" % (san, gs.get_fen()))
+        found = move
+
+    if found is None:
+        raise PGNError("illegal move %r in %s" % (san, gs.get_fen()))
+    return found
+
+
+def get_san(gs, move, moves=None):
+
+    """
+    standard algebraic notation of `move` in the current position of `gs`, with check and mate marks
+    """
+
+    if moves is None:
+        moves = gs.get_valid_moves()
+
+    if move.is_castling_move:
+        san = 'O-O' if move.end_col > move.start_col else 'O-O-O'
+    else:
+        destination = move.get_rank_file(move.end_row, move.end_col)
+        capture = 'x' if move.piece_captured != "--" else ''
+        piece_type = move.piece_moved[1]
+
+        if piece_type == 'p':
+            san = (move.cols_files[move.start_col] + capture if capture else '') + destination
+            if move.is_pawn_promotion:
+                san += '=' + move.promotion_piece
+        else:
+            others = [other for other in moves if other.piece_moved == move.piece_moved and
+                      other.end_row == move.end_row and other.end_col == move.end_col and
+                      (other.start_row, other.start_col) != (move.start_row, move.start_col)]
+            disambiguation = ''
+            if others:
+                if all(other.start_col != move.start_col for other in others):
+                    disambiguation = move.cols_files[move.start_col]
+                elif all(other.start_row != move.start_row for other in others):
+                    disambiguation = move.rows_ranks[move.start_row]
+                else:
+                    disambiguation = move.get_rank_file(move.start_row, move.start_col)
+            san = piece_type + disambiguation + capture + destination
+
+    flags = (gs.check_mate, gs.stale_mate, gs.draw_by_repetition)
+    gs.make_move(move)
+    if gs.in_check():
+        san += '#' if len(gs.get_valid_moves()) == 0 else '+'
+    gs.undo_move()
+    gs.check_mate, gs.stale_mate, gs.draw_by_repetition = flags
+    return san
+
+
+def load_start_position(game, gs):
+
+    """
+    set `gs` to the start position of `game`, raises PGNError for an invalid FEN header
+    """
+
+    try:
+        gs.load_fen(game.get_start_fen())
+    except ValueError as e:
+        raise PGNError("invalid start position: %s" % e)
+
+
+def replay_game(game, gs=None):
+
+    """
+    generator that plays `game` on `gs` and yields it after every move, so positions can be pulled out as they pass
+    - `gs` is reset to the game's start position first and reused, copy it if a position has to be kept
+    - raises PGNError for an invalid start position and at the first illegal move
+    """
+
+    if gs is None:
+        gs = GameState()
+    load_start_position(game, gs)
+
+    moves = []
+    for san in game.moves:
+        gs.get_valid_moves(moves)
+        gs.make_move(parse_san(gs, san, moves))
+        yield gs
+
+
+def replay_file(source, on_position=None, gs=None):
+
+    """
+    replay and validate every game of a PGN file, returns ReplayStats
+    - `on_position(game, gs)` is called after every move when given
+    - invalid games are recorded in `errors` as `(game number, message)` and the replay carries on
+    """
+
+    if gs is None:
+        gs = GameState()
+    stats = ReplayStats()
+    start = time.perf_counter()
+
+    for game_number, game in enumerate(read_games(source), 1):
+        stats.games += 1
+        try:
+            for position in replay_game(game, gs):
+                stats.positions += 1
+                if on_position is not None:
+                    on_position(game, position)
+        except PGNError as e:
+            name = source if isinstance(source, str) else getattr(source, 'name', '<stream>')
+            stats.errors.append((name, game_number, str(e)))
+
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+def replay_files(paths, workers=1):
+
+    """
+    replay many PGN files, one file per task on a process pool when `workers` > 1, returns merged ReplayStats
+    """
+
+    start = time.perf_counter()
+    total = ReplayStats()
+    if workers == 1:
+        for path in paths:
+            total.merge(replay_file(path))
+    else:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            for stats in executor.map(replay_file, paths):
+                total.merge(stats)
+    total.elapsed = time.perf_counter() - start
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="replay and validate PGN files")
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--workers', type=int, default=1, help="processes to spread files over, 0 for the cpu count")
+    args = parser.parse_args(argv)
+
+    stats = replay_files(args.paths, args.workers)
+    for name, game_number, message in stats.errors:
+        print("%s game %d: %s" % (name, game_number, message))
+    print(stats.get_report())
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
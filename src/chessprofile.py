@@ -0,0 +1,205 @@
+"""
+File chessprofile.py from project Project_Chess_Game
+
+"""
+
+
+# Opt-in engine instrumentation: counters for the hot paths of one GameState and time per piece move generator.
+# Nothing is installed until a Profiler is entered, it then shadows the methods on that one instance and puts
+# them back on exit, so an unprofiled GameState runs the exact same code as before
+
+
+import argparse
+import cProfile
+import io
+import pstats
+import time
+
+from src.chessengine import GameState, Move
+from src.chessbitboard import BitboardGameState
+
+BACKENDS = {'mailbox': GameState, 'bitboard': BitboardGameState}
+
+# GameState methods counted per call
+COUNTED_METHODS = ('get_valid_moves', 'make_move', 'undo_move', 'sq_under_attack')
+
+# move generators timed per piece type, in the order they are reported
+GENERATORS = {'p': 'pawn', 'N': 'knight', 'B': 'bishop', 'R': 'rook', 'Q': 'queen', 'K': 'king'}
+
+
+class EngineProfile:
+    """
+    Counters of one profiled run, can be merged across runs
+    - `counts` by method name plus 'moves constructed', every Move built while profiling from any GameState
+    - `generator_calls` and `generator_time` (seconds) by piece type, only the mailbox generators are timed
+    """
+
+    def __init__(self):
+        self.counts = dict.fromkeys(COUNTED_METHODS + ('moves constructed',), 0)
+        self.generator_calls = dict.fromkeys(GENERATORS, 0)
+        self.generator_time = dict.fromkeys(GENERATORS, 0.0)
+        self.elapsed = 0.0
+
+    def merge(self, other):
+        for name, count in other.counts.items():
+            self.counts[name] += count
+        for piece_type in GENERATORS:
+            self.generator_calls[piece_type] += other.generator_calls[piece_type]
+            self.generator_time[piece_type] += other.generator_time[piece_type]
+        self.elapsed += other.elapsed
+
+    def get_report(self):
+
+        """
+        counters and generator times as printable lines
+        """
+
+        lines = ["%-18s %10d" % (name, count) for name, count in self.counts.items()]
+        for piece_type, name in GENERATORS.items():
+            calls = self.generator_calls[piece_type]
+            if calls:
+                seconds = self.generator_time[piece_type]
+                lines.append("%-18s %10d calls %9.1f ms %7.2f us/call" % (name + ' moves', calls, seconds * 1000,
+                                                                         seconds / calls * 1e6))
+        return lines
+
+
+class Profiler:
+    """
+    Context manager that instruments `gs` while it is entered and yields its EngineProfile
+    - `cprofile` is an optional cProfile.Profile that also records the run, it can be shared by several profilers
+    - the instrumentation itself adds overhead, compare counters between runs rather than absolute times
+    """
+
+    def __init__(self, gs, profile=None, cprofile=None):
+        self.gs = gs
+        self.profile = profile if profile is not None else EngineProfile()
+        self.cprofile = cprofile
+        self.move_init = None
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.attach()
+        self.start_time = time.perf_counter()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        return self.profile
+
+    def __exit__(self, *exc):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.profile.elapsed += time.perf_counter() - self.start_time
+        self.detach()
+
+    def attach(self):
+        gs = self.gs
+        counts = self.profile.counts
+
+        def counted(name, method):
+            def wrapper(*args, **kwargs):
+                counts[name] += 1
+                return method(*args, **kwargs)
+            return wrapper
+
+        for name in COUNTED_METHODS:
+            setattr(gs, name, counted(name, getattr(gs, name)))
+
+        generator_calls = self.profile.generator_calls
+        generator_time = self.profile.generator_time
+        perf_counter = time.perf_counter
+
+        def timed(piece_type, generate):
+            def wrapper(r, c, moves):
+                start = perf_counter()
+                generate(r, c, moves)
+                generator_time[piece_type] += perf_counter() - start
+                generator_calls[piece_type] += 1
+            return wrapper
+
+        # only the dispatch table is wrapped, so the queen's own rook and bishop calls are not counted twice
+        for piece_type, generate in list(gs.move_functions.items()):
+            gs.move_functions[piece_type] = timed(piece_type, generate)
+        if 'K' in gs.move_functions:
+            gs.get_king_moves = gs.move_functions['K']  # called directly in double check
+
+        # Move has slots, so construction is counted on the class for as long as the profiler is entered
+        self.move_init = Move.__init__
+        move_init = self.move_init
+
+        def counted_init(move, *args, **kwargs):
+            counts['moves constructed'] += 1
+            move_init(move, *args, **kwargs)
+        Move.__init__ = counted_init
+
+    def detach(self):
+        Move.__init__ = self.move_init
+        for name in COUNTED_METHODS + ('get_king_moves',):
+            self.gs.__dict__.pop(name, None)
+        self.gs.bind_move_functions()
+
+
+def get_cprofile_report(cprofile, top=25, sort='cumulative'):
+
+    """
+    the `top` functions of a cProfile.Profile as text, sorted by `sort`
+    """
+
+    stream = io.StringIO()
+    pstats.Stats(cprofile, stream=stream).sort_stats(sort).print_stats(top)
+    return stream.getvalue()
+
+
+def profile_positions(positions, depth, mode='perft', backend='mailbox', cprofile=None, log=print):
+
+    """
+    perft or search every `(name, fen)` position under a Profiler, logging a breakdown per position
+    - `cprofile` is an optional cProfile.Profile recording all positions
+    - returns the EngineProfile of all positions together
+    """
+
+    from src import chessperft
+    from src import chesssearch
+
+    total = EngineProfile()
+    for name, fen in positions:
+        gs = BACKENDS[backend](fen)
+        with Profiler(gs, cprofile=cprofile) as profile:
+            if mode == 'perft':
+                result = "%d nodes" % chessperft.perft(gs, depth)
+            else:
+                best_move = chesssearch.Search(gs).search(max_depth=depth).best_move
+                result = "bestmove %s" % (best_move.get_chess_notation() if best_move else '(none)')
+        total.merge(profile)
+        if log is not None:
+            log("%s: %s in %.2fs" % (name, result, profile.elapsed))
+            for line in profile.get_report():
+                log("  " + line)
+    return total
+
+
+def main(argv=None):
+    from src.chessperft import REFERENCE_POSITIONS
+
+    parser = argparse.ArgumentParser(description="hot path counters and generator times of perft or search runs")
+    parser.add_argument('mode', choices=('perft', 'search'))
+    parser.add_argument('--fen', action='append', help="position to run, repeatable, defaults to the perft suite")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='mailbox')
+    parser.add_argument('--cprofile', type=int, default=0, metavar='N',
+                        help="also record the runs with cProfile and print its N most expensive functions")
+    args = parser.parse_args(argv)
+
+    positions = [(fen, fen) for fen in args.fen] if args.fen else [(name, fen) for name, fen, _ in REFERENCE_POSITIONS]
+    recorder = cProfile.Profile() if args.cprofile else None
+    total = profile_positions(positions, args.depth, args.mode, args.backend, recorder)
+
+    print("total: %d positions in %.2fs" % (len(positions), total.elapsed))
+    for line in total.get_report():
+        print("  " + line)
+    if recorder is not None:
+        print(get_cprofile_report(recorder, args.cprofile))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
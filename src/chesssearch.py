@@ -0,0 +1,346 @@
+"""
+File chesssearch.py from project Project_Chess_Game
+
+"""
+
+
+# Computer opponent: negamax alpha-beta search over GameState with iterative deepening and time control
+
+
+import time
+
+from src.chessengine import TranspositionTable
+from src.chessevaluation import evaluate  # incremental, reads the scores make_move/undo_move keep
+
+# plain material values for move ordering
+PIECE_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+
+MATE_SCORE = 100000
+MATE_THRESHOLD = MATE_SCORE - 1000  # anything above this is a forced mate
+INFINITY = MATE_SCORE + 1
+
+ASPIRATION_WINDOW = 50
+MAX_PLY = 64
+
+
+class SearchTimeout(Exception):
+    """
+    raised inside the tree when the time or node budget runs out
+    """
+
+
+class SearchResult:
+    """
+    Outcome of a search, the best move and principal variation come from the last completed depth
+    """
+
+    def __init__(self, best_move, score, depth, nodes, elapsed, pv):
+        self.best_move = best_move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.pv = pv
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def get_pv_notation(self):
+        return ' '.join(move.get_chess_notation() for move in self.pv)
+
+
+class Search:
+    """
+    Alpha-beta searcher bound to one GameState
+    - moves are played on `gs` itself with make_move/undo_move, the position is unchanged once a search returns
+    - move ordering: transposition table move, MVV-LVA captures, killer moves, then the history heuristic
+    """
+
+    def __init__(self, gs, tt=None, evaluate_fn=evaluate):
+
+        self.gs = gs
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.evaluate = evaluate_fn
+
+        self.nodes = 0
+        self.stop_time = None
+        self.node_limit = None
+        self.should_stop = None
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = {}
+
+    def search(self, max_depth=MAX_PLY, time_limit=None, node_limit=None, info=None, should_stop=None):
+
+        """
+        iterative deepening search
+        - `time_limit` is a wall clock budget in seconds, `node_limit` a budget in nodes, both optional
+        - `should_stop()` is polled with the clock and ends the search early once it returns True, e.g. to cancel it
+          from another thread or process
+        - `info` is called with a SearchResult after every completed depth
+        - returns the SearchResult of the deepest completed iteration
+        """
+
+        gs = self.gs
+        start_time = time.perf_counter()
+        self.stop_time = start_time + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        self.should_stop = should_stop
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = {}
+        self.tt.new_search()
+
+        root_len = len(gs.movelog)
+        game_flags = (gs.check_mate, gs.stale_mate, gs.draw_by_repetition)
+
+        root_moves = gs.get_valid_moves()
+        result = SearchResult(None, -MATE_SCORE if gs.check_mate else 0, 0, 0, 0.0, [])
+        if root_moves:
+            result.best_move = root_moves[0]
+            result.pv = [root_moves[0]]
+
+            score = 0
+            for depth in range(1, min(max_depth, MAX_PLY - 1) + 1):
+                try:
+                    score = self.aspiration_search(depth, score)
+                except SearchTimeout:
+                    while len(gs.movelog) > root_len:  # unwind the interrupted iteration
+                        gs.undo_move()
+                    break
+
+                pv = self.get_pv(depth)
+                result = SearchResult(pv[0] if pv else result.best_move, score, depth, self.nodes,
+                                      time.perf_counter() - start_time, pv)
+                if info is not None:
+                    info(result)
+
+                if abs(score) >= MATE_THRESHOLD:  # forced mate found, deeper search cannot improve on it
+                    break
+                # another iteration takes longer than all the previous ones together, so do not start one late
+                if self.stop_time is not None and time.perf_counter() - start_time > (self.stop_time - start_time) / 2:
+                    break
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start_time
+        gs.check_mate, gs.stale_mate, gs.draw_by_repetition = game_flags
+        return result
+
+    def aspiration_search(self, depth, previous_score):
+
+        """
+        search the root with a narrow window around the previous score, re-searching with a full window on failure
+        """
+
+        if depth >= 3 and abs(previous_score) < MATE_THRESHOLD:
+            alpha = previous_score - ASPIRATION_WINDOW
+            beta = previous_score + ASPIRATION_WINDOW
+            score = self.negamax(depth, alpha, beta, 0)
+            if alpha < score < beta:
+                return score
+        return self.negamax(depth, -INFINITY, INFINITY, 0)
+
+    def check_limits(self):
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+        if self.nodes & 1023 == 0:
+            if self.stop_time is not None and time.perf_counter() >= self.stop_time:
+                raise SearchTimeout()
+            if self.should_stop is not None and self.should_stop():
+                raise SearchTimeout()
+
+    def negamax(self, depth, alpha, beta, ply):
+
+        """
+        fail-soft alpha-beta, returns the score of the position for the side to move
+        """
+
+        gs = self.gs
+        self.nodes += 1
+        self.check_limits()
+
+        # draws, a mate on the hundredth halfmove still counts and is found by the move generation below
+        if ply > 0 and (gs.is_repetition(2) or gs.is_insufficient_material() or
+                        (gs.is_fifty_move_draw() and gs.has_legal_move())):
+            return 0
+
+        alpha_orig = alpha
+        tt_move = 0
+        entry = self.tt.probe(gs.zobrist_key)
+        if entry is not None:
+            tt_depth, bound, tt_score, tt_move = entry
+            if ply > 0 and tt_depth >= depth:
+                tt_score = score_from_tt(tt_score, ply)
+                if bound == TranspositionTable.EXACT:
+                    return tt_score
+                elif bound == TranspositionTable.LOWER_BOUND:
+                    alpha = max(alpha, tt_score)
+                else:
+                    beta = min(beta, tt_score)
+                if alpha >= beta:
+                    return tt_score
+
+        if depth <= 0:
+            return self.quiescence(alpha, beta, ply)
+
+        moves = gs.get_valid_moves()
+        if len(moves) == 0:
+            return -MATE_SCORE + ply if gs.check_mate else 0
+
+        self.order_moves(moves, tt_move, ply)
+
+        best_score = -INFINITY
+        best_move = None
+        for move in moves:
+            gs.make_move(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            gs.undo_move()
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if move.piece_captured == "--":  # quiet move caused the cutoff
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            history_key = (move.piece_moved, move.end_row, move.end_col)
+                            self.history[history_key] = self.history.get(history_key, 0) + depth * depth
+                        break
+
+        if best_score <= alpha_orig:
+            bound = TranspositionTable.UPPER_BOUND
+        elif best_score >= beta:
+            bound = TranspositionTable.LOWER_BOUND
+        else:
+            bound = TranspositionTable.EXACT
+        self.tt.store(gs.zobrist_key, depth, bound, score_to_tt(best_score, ply), best_move.code)
+
+        return best_score
+
+    def quiescence(self, alpha, beta, ply):
+
+        """
+        search captures and promotions only until the position is quiet
+        - in check there is no standing pat: every evasion is searched
+        - no legal move at all is scored as mate or stalemate, as in negamax
+        """
+
+        gs = self.gs
+        self.nodes += 1
+        self.check_limits()
+
+        if ply >= MAX_PLY - 1:
+            return self.evaluate(gs)
+
+        moves = gs.get_valid_moves()
+        if len(moves) == 0:
+            return -MATE_SCORE + ply if gs.check_mate else 0
+        if gs.in_check():
+            best_score = -INFINITY
+            self.order_moves(moves, 0, ply)
+        else:
+            stand_pat = self.evaluate(gs)
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            best_score = stand_pat
+            moves = [move for move in moves if move.piece_captured != "--" or move.is_pawn_promotion]
+            moves.sort(key=mvv_lva, reverse=True)
+
+        for move in moves:
+            gs.make_move(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            gs.undo_move()
+
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        return best_score
+
+    def order_moves(self, moves, tt_move, ply):
+
+        """
+        sort `moves` in place, most promising first
+        """
+
+        killers = self.killers[ply]
+        history = self.history
+
+        def move_score(move):
+            if move.code == tt_move:
+                return 1000000
+            if move.piece_captured != "--" or move.is_pawn_promotion:
+                return 100000 + mvv_lva(move)
+            if move == killers[0]:
+                return 90000
+            if move == killers[1]:
+                return 80000
+            return history.get((move.piece_moved, move.end_row, move.end_col), 0)
+
+        moves.sort(key=move_score, reverse=True)
+
+    def get_pv(self, depth):
+
+        """
+        follow best moves through the transposition table from the current position
+        """
+
+        gs = self.gs
+        pv = []
+        seen = set()
+        while len(pv) < depth and gs.zobrist_key not in seen:
+            seen.add(gs.zobrist_key)
+            entry = self.tt.probe(gs.zobrist_key)
+            if entry is None:
+                break
+            move = next((m for m in gs.get_valid_moves() if m.code == entry[3]), None)
+            if move is None:
+                break
+            pv.append(move)
+            gs.make_move(move)
+
+        for _ in pv:
+            gs.undo_move()
+        return pv
+
+
+def mvv_lva(move):
+
+    """
+    most valuable victim, least valuable attacker
+    """
+
+    victim = PIECE_VALUES[move.piece_captured[1]] if move.piece_captured != "--" else 0
+    if move.is_pawn_promotion:
+        victim += PIECE_VALUES[move.promotion_piece]
+    return victim * 10 - PIECE_VALUES[move.piece_moved[1]] // 10
+
+
+def score_to_tt(score, ply):
+
+    """
+    mate scores are stored relative to the node, not the root
+    """
+
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
@@ -0,0 +1,529 @@
+"""
+File chessserver.py from project Project_Chess_Game
+
+"""
+
+
+# Multi-game server: an asyncio TCP server hosting many GameState sessions over a line delimited JSON protocol.
+# Move generation runs on a thread pool and engine search on a process pool, so the event loop only parses and
+# routes requests. `loadtest` plays many random games against a server and reports move latency percentiles
+
+# Protocol, one JSON object per line both ways. A request has a "cmd" and an optional "id" echoed in its reply,
+# replies have "ok" and, on failure, "error". Requests of one connection may be pipelined
+#   {"cmd": "new", "fen": optional}                       -> session, fen, moves, status
+#   {"cmd": "state", "session": n}                        -> fen, moves, status, memory in bytes
+#   {"cmd": "move", "session": n, "move": "e7e8q"}        -> fen, moves, status
+#   {"cmd": "undo", "session": n}                         -> fen, moves, status
+#   {"cmd": "search", "session": n, "depth": 3, "time": 1} -> bestmove, score, depth, nodes
+#   {"cmd": "close", "session": n}
+#   {"cmd": "stats"}                                      -> sessions, memory of all sessions in bytes
+
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from src.chessengine import GameState, Move
+from src import chesssearch
+
+MAX_LINE = 1 << 16
+MAX_SEARCH_DEPTH = 8
+MAX_SEARCH_TIME = 10.0
+
+
+class ProtocolError(ValueError):
+    """
+    raised for a request the server cannot serve, its message is sent back to the client
+    """
+
+
+def get_status(gs):
+
+    """
+    game status of a position whose valid moves were just generated, same order as GameState.get_status
+    - the flags of that generation stand in for a second search for a legal move
+    """
+
+    if gs.check_mate:
+        return 'checkmate'
+    if gs.stale_mate:
+        return 'stalemate'
+    if gs.is_fifty_move_draw():
+        return 'fifty moves'
+    if gs.draw_by_repetition:
+        return 'repetition'
+    if gs.is_insufficient_material():
+        return 'insufficient material'
+    return 'active'
+
+
+def get_field(request, name, types, default=None, required=False):
+
+    """
+    field `name` of a request, raises ProtocolError unless it is one of `types`
+    - JSON booleans are not accepted as numbers
+    """
+
+    if name not in request:
+        if required:
+            raise ProtocolError("missing field %r" % name)
+        return default
+    value = request[name]
+    if not isinstance(value, types) or isinstance(value, bool):
+        raise ProtocolError("field %r has the wrong type: %r" % (name, value))
+    return value
+
+
+def get_size(obj, seen=None):
+
+    """
+    bytes held by `obj` and everything it references, each object counted once
+    - classes, functions and modules are shared by all sessions and left out
+    """
+
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, type(get_size), type(sys))):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, (str, bytes, int, float, array)):
+            continue
+        elif hasattr(obj, '__self__'):  # bound method
+            stack.append(obj.__self__)
+        else:
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for slot in getattr(type(obj), '__slots__', ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return size
+
+
+def parse_move(valid_moves, notation):
+
+    """
+    the valid move of a coordinate notation string like 'e2e4' or 'e7e8n', as `get_chess_notation` writes them
+    """
+
+    if not isinstance(notation, str) or len(notation) not in (4, 5) or notation[0] not in Move.files_cols or \
+            notation[2] not in Move.files_cols or notation[1] not in Move.ranks_rows or \
+            notation[3] not in Move.ranks_rows:
+        raise ProtocolError("cannot read move %r" % (notation,))
+    start_sq = (Move.ranks_rows[notation[1]], Move.files_cols[notation[0]])
+    end_sq = (Move.ranks_rows[notation[3]], Move.files_cols[notation[2]])
+    promotion = notation[4].upper() if len(notation) == 5 else None
+    if promotion is not None and promotion not in Move.promotion_pieces:
+        raise ProtocolError("cannot read move %r" % (notation,))
+
+    move = valid_moves.get_move(start_sq, end_sq, promotion or 'Q')
+    if move is None or (promotion is not None and move.promotion_piece != promotion):
+        raise ProtocolError("illegal move %s" % notation)
+    return move
+
+
+class Session:
+    """
+    One hosted game: its GameState, the MoveIndex of the current position and a lock serializing its requests
+    - everything but the lock is only touched from pool threads, one request at a time
+    """
+
+    def __init__(self, session_id, owner, fen=None):
+        self.session_id = session_id
+        self.owner = owner  # connection that opened it, its sessions close with it
+        self.lock = asyncio.Lock()
+        self.gs = None
+        self.fen = fen
+        self.valid_moves = None
+
+    def start(self):
+        self.gs = GameState(self.fen)
+        return self.refresh()
+
+    def refresh(self):
+
+        """
+        regenerate the valid moves after the position changed, returns the reply fields
+        """
+
+        self.valid_moves = self.gs.get_valid_moves(indexed=True)
+        return self.get_state()
+
+    def get_state(self):
+        return {'session': self.session_id, 'fen': self.gs.get_fen(), 'status': get_status(self.gs),
+                'check': self.gs.in_check(), 'moves': [move.get_chess_notation() for move in self.valid_moves]}
+
+    def play(self, notation):
+        if get_status(self.gs) != 'active':
+            raise ProtocolError("the game is over")
+        self.gs.make_move(parse_move(self.valid_moves, notation))
+        return self.refresh()
+
+    def undo(self):
+        if not self.gs.movelog:
+            raise ProtocolError("no move to undo")
+        self.gs.undo_move()
+        return self.refresh()
+
+    def get_memory(self):
+
+        """
+        bytes held by this session's game state and move lists
+        """
+
+        return get_size((self.gs, self.valid_moves))
+
+
+def _search_task(snapshot, depth, time_limit):
+
+    """
+    search a snapshot in a worker process, returns `(move code or None, score, depth, nodes)`
+    """
+
+    gs = GameState.from_snapshot(snapshot)
+    result = chesssearch.Search(gs).search(max_depth=depth, time_limit=time_limit)
+    return (result.best_move.code if result.best_move else None), result.score, result.depth, result.nodes
+
+
+class GameServer:
+    """
+    Hosts sessions for any number of connections
+    - `threads` runs move generation, `processes` runs searches, 0 for the cpu count
+    """
+
+    def __init__(self, threads=4, processes=0, max_sessions=100000):
+        self.threads = ThreadPoolExecutor(max_workers=threads or os.cpu_count())
+        # spawned, not forked: a forked worker would inherit the open client sockets and keep them from closing
+        self.processes = ProcessPoolExecutor(max_workers=processes or os.cpu_count(),
+                                             mp_context=multiprocessing.get_context('spawn'))
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+        self.server = None
+        self.connections = {}  # writer: task handling the connection
+        self.requests = 0
+
+        self.commands = {'new': self.cmd_new, 'state': self.cmd_state, 'move': self.cmd_move, 'undo': self.cmd_undo,
+                         'search': self.cmd_search, 'close': self.cmd_close, 'stats': self.cmd_stats}
+
+    async def start(self, host='127.0.0.1', port=0):
+
+        """
+        listen on `host:port`, port 0 picks a free one, returns the bound `(host, port)`
+        """
+
+        self.server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_LINE)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            handlers = list(self.connections.values())
+            for writer in list(self.connections):
+                writer.close()
+            if handlers:  # closed sockets read as end of file, the handlers wind down on their own
+                await asyncio.wait(handlers, timeout=MAX_SEARCH_TIME)
+            await self.server.wait_closed()
+        self.threads.shutdown(wait=False, cancel_futures=True)
+        self.processes.shutdown(wait=False, cancel_futures=True)
+
+    async def run_in_thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.threads, fn, *args)
+
+    async def handle_connection(self, reader, writer):
+        self.connections[writer] = asyncio.current_task()
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):  # line over MAX_LINE or connection reset
+                    break
+                if not line:
+                    break
+                # one task per request so a slow search does not hold up the connection's other games
+                task = asyncio.ensure_future(self.handle_line(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            # nobody can reach the sessions the connection left open any more
+            for session_id in [session_id for session_id, session in self.sessions.items() if session.owner is writer]:
+                del self.sessions[session_id]
+            del self.connections[writer]
+            writer.close()
+
+    async def handle_line(self, line, writer):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ProtocolError("a request must be a JSON object")
+            request_id = request.get('id')
+            command = self.commands.get(request.get('cmd'))
+            if command is None:
+                raise ProtocolError("unknown command %r" % (request.get('cmd'),))
+            reply = await command(request, writer)
+            reply['ok'] = True
+        except (ProtocolError, ValueError) as e:  # json errors and bad FENs are ValueErrors too
+            reply = {'ok': False, 'error': str(e)}
+        except Exception as e:  # a bug must not leave the client waiting for a reply that never comes
+            reply = {'ok': False, 'error': "internal error: %s: %s" % (type(e).__name__, e)}
+        self.requests += 1
+
+        if request_id is not None:
+            reply['id'] = request_id
+        if not writer.is_closing():
+            writer.write(json.dumps(reply).encode() + b'\n')
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    def get_session(self, request):
+        session_id = get_field(request, 'session', int)
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ProtocolError("no session %r" % (session_id,))
+        return session
+
+    async def cmd_new(self, request, writer):
+        if len(self.sessions) >= self.max_sessions:
+            raise ProtocolError("server is full, %d sessions" % self.max_sessions)
+        session = Session(next(self.session_ids), writer, get_field(request, 'fen', str))
+        reply = await self.run_in_thread(session.start)
+        self.sessions[session.session_id] = session
+        return reply
+
+    async def cmd_state(self, request, writer):
+        session = self.get_session(request)
+        async with session.lock:
+            reply = await self.run_in_thread(session.get_state)
+            reply['memory'] = await self.run_in_thread(session.get_memory)
+        return reply
+
+    async def cmd_move(self, request, writer):
+        session = self.get_session(request)
+        async with session.lock:
+            return await self.run_in_thread(session.play, get_field(request, 'move', str, required=True))
+
+    async def cmd_undo(self, request, writer):
+        session = self.get_session(request)
+        async with session.lock:
+            return await self.run_in_thread(session.undo)
+
+    async def cmd_search(self, request, writer):
+        session = self.get_session(request)
+        depth = max(1, min(get_field(request, 'depth', int, 3), MAX_SEARCH_DEPTH))
+        time_limit = min(get_field(request, 'time', (int, float), MAX_SEARCH_TIME), MAX_SEARCH_TIME)
+        async with session.lock:
+            snapshot = session.gs.snapshot()
+            code, score, depth, nodes = await asyncio.get_running_loop().run_in_executor(
+                self.processes, _search_task, snapshot, depth, time_limit)
+            best_move = Move.from_code(code, session.gs.board).get_chess_notation() if code is not None else None
+        return {'session': session.session_id, 'bestmove': best_move, 'score': score, 'depth': depth,
+                'nodes': nodes}
+
+    async def cmd_close(self, request, writer):
+        session = self.get_session(request)
+        async with session.lock:  # let a move or search in flight finish first
+            if self.sessions.get(session.session_id) is not session:
+                raise ProtocolError("no session %r" % session.session_id)  # closed while we waited
+            del self.sessions[session.session_id]
+        return {'session': session.session_id}
+
+    async def cmd_stats(self, request, writer):
+
+        """
+        session count and memory, sessions are measured one at a time under their lock
+        """
+
+        sizes = []
+        for session in list(self.sessions.values()):
+            async with session.lock:
+                sizes.append(await self.run_in_thread(session.get_memory))
+        return {'sessions': len(self.sessions), 'requests': self.requests, 'memory': sum(sizes),
+                'memory per session': int(statistics.mean(sizes)) if sizes else 0,
+                'largest session': max(sizes, default=0)}
+
+
+async def serve(host, port, threads, processes, max_sessions):
+    server = GameServer(threads, processes, max_sessions)
+    host, port = await server.start(host, port)
+    print("listening on %s:%d" % (host, port), flush=True)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+class Client:
+    """
+    Pipelining client of one connection, replies are matched to requests by id
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.listener = asyncio.ensure_future(self.listen())
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+        return cls(reader, writer)
+
+    async def listen(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            future = self.pending.pop(reply.get('id'), None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+        for future in self.pending.values():
+            future.set_exception(ConnectionError("server closed the connection"))
+
+    async def request(self, cmd, **fields):
+
+        """
+        send one request and wait for its reply, raises ProtocolError for a failed one
+        """
+
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        fields.update(cmd=cmd, id=request_id)
+        self.writer.write(json.dumps(fields).encode() + b'\n')
+        await self.writer.drain()
+        reply = await future
+        if not reply['ok']:
+            raise ProtocolError(reply['error'])
+        return reply
+
+    async def close(self):
+        self.writer.close()
+        self.listener.cancel()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def load_test(host, port, games=100, connections=None, plies=40, seed=0, log=print):
+
+    """
+    play `games` random games at once over `connections` connections, returns a dict of statistics
+    - every game opens a session and plays up to `plies` random legal moves, each move timed end to end
+    - all sessions stay open until every game is done, then server memory is read before they are closed
+    """
+
+    clients = [await Client.connect(host, port) for _ in range(connections or min(games, 100))]
+    rng = random.Random(seed)
+    latencies = []
+
+    async def play(client):
+        reply = await client.request('new')
+        for _ in range(plies):
+            if reply['status'] != 'active':
+                break
+            move = rng.choice(reply['moves'])
+            start = time.perf_counter()
+            reply = await client.request('move', session=reply['session'], move=move)
+            latencies.append(time.perf_counter() - start)
+        return reply['session']
+
+    start = time.perf_counter()
+    sessions = await asyncio.gather(*(play(clients[i % len(clients)]) for i in range(games)))
+    elapsed = time.perf_counter() - start
+
+    stats = await clients[0].request('stats')
+    await asyncio.gather(*(clients[i % len(clients)].request('close', session=session)
+                           for i, session in enumerate(sessions)))
+    for client in clients:
+        await client.close()
+
+    if log is not None:
+        log("%d games over %d connections: %d moves in %.2fs" % (games, len(clients), len(latencies), elapsed))
+    result = {'games': games, 'connections': len(clients), 'moves': len(latencies), 'seconds': elapsed,
+              'moves/sec': len(latencies) / elapsed if elapsed else 0.0,
+              'p50 ms': percentile(latencies, 0.50) * 1000 if latencies else 0.0,
+              'p99 ms': percentile(latencies, 0.99) * 1000 if latencies else 0.0,
+              'max ms': max(latencies, default=0.0) * 1000,
+              'server memory': stats['memory'], 'memory per session': stats['memory per session']}
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="host many games over a line delimited JSON TCP protocol")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="run the server until interrupted")
+    serve_parser.add_argument('--threads', type=int, default=4, help="move generation threads, 0 for the cpu count")
+    serve_parser.add_argument('--processes', type=int, default=0, help="search processes, 0 for the cpu count")
+    serve_parser.add_argument('--max-sessions', type=int, default=100000)
+
+    load = commands.add_parser('loadtest', help="play random games against a server and report move latency")
+    load.add_argument('--games', type=int, default=100, help="concurrent games")
+    load.add_argument('--connections', type=int, default=None, help="defaults to one per game, at most 100")
+    load.add_argument('--plies', type=int, default=40, help="moves per game at most")
+    load.add_argument('--seed', type=int, default=0)
+
+    for command in (serve_parser, load):
+        command.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=7777)
+    load.add_argument('--port', type=int, default=None, help="server to test, by default one is started")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(serve(args.host, args.port, args.threads, args.processes, args.max_sessions))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    process = None
+    port = args.port
+    if port is None:  # a server of our own, in another process so it does not share the client's event loop
+        process = subprocess.Popen([sys.executable, '-m', 'src.chessserver', 'serve', '--host', args.host,
+                                    '--port', '0'], stdout=subprocess.PIPE, text=True)
+        port = int(process.stdout.readline().rsplit(':', 1)[1])
+    try:
+        result = asyncio.run(load_test(args.host, port, args.games, args.connections, args.plies, args.seed))
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGINT)  # lets the server shut its process pool down
+            process.wait()
+
+    print("%.1f moves/sec, latency p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+        result['moves/sec'], result['p50 ms'], result['p99 ms'], result['max ms']))
+    print("server memory %d bytes, %d per session" % (result['server memory'], result['memory per session']))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
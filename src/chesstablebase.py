@@ -0,0 +1,678 @@
+"""
+File chesstablebase.py from project Project_Chess_Game
+
+"""
+
+
+# Endgame tablebases: retrograde analysis of KQK, KRK, KPK and KBNK into distance to mate tables. Tables are
+# symmetry reduced and bit packed on disk, and probed through mmap with a GameState
+
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src.chessengine import GameState, CastlingRights, KING_SQUARES, KNIGHT_SQUARES, RAY_SQUARES, SQ_ROW_COL
+
+# pieces of the strong side besides its king, the weak side always has a bare king
+MATERIAL = {'KQK': ('Q',), 'KRK': ('R',), 'KPK': ('p',), 'KBNK': ('B', 'N')}
+# tables a pawn promotes into, other promotions are draws
+PROMOTION_TABLES = {'Q': 'KQK', 'R': 'KRK'}
+DEPENDENCIES = {'KPK': ('KQK', 'KRK')}
+
+# magic, version, table name, bits per entry, entries, longest mate in plies
+HEADER = struct.Struct('<4sB8sBIB')
+MAGIC = b'PCTB'
+VERSION = 1
+
+WIN, DRAW, LOSS = 1, 0, -1
+RESULT_NAMES = {WIN: 'win', DRAW: 'draw', LOSS: 'loss'}
+
+CANNOT_LOSE = 255  # move counter of a weak side position that can capture its way to a draw
+
+# Geometry on engine squares `sq = row * 8 + col`, row 0 is rank 8. The strong side is always white in a table
+
+KING_TARGETS = tuple(tuple(r * 8 + c for r, c in squares) for squares in KING_SQUARES)
+KNIGHT_TARGETS = tuple(tuple(r * 8 + c for r, c in squares) for squares in KNIGHT_SQUARES)
+KNIGHT_MASKS = tuple(sum(1 << sq for sq in targets) for targets in KNIGHT_TARGETS)
+# squares a white pawn attacks
+PAWN_MASKS = tuple(sum(1 << ((r - 1) * 8 + c + d_col) for d_col in (-1, 1) if r > 0 and 0 <= c + d_col < 8)
+                   for r, c in SQ_ROW_COL)
+KING_DISTANCE = tuple(tuple(max(abs(r - r2), abs(c - c2)) for r2, c2 in SQ_ROW_COL) for r, c in SQ_ROW_COL)
+SLIDER_DIRECTIONS = {'Q': frozenset(range(8)), 'R': frozenset(range(4)), 'B': frozenset(range(4, 8))}
+
+
+def _lines():
+    direction = [[-1] * 64 for _ in range(64)]
+    between = [[0] * 64 for _ in range(64)]
+    for d in range(8):
+        for sq in range(64):
+            mask = 0
+            for r, c in RAY_SQUARES[d][sq]:
+                direction[sq][r * 8 + c] = d
+                between[sq][r * 8 + c] = mask
+                mask |= 1 << (r * 8 + c)
+    return direction, between
+
+
+def _transforms():
+    transforms = []
+    for transpose in (False, True):
+        for flip_row in (False, True):
+            for flip_col in (False, True):
+                table = []
+                for r, c in SQ_ROW_COL:
+                    if transpose:
+                        r, c = c, r
+                    if flip_row:
+                        r = 7 - r
+                    if flip_col:
+                        c = 7 - c
+                    table.append(r * 8 + c)
+                transforms.append(tuple(table))
+    return transforms
+
+
+# direction index (as in RAY_SQUARES) from one square to another along a queen line, -1 if there is none,
+# and the mask of the squares strictly in between
+LINE_DIRECTION, BETWEEN = _lines()
+
+# the 8 symmetries of the board, identity first
+TRANSFORMS = _transforms()
+MIRROR = TRANSFORMS[1]  # a - h file mirror, the only symmetry left with a pawn on the board
+FLIP = TRANSFORMS[2]  # rank mirror, to make the strong side white
+# pawnless tables keep the strong king in the a1 - d1 - d4 triangle
+KING_TRIANGLE = tuple(sq for sq in range(64) if 7 - SQ_ROW_COL[sq][0] <= SQ_ROW_COL[sq][1] <= 3)
+TRIANGLE_INDEX = {sq: i for i, sq in enumerate(KING_TRIANGLE)}
+# every symmetry taking a strong king square into the triangle, two of them on the a1 - d4 diagonal
+TRIANGLE_TRANSFORMS = tuple(tuple(t for t in TRANSFORMS if t[sq] in TRIANGLE_INDEX) for sq in range(64))
+# pawn tables keep the pawn on files a - d, ranks 2 - 7
+PAWN_SQUARES = tuple(sq for sq in range(64) if 1 <= SQ_ROW_COL[sq][0] <= 6 and SQ_ROW_COL[sq][1] <= 3)
+PAWN_INDEX = {sq: i for i, sq in enumerate(PAWN_SQUARES)}
+
+
+class TableLayout:
+    """
+    Position index of one endgame, white being the strong side
+    - pawnless: `(side, strong king in the triangle, weak king, pieces...)`, all squares in the king's symmetry
+    - with a pawn: `(side, pawn on files a - d, strong king, weak king)`
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.pieces = MATERIAL[name]
+        self.has_pawn = 'p' in self.pieces
+        self.lead = len(PAWN_SQUARES) if self.has_pawn else len(KING_TRIANGLE)
+        self.side_size = self.lead * 64 ** (1 + len(self.pieces))
+        self.size = 2 * self.side_size
+
+    def index(self, black_to_move, wk, bk, squares):
+        if self.has_pawn:
+            pawn = squares[0]
+            if pawn & 7 > 3:
+                wk, bk, pawn = MIRROR[wk], MIRROR[bk], MIRROR[pawn]
+            return ((black_to_move * self.lead + PAWN_INDEX[pawn]) * 64 + wk) * 64 + bk
+
+        # a king on the diagonal leaves two images of the position, the smaller index is the canonical one
+        best = None
+        for t in TRIANGLE_TRANSFORMS[wk]:
+            idx = (black_to_move * self.lead + TRIANGLE_INDEX[t[wk]]) * 64 + t[bk]
+            for sq in squares:
+                idx = idx * 64 + t[sq]
+            if best is None or idx < best:
+                best = idx
+        return best
+
+    def decode(self, idx):
+
+        """
+        `(black_to_move, wk, bk, squares)` of an index, the inverse of `index`
+        """
+
+        if self.has_pawn:
+            bk = idx & 63
+            wk = idx >> 6 & 63
+            idx >>= 12
+            return idx // self.lead, wk, bk, (PAWN_SQUARES[idx % self.lead],)
+
+        squares = []
+        for _ in self.pieces:
+            squares.append(idx & 63)
+            idx >>= 6
+        squares.reverse()
+        bk = idx & 63
+        idx >>= 6
+        return idx // self.lead, KING_TRIANGLE[idx % self.lead], bk, tuple(squares)
+
+
+def attacked(sq, wk, pieces, squares, occ):
+
+    """
+    determine if white attacks `sq`, sliders are blocked by the squares in `occ`
+    """
+
+    if KING_DISTANCE[wk][sq] <= 1:
+        return True
+    for piece, from_sq in zip(pieces, squares):
+        if from_sq == sq:
+            continue
+        if piece == 'N':
+            if KNIGHT_MASKS[from_sq] >> sq & 1:
+                return True
+        elif piece == 'p':
+            if PAWN_MASKS[from_sq] >> sq & 1:
+                return True
+        elif LINE_DIRECTION[from_sq][sq] in SLIDER_DIRECTIONS[piece] and not BETWEEN[from_sq][sq] & occ:
+            return True
+    return False
+
+
+class Generator:
+    """
+    Retrograde analysis of one table
+    - values: 0 for draws and illegal positions, otherwise plies to mate + 1, odd plies are wins for the side to
+      move and even plies losses
+    - every position is set up once, after that only the positions resolved at the previous ply are visited
+    """
+
+    def __init__(self, name, child_paths=None):
+        self.layout = TableLayout(name)
+        self.children = {piece: Tablebase(path) for piece, path in (child_paths or {}).items()}
+
+    def init_range(self, start, stop):
+
+        """
+        set up positions `start` to `stop`, returns `(values, counters, seeds)`
+        - weak side positions get their number of distinct successors, or CANNOT_LOSE
+        - mates are valued, seeds are `(index, plies)` wins through promotion into a child table
+        """
+
+        layout = self.layout
+        pieces = layout.pieces
+        values = bytearray(stop - start)
+        counters = bytearray(stop - start)
+        seeds = []
+
+        for idx in range(start, stop):
+            black_to_move, wk, bk, squares = layout.decode(idx)
+            occ = 1 << wk
+            for sq in squares:
+                occ |= 1 << sq
+            if bin(occ).count('1') != len(squares) + 1 or occ >> bk & 1 or KING_DISTANCE[wk][bk] <= 1:
+                continue  # pieces on the same square or kings touching
+            if not layout.has_pawn and wk & 7 == 7 - (wk >> 3) and layout.index(black_to_move, wk, bk, squares) != idx:
+                continue  # mirror image of a position with a smaller index
+
+            if not black_to_move:
+                if attacked(bk, wk, pieces, squares, occ):
+                    continue  # the side not to move is in check
+                if layout.has_pawn and squares[0] >> 3 == 1:
+                    promotion_sq = squares[0] - 8
+                    if promotion_sq != wk and promotion_sq != bk:
+                        for piece, child in self.children.items():
+                            value = child.probe_squares(True, wk, bk, (promotion_sq,))
+                            if value and (value - 1) % 2 == 0:  # weak side to move loses
+                                seeds.append((idx, value))
+                continue
+
+            successors = set()
+            can_capture = False
+            for to_sq in KING_TARGETS[bk]:
+                if KING_DISTANCE[wk][to_sq] <= 1:
+                    continue
+                if occ >> to_sq & 1:  # capture, the endgame left is a draw if the piece is not defended
+                    remaining = [(piece, sq) for piece, sq in zip(pieces, squares) if sq != to_sq]
+                    if not attacked(to_sq, wk, [p for p, _ in remaining], [s for _, s in remaining], occ ^ 1 << to_sq):
+                        can_capture = True
+                    continue
+                if not attacked(to_sq, wk, pieces, squares, occ):
+                    successors.add(layout.index(False, wk, to_sq, squares))
+
+            if can_capture:
+                counters[idx - start] = CANNOT_LOSE
+            elif successors:
+                counters[idx - start] = len(successors)
+            elif attacked(bk, wk, pieces, squares, occ):
+                values[idx - start] = 1  # mated
+        return bytes(values), bytes(counters), seeds
+
+    def predecessors(self, indices):
+
+        """
+        positions one move before each of `indices`, distinct per position, concatenated
+        """
+
+        layout = self.layout
+        pieces = layout.pieces
+        found = []
+        for idx in indices:
+            black_to_move, wk, bk, squares = layout.decode(idx)
+            occ = 1 << wk | 1 << bk
+            for sq in squares:
+                occ |= 1 << sq
+            previous = set()
+
+            if not black_to_move:  # the weak king just moved
+                for from_sq in KING_TARGETS[bk]:
+                    if not occ >> from_sq & 1 and KING_DISTANCE[from_sq][wk] > 1:
+                        previous.add(layout.index(True, wk, from_sq, squares))
+                found.extend(previous)
+                continue
+
+            # white just moved, the weak king must not have been in check before that
+            for from_sq in KING_TARGETS[wk]:
+                if not occ >> from_sq & 1 and KING_DISTANCE[from_sq][bk] > 1 and \
+                        not attacked(bk, from_sq, pieces, squares, occ ^ 1 << wk ^ 1 << from_sq):
+                    previous.add(layout.index(False, from_sq, bk, squares))
+
+            for i, piece in enumerate(pieces):
+                sq = squares[i]
+                origins = []
+                if piece == 'N':
+                    origins = [from_sq for from_sq in KNIGHT_TARGETS[sq] if not occ >> from_sq & 1]
+                elif piece == 'p':
+                    if sq >> 3 < 6 and not occ >> (sq + 8) & 1:
+                        origins.append(sq + 8)
+                        if sq >> 3 == 4 and not occ >> (sq + 16) & 1:
+                            origins.append(sq + 16)  # double step
+                else:
+                    for d in SLIDER_DIRECTIONS[piece]:
+                        for r, c in RAY_SQUARES[d][sq]:
+                            if occ >> (r * 8 + c) & 1:
+                                break
+                            origins.append(r * 8 + c)
+
+                for from_sq in origins:
+                    before = squares[:i] + (from_sq,) + squares[i + 1:]
+                    if not attacked(bk, wk, pieces, before, occ ^ 1 << sq ^ 1 << from_sq):
+                        previous.add(layout.index(False, wk, bk, before))
+            found.extend(previous)
+        return found
+
+
+_generators = {}
+
+
+def _get_generator(name, child_paths):
+    if name not in _generators:
+        _generators[name] = Generator(name, child_paths)
+    return _generators[name]
+
+
+def _init_task(task):
+    name, child_paths, start, stop = task
+    return start, _get_generator(name, child_paths).init_range(start, stop)
+
+
+def _predecessor_task(task):
+    name, child_paths, indices = task
+    return _get_generator(name, child_paths).predecessors(indices)
+
+
+def generate(name, directory='.', workers=1, chunk_size=1 << 16, log=None):
+
+    """
+    build table `name` and write it to `directory/<name>.tb`, returns a dict of statistics
+    - tables it promotes into must already be in `directory`
+    - `workers` > 1 spreads the setup and every ply over a process pool, 0 for the cpu count
+    """
+
+    start_time = time.perf_counter()
+    layout = TableLayout(name)
+    child_paths = {piece: os.path.join(directory, PROMOTION_TABLES[piece] + '.tb')
+                   for piece in PROMOTION_TABLES if layout.has_pawn}
+    for path in child_paths.values():
+        if not os.path.exists(path):
+            raise ValueError("%s needs %s, generate it first" % (name, path))
+
+    executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count()) if workers != 1 else None
+    run = executor.map if executor is not None else map
+
+    def in_chunks(indices):
+        for i in range(0, len(indices), chunk_size // 16):
+            yield name, child_paths, indices[i:i + chunk_size // 16]
+
+    try:
+        values = bytearray(layout.size)
+        counters = bytearray(layout.size)
+        seeds = {}
+        tasks = [(name, child_paths, i, min(i + chunk_size, layout.size)) for i in range(0, layout.size, chunk_size)]
+        for chunk_start, (chunk_values, chunk_counters, chunk_seeds) in run(_init_task, tasks):
+            values[chunk_start:chunk_start + len(chunk_values)] = chunk_values
+            counters[chunk_start:chunk_start + len(chunk_counters)] = chunk_counters
+            for idx, value in chunk_seeds:
+                seeds.setdefault(value + 1, []).append(idx)  # a win one ply longer than the child's loss
+
+        frontier = [idx for idx in range(layout.side_size, layout.size) if values[idx] == 1]
+        plies = 0
+        while frontier or any(value > plies + 1 for value in seeds):
+            if log is not None:
+                log("%s ply %d: %d positions" % (name, plies, len(frontier)))
+            resolved = []
+            value = plies + 2
+            for previous in run(_predecessor_task, in_chunks(frontier)):
+                if plies % 2 == 0:  # frontier lost for the weak side, white wins from every predecessor
+                    for idx in previous:
+                        if not values[idx]:
+                            values[idx] = value
+                            resolved.append(idx)
+                else:  # frontier won for white, a weak side predecessor loses once all its moves do
+                    for idx in previous:
+                        if not values[idx] and counters[idx] != CANNOT_LOSE:
+                            counters[idx] -= 1
+                            if not counters[idx]:
+                                values[idx] = value
+                                resolved.append(idx)
+            for idx in seeds.pop(value, ()):
+                if not values[idx]:
+                    values[idx] = value
+                    resolved.append(idx)
+            frontier = resolved
+            plies += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    path = os.path.join(directory, name + '.tb')
+    longest = max(values)
+    width = write_table(path, name, values)
+    stats = {'name': name, 'entries': layout.size, 'bits': width, 'bytes': os.path.getsize(path),
+             'longest mate': longest - 1 if longest else 0, 'seconds': time.perf_counter() - start_time,
+             'wins': sum(1 for value in values if value and value % 2 == 0),
+             'losses': sum(1 for value in values if value and value % 2 == 1)}
+    return stats
+
+
+def write_table(path, name, values):
+
+    """
+    write `values` with as few bits per entry as the largest one needs, returns the width
+    """
+
+    longest = max(values)
+    width = max(1, longest.bit_length())
+    if width > 8:
+        raise ValueError("mates longer than 254 plies do not fit a table")
+
+    packed = bytearray((len(values) * width + 7) // 8 + 1)  # one spare byte so a probe can always read two
+    bit = 0
+    for value in values:
+        if value:
+            packed[bit >> 3] |= (value << (bit & 7)) & 0xFF
+            if (bit & 7) + width > 8:
+                packed[(bit >> 3) + 1] |= value >> (8 - (bit & 7))
+        bit += width
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, name.encode('ascii'), width, len(values), longest - 1 if longest else 0))
+        f.write(packed)
+    return width
+
+
+class Tablebase:
+    """
+    One memory mapped table file
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, name, self.width, self.entries, self.longest = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise ValueError("%s is not a version %d tablebase" % (path, VERSION))
+        self.name = name.rstrip(b'\0').decode('ascii')
+        self.layout = TableLayout(self.name)
+        self.mask = (1 << self.width) - 1
+
+    def close(self):
+        self.map.close()
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def get_value(self, idx):
+
+        """
+        stored value of an index: 0 for a draw, otherwise plies to mate + 1
+        """
+
+        bit = idx * self.width
+        offset = HEADER.size + (bit >> 3)
+        return (self.map[offset] | self.map[offset + 1] << 8) >> (bit & 7) & self.mask
+
+    def probe_squares(self, black_to_move, wk, bk, squares):
+        return self.get_value(self.layout.index(black_to_move, wk, bk, squares))
+
+
+def get_material(gs):
+
+    """
+    `(table name, black_to_move, wk, bk, squares)` of a position, mapped so the strong side is white
+    - the name is e.g. 'KQK' even if no such table exists, `None` when both sides have pieces besides the king
+    """
+
+    kings = {}
+    pieces = {'w': [], 'b': []}
+    for r in range(8):
+        for c in range(8):
+            piece = gs.board[r][c]
+            if piece == "--":
+                continue
+            if piece[1] == 'K':
+                kings[piece[0]] = r * 8 + c
+            else:
+                pieces[piece[0]].append((piece[1], r * 8 + c))
+
+    if pieces['w'] and pieces['b']:
+        return None
+    strong, weak = ('w', 'b') if pieces['w'] or not pieces['b'] else ('b', 'w')
+    order = 'pQRBN'
+    strong_pieces = sorted(pieces[strong], key=lambda piece: order.index(piece[0]))
+    name = 'K' + ''.join(piece.upper() for piece, _ in strong_pieces) + 'K'
+
+    black_to_move = not gs.whitetomove
+    wk, bk = kings[strong], kings[weak]
+    squares = tuple(sq for _, sq in strong_pieces)
+    if strong == 'b':  # mirror the ranks so the strong side plays up the board as white
+        black_to_move = not black_to_move
+        wk, bk = FLIP[wk], FLIP[bk]
+        squares = tuple(FLIP[sq] for sq in squares)
+    return name, black_to_move, wk, bk, squares
+
+
+class Tablebases:
+    """
+    All tables of a directory, probed by GameState
+    """
+
+    # bare kings and a lone minor piece cannot mate
+    DRAWN = ('KK', 'KBK', 'KNK')
+
+    def __init__(self, directory):
+        self.tables = {}
+        for name in MATERIAL:
+            path = os.path.join(directory, name + '.tb')
+            if os.path.exists(path):
+                self.tables[name] = Tablebase(path)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+
+    def probe(self, gs):
+
+        """
+        `(result, plies)` for the side to move: WIN, DRAW or LOSS and the distance to mate in plies
+        - `None` when the material has no table
+        """
+
+        material = get_material(gs)
+        if material is None:
+            return None
+        name, black_to_move, wk, bk, squares = material
+        if name in self.DRAWN:
+            return DRAW, 0
+        table = self.tables.get(name)
+        if table is None:
+            return None
+
+        value = table.probe_squares(black_to_move, wk, bk, squares)
+        if not value:
+            return DRAW, 0
+        plies = value - 1
+        return (WIN if plies % 2 else LOSS), plies
+
+    def get_best_move(self, gs):
+
+        """
+        the move that wins fastest, loses slowest or keeps the draw, `None` when the position is not covered
+        """
+
+        if self.probe(gs) is None:
+            return None
+        flags = (gs.check_mate, gs.stale_mate, gs.draw_by_repetition)
+        best_move, best_rank = None, None
+        for move in gs.get_valid_moves():
+            gs.make_move(move)
+            child = self.probe(gs)
+            gs.undo_move()
+            if child is None:
+                continue
+            result, plies = child
+            # rank from the mover's side: quick wins first, then draws, then slow losses
+            rank = 1000 - plies if result == LOSS else (plies - 1000 if result == WIN else 0)
+            if best_rank is None or rank > best_rank:
+                best_move, best_rank = move, rank
+        gs.check_mate, gs.stale_mate, gs.draw_by_repetition = flags
+        return best_move
+
+
+def verify(tablebases, name, samples=1000, rng=None):
+
+    """
+    check sampled positions of a table against GameState move generation, returns a list of failures
+    - a win must have a move to a loss one ply shorter, a loss must have only moves to wins, the longest one
+      ply shorter, and a draw must have no move to a loss and some move that is not a win
+    """
+
+    rng = rng or random.Random(0)
+    layout = TableLayout(name)
+    failures = []
+    gs = GameState()
+    checked = 0
+    while checked < samples:
+        black_to_move, wk, bk, squares = layout.decode(rng.randrange(layout.size))
+        occ = 1 << wk
+        for sq in squares:
+            occ |= 1 << sq
+        if len({wk, bk, *squares}) != len(squares) + 2 or KING_DISTANCE[wk][bk] <= 1 or \
+                (not black_to_move and attacked(bk, wk, layout.pieces, squares, occ)):
+            continue  # not a legal position
+        checked += 1
+
+        board = [["--"] * 8 for _ in range(8)]
+        board[wk >> 3][wk & 7] = 'wK'
+        board[bk >> 3][bk & 7] = 'bK'
+        for piece, sq in zip(layout.pieces, squares):
+            board[sq >> 3][sq & 7] = 'w' + piece
+        gs.set_position(board, not black_to_move, CastlingRights(False, False, False, False), ())
+
+        result, plies = tablebases.probe(gs)
+        children = []
+        for move in gs.get_valid_moves():
+            gs.make_move(move)
+            children.append(tablebases.probe(gs))
+            gs.undo_move()
+        if not children:
+            ok = (result, plies) == ((LOSS, 0) if gs.check_mate else (DRAW, 0))
+        elif result == WIN:
+            ok = (LOSS, plies - 1) in children
+        elif result == LOSS:
+            ok = all(child is not None and child[0] == WIN for child in children) and \
+                max(child[1] for child in children) == plies - 1
+        else:
+            ok = all(child is None or child[0] != LOSS for child in children) and \
+                any(child is None or child[0] != WIN for child in children)
+        if not ok:
+            failures.append((gs.get_fen(), result, plies))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="generate and probe endgame tablebases")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = commands.add_parser('generate', help="build tables, the ones they depend on first")
+    generate_parser.add_argument('names', nargs='*', default=list(MATERIAL))
+    generate_parser.add_argument('--workers', type=int, default=1, help="processes, 0 for the cpu count")
+    generate_parser.add_argument('--verbose', action='store_true')
+
+    probe = commands.add_parser('probe', help="result, distance to mate and best move of a position")
+    probe.add_argument('fen')
+
+    check = commands.add_parser('verify', help="check sampled positions against the engine's move generation")
+    check.add_argument('names', nargs='*', default=list(MATERIAL))
+    check.add_argument('--samples', type=int, default=1000)
+
+    for command in (generate_parser, probe, check):
+        command.add_argument('--dir', default='tablebases')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        os.makedirs(args.dir, exist_ok=True)
+        names = []
+        for name in args.names:
+            for dependency in DEPENDENCIES.get(name, ()):
+                if dependency not in names and not os.path.exists(os.path.join(args.dir, dependency + '.tb')):
+                    names.append(dependency)
+            if name not in names:
+                names.append(name)
+        for name in names:
+            stats = generate(name, args.dir, args.workers, log=print if args.verbose else None)
+            print("%-5s %9d positions, %d bits each, %9d bytes, %8d wins %8d losses, longest mate %d plies, "
+                  "%.1fs" % (name, stats['entries'], stats['bits'], stats['bytes'], stats['wins'], stats['losses'],
+                             stats['longest mate'], stats['seconds']))
+        return 0
+
+    tablebases = Tablebases(args.dir)
+    try:
+        if args.command == 'probe':
+            gs = GameState(args.fen)
+            found = tablebases.probe(gs)
+            if found is None:
+                print("no table for this position")
+                return 1
+            result, plies = found
+            best_move = tablebases.get_best_move(gs)
+            print("%s in %d plies, best move %s" % (RESULT_NAMES[result], plies,
+                                                   best_move.get_chess_notation() if best_move else '(none)'))
+            return 0
+
+        failed = 0
+        for name in args.names:
+            if name not in tablebases.tables:
+                print("%s: not generated" % name)
+                failed += 1
+                continue
+            failures = verify(tablebases, name, args.samples)
+            print("%s: %d of %d sampled positions inconsistent" % (name, len(failures), args.samples))
+            for fen, result, plies in failures[:10]:
+                print("  %s %s %d" % (fen, RESULT_NAMES[result], plies))
+            failed += bool(failures)
+        return 1 if failed else 0
+    finally:
+        tablebases.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+"""
+File chessworker.py from project Project_Chess_Game
+
+"""
+
+
+# Engine worker for the GUI: valid moves, engine moves and pondering are computed in a separate process fed through
+# queues, so the pygame loop only polls for results and keeps its frame rate while the engine thinks.
+# Every request starts a new generation, which cancels whatever the worker was doing and drops stale replies
+
+
+import multiprocessing
+import queue
+
+from src.chessengine import GameState, Move, MoveIndex, TranspositionTable
+from src import chesssearch
+
+# pondering stops this many plies beyond the engine's search depth or after this many seconds, so a human who
+# leaves the window open does not keep a core busy forever
+PONDER_EXTRA_DEPTH = 2
+PONDER_TIME_LIMIT = 60.0
+
+
+def _get_moves(gs):
+
+    """
+    `(move codes, (check_mate, stale_mate, draw_by_repetition))` of a position
+    """
+
+    moves = gs.get_valid_moves()
+    return [move.code for move in moves], (gs.check_mate, gs.stale_mate, gs.draw_by_repetition)
+
+
+def _engine_process(requests, replies, generation, tt_mb):
+
+    """
+    worker loop, every request is `(kind, generation, snapshot, ...)`
+    - one transposition table is kept across requests, so pondering warms it up for the search that follows
+    - replies: `('moves', generation, codes, flags)` and `('bestmove', generation, code, codes, flags)`, the codes
+      and flags of a bestmove are those of the position after it
+    """
+
+    tt = TranspositionTable(tt_mb)
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        kind, request_generation, snapshot = request[:3]
+        if request_generation != generation.value:
+            continue  # cancelled before it started
+
+        def cancelled():
+            return generation.value != request_generation
+
+        gs = GameState.from_snapshot(snapshot)
+        if kind == 'moves':
+            replies.put(('moves', request_generation) + _get_moves(gs))
+
+        elif kind == 'search':
+            depth, time_limit = request[3:]
+            result = chesssearch.Search(gs, tt).search(max_depth=depth, time_limit=time_limit, should_stop=cancelled)
+            if cancelled():
+                continue
+            if result.best_move is None:  # game over, the GUI still needs the flags
+                replies.put(('moves', request_generation) + _get_moves(gs))
+                continue
+            gs.make_move(result.best_move)
+            replies.put(('bestmove', request_generation, result.best_move.code) + _get_moves(gs))
+
+        elif kind == 'ponder':  # search the human's position until their move cancels it or the cap is reached
+            depth, time_limit = request[3:]
+            chesssearch.Search(gs, tt).search(max_depth=depth, time_limit=time_limit, should_stop=cancelled)
+
+
+def decode_moves(codes, board):
+
+    """
+    MoveIndex of the move codes of a reply, `board` is the position they were generated in
+    """
+
+    return MoveIndex([Move.from_code(code, board) for code in codes])
+
+
+class EngineWorker:
+    """
+    GUI side of the worker process
+    - requests return at once, replies are collected with `poll()` from the game loop
+    - a new request or `cancel()` stops the running one, only replies to the latest request are returned
+    - the process is spawned, not forked, so it does not inherit the pygame display
+    """
+
+    def __init__(self, depth=4, time_limit=2.0, tt_mb=32):
+        context = multiprocessing.get_context('spawn')
+        self.depth = depth
+        self.time_limit = time_limit
+        self.requests = context.Queue()
+        self.replies = context.Queue()
+        self.generation = context.RawValue('i', 0)  # only written here, read by the worker
+        self.process = context.Process(target=_engine_process, name='engine worker', daemon=True,
+                                       args=(self.requests, self.replies, self.generation, tt_mb))
+        self.process.start()
+
+    def send(self, kind, gs, *args):
+        self.cancel()
+        self.requests.put((kind, self.generation.value, gs.snapshot()) + args)
+
+    def request_moves(self, gs):
+        self.send('moves', gs)
+
+    def request_move(self, gs):
+        self.send('search', gs, self.depth, self.time_limit)
+
+    def ponder(self, gs):
+        self.send('ponder', gs, self.depth + PONDER_EXTRA_DEPTH, PONDER_TIME_LIMIT)
+
+    def cancel(self):
+        self.generation.value += 1
+
+    def poll(self):
+
+        """
+        replies to the current request that have arrived, without blocking
+        """
+
+        replies = []
+        while True:
+            try:
+                reply = self.replies.get_nowait()
+            except queue.Empty:
+                return replies
+            if reply[1] == self.generation.value:
+                replies.append((reply[0],) + reply[2:])
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
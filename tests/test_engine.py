@@ -0,0 +1,134 @@
+"""
+File test_engine.py from project Project_Chess_Game
+
+"""
+
+
+# Regression tests for both GameState backends: incremental state over random games, shallow perft counts, game
+# status detection, SAN round trips and the Polyglot reference keys. Run from the repository root with
+# `python -m pytest -q`
+
+
+import random
+
+import pytest
+
+from src import chessbook, chessevaluation, chesspgn, chessperft
+from src.chessengine import GameState
+from src.chessbitboard import BitboardGameState
+
+BACKENDS = [GameState, BitboardGameState]
+
+# perft depth checked for every reference position, deeper counts are left to `chessperft --suite`
+PERFT_DEPTH = 3
+
+FENS = [(name, fen) for name, fen, _ in chessperft.REFERENCE_POSITIONS]
+
+# positions and keys from the Polyglot book format specification
+POLYGLOT_VECTORS = [
+    ([], 0x463b96181691fc9c),
+    (['e2e4'], 0x823c9b50fd114196),
+    (['e2e4', 'd7d5'], 0x0756b94461c50fb0),
+    (['e2e4', 'd7d5', 'e4e5'], 0x662fafb965db29d4),
+    (['e2e4', 'd7d5', 'e4e5', 'f7f5'], 0x22a48b5a8e47ff78),
+    (['e2e4', 'd7d5', 'e4e5', 'f7f5', 'e1e2'], 0x652a607ca3f242c1),
+    (['e2e4', 'd7d5', 'e4e5', 'f7f5', 'e1e2', 'e8f7'], 0x00fdd303c946bdd9),
+    (['a2a4', 'b7b5', 'h2h4', 'b5b4', 'c2c4'], 0x3c8123ea7b067637),
+    (['a2a4', 'b7b5', 'h2h4', 'b5b4', 'c2c4', 'b4c3', 'a1a3'], 0x5c3f9b829b279560),
+]
+
+
+def play(gs, notation):
+    move = next(move for move in gs.get_valid_moves() if move.get_chess_notation() == notation)
+    gs.make_move(move)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('name, fen', FENS)
+def test_incremental_evaluation(backend, name, fen):
+    gs = backend(fen)
+    assert chessevaluation.verify_incremental(gs, games=3, plies=100, rng=random.Random(name)) > 0
+    assert gs.get_fen() == backend(fen).get_fen()
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('name, fen', FENS)
+def test_incremental_keys(backend, name, fen):
+    rng = random.Random(name)
+    gs = backend(fen)
+    start_key = gs.zobrist_key
+    for _ in range(100):
+        moves = gs.get_valid_moves()
+        if not moves:
+            break
+        before = gs.get_fen()
+        gs.make_move(rng.choice(moves))
+        assert gs.zobrist_key == gs.compute_zobrist_key()
+        if rng.random() < 0.2:
+            gs.undo_move()
+            assert gs.get_fen() == before
+            assert gs.zobrist_key == gs.compute_zobrist_key()
+
+    while gs.movelog:
+        gs.undo_move()
+    assert gs.zobrist_key == start_key
+    assert gs.key_counts == {start_key: 1}
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('name, fen, counts', [entry for entry in chessperft.REFERENCE_POSITIONS
+                                               if min(entry[2]) <= PERFT_DEPTH])
+def test_perft(backend, name, fen, counts):
+    gs = backend(fen)
+    for depth in sorted(counts):
+        if depth <= PERFT_DEPTH:
+            assert chessperft.perft(gs, depth) == counts[depth], "%s depth %d" % (name, depth)
+    assert gs.get_fen() == backend(fen).get_fen()
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('name, fen, expected', chessperft.STATUS_POSITIONS)
+def test_status(backend, name, fen, expected):
+    assert backend(fen).get_status() == expected
+
+
+@pytest.mark.parametrize('name, fen', FENS)
+def test_san_round_trip(name, fen):
+    rng = random.Random(name)
+    gs = GameState(fen)
+    for _ in range(3):
+        for _ in range(80):
+            moves = gs.get_valid_moves()
+            if not moves:
+                break
+            for move in moves:
+                san = chesspgn.get_san(gs, move, moves)
+                assert chesspgn.parse_san(gs, san, moves) is move, san
+            gs.make_move(rng.choice(moves))
+        while gs.movelog:
+            gs.undo_move()
+
+
+def test_san_notation():
+    gs = GameState("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+    moves = gs.get_valid_moves()
+    sans = {chesspgn.get_san(gs, move, moves) for move in moves}
+    assert {'O-O', 'O-O-O', 'Qxf6', 'Nxf7', 'dxe6', 'Bxa6', 'Nc6', 'gxh3'} <= sans
+
+    gs = GameState("8/8/4k3/8/R7/8/1K6/R6R w - - 0 1")
+    moves = gs.get_valid_moves()
+    sans = {chesspgn.get_san(gs, move, moves) for move in moves}
+    assert {'Rad1', 'Rhd1', 'R1a2', 'R4a2', 'Rb4'} <= sans
+    assert 'Rd1' not in sans
+
+    gs = GameState("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1")
+    assert chesspgn.get_san(gs, chesspgn.parse_san(gs, 'Ra8')) == 'Ra8#'
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('moves, key', POLYGLOT_VECTORS)
+def test_polyglot_key(backend, moves, key):
+    gs = backend()
+    for notation in moves:
+        play(gs, notation)
+    assert chessbook.POLYGLOT_KEY(gs) == key